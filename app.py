@@ -8,16 +8,29 @@ import logging
 import numpy as np
 import os
 from bokeh.models import Div
-from backend_handler import UserInputData, run_program
+from backend_handler import (UserInputData, run_program, prefetch_stations,
+                             get_sheet_split_messages)
 from back_end.api_counter import (InternalServerError,
                                   NetatmoGeneralError, NoActiveTokenError,
-                                  NoApiCallsLeftError, InvalidInputError)
-from bokeh.models import ColumnDataSource, WheelZoomTool
+                                  NoApiCallsLeftError, InvalidInputError,
+                                  JobCancelledError, NoDataInStationError)
+from bokeh.models import (ColumnDataSource, WheelZoomTool, PolyDrawTool,
+                          HoverTool)
 from bokeh.plotting import figure
 from bokeh.tile_providers import get_provider, Vendors
 from bokeh.models import ImageURL
 import math
 import base64
+import threading
+from functools import partial
+import json
+import html
+from back_end.running_program_data import CancellationToken, JobMetrics
+from back_end import polygons
+from back_end.export import OUTPUT_FORMATS, VIEWS, DEFAULT_VIEWS
+from back_end.data_processing import EVENT_DRY_TIME
+from back_end.download import create_download_url
+from back_end.station_index import station_index
 # Set the Panel extension
 pn.extension('mathjax')
 
@@ -42,6 +55,8 @@ def web_mercator_to_wgs84(x, y):
 
 # Add interaction
 def update_plot(event):
+    if area_input.value == 'Polygon':
+        return
     x, y = event.x, event.y
     source.data = dict(x=[x], y=[y])
     #image_source.data = dict(url=[url], x=[x], y=[y])
@@ -49,16 +64,171 @@ def update_plot(event):
     latitude_input.value = str(lat)
     longitude_input.value = str(lon)
     #print(f"Clicked location: {lon}, {lat}")
+    start_prefetch(lat, lon)
+
+def start_prefetch(latitude, longitude):
+    # Stations around the clicked point are looked up and probed while the
+    # user fills in the rest of the form
+    if prefetch["cancel_token"] is not None:
+        prefetch["cancel_token"].cancel()
+    prefetch.update(cancel_token=None, key=None, candidates=None,
+                    metrics=None)
+    candidate_source.data = dict(x=[], y=[], name=[])
+
+    if not auth_input.value or running_job["cancel_token"] is not None:
+        return
+    try:
+        input_data = UserInputData(
+            auth_token=auth_input.value,
+            latitude=latitude,
+            longitude=longitude,
+            date_begin=start_date_input.value.strftime('%Y-%m-%d'),
+            date_end=end_date_input.value.strftime('%Y-%m-%d'),
+            scale=time_input.value,
+            station_amount=int(amount_input.value),
+            path=''
+        )
+    except (KeyError, ValueError, TypeError, AttributeError) as e:
+        print(e)
+        return
+
+    cancel_token = CancellationToken()
+    prefetch["cancel_token"] = cancel_token
+    # Devices skipped while looking up the stations are reported by the job
+    metrics = JobMetrics()
+    prefetch_thread = threading.Thread(
+        target=run_prefetch,
+        args=(input_data, cancel_token, pn.state.curdoc, metrics),
+        daemon=True)
+    prefetch_thread.start()
+
+def run_prefetch(input_data, cancel_token, doc, metrics):
+    try:
+        candidates = prefetch_stations(input_data, cancel_token=cancel_token,
+                                       metrics=metrics)
+    except Exception as e:
+        # The job looks the stations up again and reports the error
+        print("Prefetch failed:", e)
+        return
+
+    if not cancel_token.cancelled:
+        doc.add_next_tick_callback(partial(
+            show_candidates, input_data, candidates, cancel_token, metrics))
+
+def show_candidates(input_data, candidates, cancel_token, metrics):
+    if prefetch["cancel_token"] is not cancel_token:
+        return
+
+    prefetch["key"] = (input_data.latitude, input_data.longitude,
+                       input_data.date_begin, input_data.date_end)
+    prefetch["amount"] = input_data.station_amount
+    prefetch["candidates"] = candidates
+    prefetch["metrics"] = metrics
+    points = [wgs84_to_web_mercator(lon, lat) for lat, lon
+              in zip(candidates.latitudes, candidates.longitudes)]
+    candidate_source.data = dict(x=[x for x, _ in points],
+                                 y=[y for _, y in points],
+                                 name=list(candidates.names))
+
+def get_prefetched_candidates(input_data):
+    key = (input_data.latitude, input_data.longitude,
+           input_data.date_begin, input_data.date_end)
+    if input_data.polygons is None and prefetch["key"] == key \
+            and prefetch["amount"] >= input_data.station_amount:
+        return prefetch["candidates"]
+    return None
+
+def load_geojson(event):
+    error_div.text = ""
+    try:
+        uploaded_polygons = polygons.read_geojson_polygons(
+            json.loads(event.new.decode("utf-8")))
+    except (ValueError, KeyError, IndexError, InvalidInputError) as e:
+        print(e)
+        error_div.text = '<div style="color:red; border: 1px solid red; padding: 5px;">Kunde inte läsa GeoJSON-filen</div>'
+        return
+
+    # Only the outer borders are shown on the map
+    xs, ys = [], []
+    for polygon in uploaded_polygons:
+        points = [wgs84_to_web_mercator(lon, lat) for lon, lat in polygon[0]]
+        xs.append([x for x, _ in points])
+        ys.append([y for _, y in points])
+    polygon_source.data = dict(xs=xs, ys=ys)
+    selected_area["polygons"] = uploaded_polygons
+    area_input.value = 'Polygon'
+    update_sheet_plan()
+
+def polygon_drawn(attr, old, new):
+    # A polygon drawn on the map replaces an uploaded file
+    selected_area["polygons"] = None
+    update_sheet_plan()
+
+def clear_polygon(event):
+    polygon_source.data = dict(xs=[], ys=[])
+    selected_area["polygons"] = None
+    update_sheet_plan()
+
+def get_selected_polygons():
+    if selected_area["polygons"] is not None:
+        return selected_area["polygons"]
+
+    drawn_polygons = []
+    for xs, ys in zip(polygon_source.data['xs'], polygon_source.data['ys']):
+        if len(xs) < 3:
+            continue
+        points = [web_mercator_to_wgs84(x, y) for x, y in zip(xs, ys)]
+        drawn_polygons.append([np.array(points, dtype=float)])
+
+    return drawn_polygons or None
+
+def update_sheet_plan(event=None):
+    # Views too large for one Excel sheet are known before the job starts
+    try:
+        if area_input.value == 'Polygon':
+            area_polygons = get_selected_polygons()
+            # Only the stations already known in the area are counted
+            station_count = 0 if area_polygons is None \
+                else len(station_index.within_polygons(area_polygons))
+        else:
+            station_count = int(amount_input.value)
+        input_data = UserInputData(
+            auth_token='',
+            latitude=0,
+            longitude=0,
+            date_begin=start_date_input.value.strftime('%Y-%m-%d'),
+            date_end=end_date_input.value.strftime('%Y-%m-%d'),
+            scale=time_input.value,
+            station_amount=station_count,
+            path='',
+            output_format=format_input.value,
+            views=views_input.value,
+            dry_hours=int(dry_hours_input.value)
+        )
+        input_data.convert_scale_to_api_format()
+        messages = get_sheet_split_messages(input_data, station_count)
+    except (KeyError, ValueError, TypeError, AttributeError,
+            InvalidInputError) as e:
+        print(e)
+        messages = []
+
+    if messages:
+        sheet_plan_div.text = ('<div style="color:orange; border: 1px solid orange; padding: 5px;">'
+                               + "<br>".join(html.escape(message)
+                                             for message in messages)
+                               + '</div>')
+    else:
+        sheet_plan_div.text = ""
 
 def load_display(x):
     if x == 'on':
         loading.value = True
         loading.visible = True
-        loading.name = "Hämtar stationer..."
+        job_status.text = "Hämtar stationer..."
     if x == 'off':
         loading.value = False
         loading.visible = False
-        loading.name = ""
+        job_status.text = ""
 # Define the submit button and its callback
 
 def show_modal(event):
@@ -75,8 +245,19 @@ def submit(event):
         auth_token = auth_input.value
         start_date = start_date_input.value.strftime('%Y-%m-%d')
         end_date = end_date_input.value.strftime('%Y-%m-%d')
-        latitude = float(latitude_input.value)
-        longitude = float(longitude_input.value)
+        area_polygons = None
+        if area_input.value == 'Polygon':
+            area_polygons = get_selected_polygons()
+            if area_polygons is None:
+                raise ValueError("Inget område valt")
+            # The center of the area is used as reference point
+            latitude_ne, longitude_ne, latitude_sw, longitude_sw = \
+                polygons.polygon_bounds(area_polygons)
+            latitude = (latitude_ne + latitude_sw) / 2
+            longitude = (longitude_ne + longitude_sw) / 2
+        else:
+            latitude = float(latitude_input.value)
+            longitude = float(longitude_input.value)
         amount = int(amount_input.value)
         time_resolution = time_input.value
 
@@ -97,23 +278,94 @@ def submit(event):
             date_end=end_date,
             scale=time_resolution,
             station_amount=amount,
-            path=''
+            path='',
+            polygons=area_polygons,
+            output_format=format_input.value,
+            views=views_input.value,
+            dry_hours=int(dry_hours_input.value),
+            exclude_flagged=exclude_flagged_input.value
         )
 
     except (KeyError, ValueError) as e:
         error_message = f"Felaktig input, dubbelkolla att alla fält är rätt inskrivna"
+        if area_input.value == 'Polygon':
+            error_message += ", rita ett område på kartan eller ladda upp en GeoJSON-fil"
         print(e)
         error_div.text = f'<div style="color:red; border: 1px solid red; padding: 5px;">{error_message}</div>'
         load_display("off")
         return
 
+    candidates = get_prefetched_candidates(input_data)
+    metrics = prefetch["metrics"] if candidates is not None else None
+    if prefetch["cancel_token"] is not None and candidates is None:
+        # The prefetch is for another point or still running, what it has
+        # fetched so far is cached for the job
+        prefetch["cancel_token"].cancel()
+
+    job_notes.text = ""
+
+    cancel_token = CancellationToken()
+    running_job["cancel_token"] = cancel_token
+    submit_button.disabled = True
+    cancel_button.visible = True
+    # Run the job in a background thread so the session can still handle
+    # events, for example a click on the cancel button
+    job_thread = threading.Thread(
+        target=run_job,
+        args=(input_data, cancel_token, pn.state.curdoc, candidates, metrics),
+        daemon=True)
+    job_thread.start()
+
+def cancel(event):
+    cancel_token = running_job["cancel_token"]
+    if cancel_token is not None:
+        cancel_token.cancel()
+        job_status.text = "Avbryter..."
+
+class JobGui:
+    """
+    Shows the events of a running job in the session.
+
+    The backend puts ("message", text), ("progress", percent) and
+    ("notice", text) events on event_queue from the job thread, they are
+    shown on the session's own thread. Messages tell what the job is doing,
+    notices stay visible when the job is done.
+    """
+
+    def __init__(self, doc):
+        self.doc = doc
+        # The backend only puts events, so the gui is its own queue
+        self.event_queue = self
+        self.message = ""
+        self.progress = 0
+        self.notices = []
+
+    def put(self, event):
+        self.doc.add_next_tick_callback(partial(show_job_event, self, *event))
+
+def show_job_event(gui, kind, value):
+    if kind == "message":
+        gui.message = " ".join(str(value).split())
+    elif kind == "progress":
+        gui.progress = min(gui.progress + int(value), 100)
+    elif kind == "notice":
+        gui.notices.append(html.escape(" ".join(str(value).split())))
+        job_notes.text = '<div style="border: 1px solid gray; padding: 5px;">' \
+            + "<br>".join(gui.notices) + '</div>'
+
+    # The cancel button shows that the job is being cancelled
+    if running_job["cancel_token"] is not None \
+            and not running_job["cancel_token"].cancelled:
+        job_status.text = html.escape(f"{gui.message} ({gui.progress} %)")
+
+def run_job(input_data, cancel_token, doc, candidates=None, metrics=None):
+    error_message = ""
+    output_file = None
     try:
         # Run the backend function
-        output_file = run_program(input_data)
-
-        file_download_button.file = output_file
-        file_download_button.filename = os.path.basename(output_file)
-        file_download_button.visible = True
+        output_file = run_program(input_data, gui=JobGui(doc),
+                                  cancel_token=cancel_token,
+                                  candidates=candidates, metrics=metrics)
     except KeyError as e:
         error_message = f"KeyError <br> {e}"
         print(error_message)
@@ -142,17 +394,44 @@ def submit(event):
     except InvalidInputError as e:
         error_message = f"Felaktig input: {e}"
         print(str(e))
-        
+
+    except JobCancelledError as e:
+        error_message = "Jobbet avbröts innan någon data hämtades"
+        print(str(e))
+
+    except NoDataInStationError as e:
+        error_message = "Inga stationer hittades i det valda området"
+        print(str(e))
+
     except Exception as e:
         error_message = f"Ospecificerat fel <br> Felmeddelande: {e}"
         print(e)
-    
+
+    # Widgets are updated on the session's own thread
+    doc.add_next_tick_callback(partial(
+        finish_job, output_file, error_message, cancel_token.cancelled))
+
+def finish_job(output_file, error_message, cancelled):
+    running_job["cancel_token"] = None
+    submit_button.disabled = False
+    cancel_button.visible = False
+    load_display("off")
+
+    if output_file is not None:
+        # The file is downloaded over HTTP from the download handler, not
+        # through the websocket of the session
+        download_link.object = (
+            f'<a href="{create_download_url(output_file)}" download '
+            f'class="btn btn-success">Ladda ner '
+            f'{html.escape(os.path.basename(output_file))}</a>')
+        download_link.visible = True
+
     if error_message:
-        load_display("off")
         error_div.text = f'<div style="color:red; border: 1px solid red; padding: 5px;">{error_message}</div>'
+    elif cancelled:
+        error_div.text = '<div style="color:orange; border: 1px solid orange; padding: 5px;">Jobbet avbröts, filen innehåller den data som hann hämtas</div>'
     else:
         error_div.text = ""
-        load_display("off")
 # Center the map around the specified coordinates
 center_lon, center_lat = 11.974559999999997, 57.70887
 x_center, y_center = wgs84_to_web_mercator(center_lon, center_lat)
@@ -178,6 +457,24 @@ p.circle(x='x', y='y', size=10, color='red', alpha=0.8, source=source)
 
 p.on_event('tap', update_plot)
 
+# Candidate stations found by the prefetch when the map is clicked
+candidate_source = ColumnDataSource(data=dict(x=[], y=[], name=[]))
+candidate_renderer = p.scatter(x='x', y='y', size=7, color='gray', alpha=0.8,
+                               source=candidate_source)
+p.add_tools(HoverTool(renderers=[candidate_renderer],
+                      tooltips=[("Station", "@name")]))
+prefetch = {"cancel_token": None, "key": None, "amount": 0,
+            "candidates": None, "metrics": None}
+
+# Polygons drawn on the map or uploaded as GeoJSON
+polygon_source = ColumnDataSource(data=dict(xs=[], ys=[]))
+polygon_renderer = p.patches('xs', 'ys', source=polygon_source, fill_alpha=0.2,
+                             line_color='blue', fill_color='blue')
+polygon_draw_tool = PolyDrawTool(renderers=[polygon_renderer])
+p.add_tools(polygon_draw_tool)
+polygon_source.on_change('data', polygon_drawn)
+selected_area = {"polygons": None}
+
 # Enable wheel zoom tool and set it as the active scroll tool
 wheel_zoom = WheelZoomTool()
 p.add_tools(wheel_zoom)
@@ -195,26 +492,45 @@ end_date_input = pn.widgets.DatePicker(name='Slutdatum', value=end_date, start=d
 latitude_input = pn.widgets.TextInput(name='Latitud', value='', width=300)
 longitude_input = pn.widgets.TextInput(name='Longitud', value='', width=300)
 
+area_input = pn.widgets.RadioButtonGroup(name='Område', options=['Punkt', 'Polygon'], value='Punkt')
+geojson_input = pn.widgets.FileInput(accept='.geojson,.json')
+geojson_input.param.watch(load_geojson, 'value')
+clear_polygon_button = pn.widgets.Button(name='Rensa område')
+clear_polygon_button.on_click(clear_polygon)
+area_info = pn.pane.HTML('Polygon: rita området med polygonverktyget på kartan eller ladda upp en GeoJSON-fil, alla stationer i området hämtas', sizing_mode='stretch_width')
+
 amount_input = pn.widgets.IntInput(name='Antal stationer', value=1, step=1, start=1)
 time_input = pn.widgets.Select(name='Upplösning', options=['30 min', '1 timme', '3 timmar', '1 dag', '1 vecka', '1 månad'])
+format_input = pn.widgets.Select(name='Filformat', options=list(OUTPUT_FORMATS), value='Excel')
+views_input = pn.widgets.CheckButtonGroup(name='Datavyer', options=list(VIEWS), value=list(DEFAULT_VIEWS))
+dry_hours_input = pn.widgets.IntInput(name='Torrperiod mellan regnhändelser [h]', value=EVENT_DRY_TIME // 3600, step=1, start=1)
+exclude_flagged_input = pn.widgets.Checkbox(name='Utelämna flaggade värden från medianen', value=False)
+# Views that will be split on several Excel sheets
+sheet_plan_div = Div(text="")
+for plan_input in (start_date_input, end_date_input, area_input, amount_input,
+                   time_input, format_input, views_input, dry_hours_input):
+    plan_input.param.watch(update_sheet_plan, 'value')
+update_sheet_plan()
 
 submit_button = pn.widgets.Button(name='Hämta data', button_type='primary')
 submit_button.on_click(submit)
+cancel_button = pn.widgets.Button(name='Avbryt', button_type='danger', visible=False)
+cancel_button.on_click(cancel)
+running_job = {"cancel_token": None}
 error_div = Div(text="") # add margins
+# Notices of the last job, such as stations without data
+job_notes = Div(text="")
 #error_div.text = "Fungerar detta" 
-# Download button (initially invisible)
-file_download_button = pn.widgets.FileDownload(
-    auto=True, 
-    button_type='success', 
-    embed=False,
-    visible=False
-)
+# Download link (initially invisible)
+download_link = pn.pane.HTML("", visible=False)
 
 info_message = "0"
 download_message = Div(text="") 
 
 info_box = None # se till att detta är en förklaring till hur man laddar ner nyckeln
 loading = pn.indicators.LoadingSpinner(value=False, width=50, height=50,visible=False)
+# What the running job is doing, the name of the spinner is constant
+job_status = Div(text="")
 
 info_button = pn.widgets.Button(name='🛈', width=15, margin=1, align=('start', 'center'), button_type="default", button_style='outline')
 info_button.on_click(show_modal)
@@ -225,6 +541,14 @@ Appen hämtar öppet tillgänglig regndata från Netatmo från deras regnmätare
 
 Appen fungerar genom att välja en punkt på kartan och antal regnmätare att hämta, vilken upplösning datan ska ha och perioden då data ska hämtas. Programmet hämtar de X antal närmaste mätarna runt den angivna punken, där antal stationer väljs av användaren. 
 
+Välj vilka datavyer filen ska innehålla, färre vyer ger en mindre fil som skapas snabbare. Vyn "Intensitet" ger det största regnet under 30 min, 1, 3, 6, 12 och 24 timmar för varje station och för medianvärdet, fönster med luckor i datan räknas inte med. Vyn "Regnhändelser" delar upp regnet i händelser som skiljs åt av minst den valda torrperioden och ger regnmängd, varaktighet och max intensitet för varje händelse. 
+
+Vyn "Kvalitetskontroll" visar för varje station hur många värden som flaggats som felaktiga: värden som avviker mycket från de andra stationerna vid samma tidpunkt, samma regnvärde många gånger i rad (fastnad mätare) och inget regn när de andra stationerna har regn. Kryssa i "Utelämna flaggade värden från medianen" för att räkna medianen utan de flaggade värdena, i alla vyer med median. 
+
+Välj filformat för att få datan i annat format än excel. Parquet, Feather och CSV ger en zip-fil med en fil per datavy, NetCDF ger en fil med regnvärden och median per station och tidssteg. Dessa format är mindre och går snabbare att läsa in i till exempel pandas eller GIS-program. 
+
+Välj "Polygon" för att i stället hämta alla mätare inom ett område, till exempel en kommun eller ett avrinningsområde. Området ritas med polygonverktyget på kartan (dubbelklicka för att börja och avsluta) eller laddas upp som en GeoJSON-fil. 
+
 ## Tokennyckel
 För att kunna hämta data automatiskt behöver man en ”Access token”, vilket är en kod för att kunna identifiera en användare för webbplatsen. Nedan beskrivs hur man skapar en ”Access token” för Netatmo.
 
@@ -251,14 +575,20 @@ def my_panel_app():
             pn.Row(start_date_input, end_date_input),
             pn.Row(latitude_input, longitude_input),
             info2,
-            pn.Row(amount_input, time_input),
+            pn.Row(area_input, geojson_input, clear_polygon_button),
+            area_info,
+            pn.Row(amount_input, time_input, format_input),
+            sheet_plan_div,
+            pn.Row(views_input, dry_hours_input),
+            exclude_flagged_input,
             download_message,
-            pn.Row(submit_button),
-            loading,
+            pn.Row(submit_button, cancel_button),
+            pn.Row(loading, job_status),
             error_div,
+            job_notes,
             width=700)
         , p, width=1400),
-        file_download_button)
+        download_link)
     ui.main.append(final_layout)
     ui.servable()
 
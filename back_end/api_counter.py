@@ -40,6 +40,12 @@ class MaxApiCallReachedError(Exception):
     pass
 
 
+class JobCancelledError(Exception):
+    """
+    Error when a running job has been cancelled by the user
+    """
+
+
 class ApiCounter:
     def __init__(self, max_calls):
         self.call_count = 0
@@ -4,479 +4,655 @@ Created on Thu Jul 13 11:54:19 2023
 
 @author: tagtyk0616
 """
-from datetime import datetime
+import queue
+import threading
 import numpy as np
-import pandas as pd
-from tqdm import tqdm
 from back_end import rain_data
 from back_end.api_counter import (InternalServerError, NoDataInStationError,
                                   NetatmoGeneralError, NoActiveTokenError,
-                                  NoApiCallsLeftError, InvalidInputError)
+                                  NoApiCallsLeftError, InvalidInputError,
+                                  JobCancelledError)
 # from api_counter import api_counter
 # from api_counter import MaxApiCallReachedError
 
-
-def quickselect_median(lst):
+TIME_STEP = 900  # Time steps that station data is aligned to, seconds
+TIME_STEP_TOLERANCE = 449  # 15 min both ways
+# Windows that the most rain is calculated for, seconds
+INTENSITY_WINDOWS = {"30 min": 1800,
+                     "1 h": 3600,
+                     "3 h": 3 * 3600,
+                     "6 h": 6 * 3600,
+                     "12 h": 12 * 3600,
+                     "24 h": 24 * 3600}
+EVENT_DRY_TIME = 6 * 3600  # Time without rain between rain events, seconds
+# Quality control flags, one bit each so a value can have several
+QC_OUTLIER = 1  # Far from the other stations
+QC_STUCK = 2  # The same rain many measurements in a row
+QC_DRY = 4  # No rain while the other stations have rain
+QC_MIN_STATIONS = 3  # Stations with data needed to compare a time step
+QC_THRESHOLD = 5  # Spreads from the median a value may be
+QC_MIN_SPREAD = 1.0  # Smallest spread in mm per hour, the MAD is often zero
+QC_WET_MEDIAN = 1.0  # Median rain in mm where no rain is a fault
+QC_STUCK_COUNT = 6  # Equal measurements with rain in a row that are stuck
+
+
+def create_time_step_list(start_stop_list):
     """
-    Quickselect implementation to find median.
+    Create the time steps that station data is aligned to.
 
     Parameters
     ----------
-    lst : list
-        The input lists from which median should be found.
-
-    Raises
-    ------
-    ValueError
-        If empty list or mismatched lengths, raises ValueError.
+    start_stop_list : list
+        List of 2x1 matricies of start, stop value pairs for partitioning data.
 
     Returns
     -------
-    name : str
-        name of median station.
-    median_value : float
-        the median value.
+    time_step_list : numpy array
+        Unix dates with 15 minutes between each time step.
 
     """
-    if len(lst[0]) != len(lst[1]):
-        raise ValueError(
-            "Error in quickselect: Mismatched lengths between names and values")
+    return np.arange(
+        start_stop_list[0][0], start_stop_list[-1][1], TIME_STEP, dtype=np.int64
+    )
 
-    if len(lst[1]) == 0:
-        raise ValueError("Error int quickselect: Empty list provided")
 
-    if len(lst[1]) % 2 == 1:
-        return quickselect(lst, len(lst[1]) // 2)
+def get_station_series(station_data):
+    """
+    Get compact arrays of unix dates and rain values from station data.
 
-    lower_median = quickselect(lst, len(lst[1]) // 2 - 1)
-    upper_median = quickselect(lst, len(lst[1]) // 2)
-    median_value = (float(lower_median[1]) + float(upper_median[1])) / 2
-    # name = f"{lower_median[0].get_name()}, {upper_median[0].get_name()}"
-    name = (lower_median[0], upper_median[0])
-    return name, median_value
+    Parameters
+    ----------
+    station_data : numpy array
+        A numpy array with dates on dimension 0, data on dimension 1 and
+        Unix dates on dimension 2 for input station.
+
+    Returns
+    -------
+    unix : numpy array
+        Unix dates as int64.
+    values : numpy array
+        Rain values as float64.
+
+    """
+    if not np.any(station_data):
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+
+    station_data_array = np.array(station_data)
+    return (station_data_array[2, :].astype(np.int64),
+            station_data_array[1, :].astype(np.float64))
 
 
-def quickselect(lst, k):
+def align_station_series(unix, values, time_step_list):
     """
-    Do recuesive quickselect on list with name and value.
+    Align the data of one station to the time steps.
+
+    Each time step gets the value of the closest measurement, if that
+    measurement is less than 15 minutes away. This accounts for offset
+    data from the stations.
 
     Parameters
     ----------
-    lst : list
-        2 dimensional list with name on dimension 0 and values on dimension 1.
-    k : int
-        Helper variable for quickselect.
+    unix : numpy array
+        Unix dates of the measurements.
+    values : numpy array
+        Rain values of the measurements.
+    time_step_list : numpy array
+        Unix dates of the time steps.
 
     Returns
     -------
-    pivots : list
-        list of [name, value]
+    column : numpy array
+        Rain value for each time step, NaN where the station has no data.
 
     """
-    if len(lst[1]) == 1:
-        return [lst[0][0], lst[1][0]]
-
-    pivot_index = len(lst[1]) // 2
-    pivot = lst[1][pivot_index]
-    lows = [[name, value] for name, value in
-            zip(lst[0], lst[1]) if value < pivot]
-    highs = [[name, value] for name, value in
-             zip(lst[0], lst[1]) if value > pivot]
-    pivots = [[name, value] for name, value in
-              zip(lst[0], lst[1]) if value == pivot]
-    if k < len(lows):
-        return quickselect(list(zip(*lows)), k)
+    column = np.full(len(time_step_list), np.nan)
+    if len(unix) == 0:
+        return column
 
-    if k < len(lows) + len(pivots):
-        if len(pivots) == 1:
-            return pivots[0]
+    order = np.argsort(unix, kind="stable")
+    unix = unix[order]
+    values = values[order]
 
-        return pivots[k - len(lows)]
+    right = np.searchsorted(unix, time_step_list)
+    left = np.clip(right - 1, 0, len(unix) - 1)
+    right = np.clip(right, 0, len(unix) - 1)
+    use_left = np.abs(time_step_list - unix[left]) \
+        <= np.abs(unix[right] - time_step_list)
+    closest = np.where(use_left, left, right)
 
-    return quickselect(list(zip(*highs)), k - len(lows) - len(pivots))
+    matched = np.abs(time_step_list - unix[closest]) < TIME_STEP_TOLERANCE
+    column[matched] = values[closest[matched]]
+    return column
 
 
-def convert_to_unix_from_stations(station_data_list):
+def calculate_median(rain_matrix):
     """
-    Get all unix values from stations and put them in a numpy array.
+    Calculate the median value of the stations for each time step.
+
+    For an even number of stations the median is the mean of the two middle
+    values, and both stations are returned.
 
     Parameters
     ----------
-    station_data_list : list
-        List of numpy arrays with with dates on dimension 0, data on dimension 1 and
-        Unix dates on dimension 2 for input station.
-
-    Raises
-    ------
-    IndexError
-        Error if problem with the shape of station_data_array.
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
 
     Returns
     -------
-    unix_from_stations : numpy array
-        Numpy array containting UNIX date values from input list
+    median_values : numpy array
+        Median value for each time step, NaN where no station has data.
+    lower_station : numpy array
+        Index of the lower median station for each time step.
+    upper_station : numpy array
+        Index of the upper median station for each time step, the same as
+        lower_station for an odd number of stations.
 
     """
-    unix_from_stations = []
-    try:
-        for station_data in station_data_list:
-            station_data_array = np.array(station_data)
-            if np.any(station_data):
-                unix_from_station = station_data_array[2, :]
-                unix_from_station = unix_from_station.astype(int)
-                unix_from_stations.append(unix_from_station)
-            else:
-                unix_from_stations.append([])
-    except IndexError as exc:
-        print(station_data_array)
-        raise IndexError from exc
-
-    unix_from_stations = np.array(unix_from_stations, dtype=object)
-    return unix_from_stations
-
-def find_what_data_each_time_step(station_data_list, station_list,
-                                  unix_from_stations, time_step_list):
-    """
-    Construct a dictionary with rainstations for each time step with data.
+    rows = np.arange(rain_matrix.shape[0])
+    valid_count = np.sum(~np.isnan(rain_matrix), axis=1)
+    # NaN is sorted last, stable sort keeps station order for equal values
+    order = np.argsort(rain_matrix, axis=1, kind="stable")
+    lower_station = order[rows, np.maximum(valid_count - 1, 0) // 2]
+    upper_station = order[rows, valid_count // 2 - (valid_count == 0)]
+
+    median_values = (rain_matrix[rows, lower_station]
+                     + rain_matrix[rows, upper_station]) / 2
+    median_values[valid_count == 0] = np.nan
+    return median_values, lower_station, upper_station
 
-    The function creates a dictionary with time steps as keys and the stations
-    that have data for that time step as values. If no value exists for the
-    time step it is left blank.
 
-    The function checks 15 minutes to the left and right of the time step value
-    in order to account for offset data and adds it to the dictonary.
-    TODO: Should it always be 15 minutes here?
+def calculate_median_series(rain_matrix):
+    """
+    Calculate the median value of the stations for all time steps.
 
     Parameters
     ----------
-    station_data_list : numpy array
-        A numpy array with dates on dimension 0, data on dimension 1 and
-        Unix dates on dimension 2 for input station.
-    station_list : list
-        List of RainStation objects.
-    unix_from_stations : numpy array
-        Numpy array containting UNIX date values from input list
-    time_step_list : list
-        List of unix dates with time steps that is used to check if there
-        is data near those values.
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
 
     Returns
     -------
-    data_dict : dict
-        A dictionary with timesteps as keys and corresponding stations as
-        values.
+    median_series : numpy array
+        Median value for each time step, NaN where no station has data.
 
     """
-    data_dict = {}
-    counter = 0
-    counter2 = 0
-    for time_step in tqdm(time_step_list):
-        for i, unix in enumerate(unix_from_stations):
-            try:
-                j = (np.abs(unix[:] - time_step)).argmin()
-                if (np.abs(time_step - int(station_data_list[i][2, j]))) < 449:
-                    # 15 min both ways
-                    if time_step in data_dict:
-                        if np.abs(time_step - int(station_data_list[i][2, j])) != 0:
-                            print("Nu blev det fel, 0 förväntades men fick:",
-                                  (time_step - int(station_data_list[i][2, j])))
-                        data_dict[time_step].append(
-                            [station_list[i],
-                             float(station_data_list[i][1, j])])
-                    else:
-                        data_dict[time_step] = \
-                            [[station_list[i],
-                              float(station_data_list[i][1, j])]]
-            except IndexError:
-                counter += 1
-                continue
-            except ValueError:
-                counter2 += 1
-                continue
-
-    # print("counter 1", counter)
-    # print("counter 2", counter2)
-    return data_dict
-
-def format_median_data_view(data_dict, reference_coordinate):
+    median_series = np.full(rain_matrix.shape[0], np.nan)
+    has_data = ~np.all(np.isnan(rain_matrix), axis=1)
+    if np.any(has_data):
+        median_series[has_data] = calculate_median(rain_matrix[has_data])[0]
+
+    return median_series
+
+
+def check_quality(rain_matrix):
     """
-    Calculate median value for each time step and create a pandas data frame.
+    Flag values of faulty rain gauges.
+
+    Each time step is compared across the stations with the median and the
+    median absolute deviation (MAD), which few faulty stations do not move.
+    Values further from the median than QC_THRESHOLD spreads are outliers,
+    and no rain while the median is at least QC_WET_MEDIAN is a dry fault.
+    The spread is at least QC_MIN_SPREAD per hour of the measurement
+    interval of the station, so longer time steps allow more rain.
+    Time steps with less than QC_MIN_STATIONS stations are not compared.
+    A station that sends the same rain QC_STUCK_COUNT measurements in a
+    row, without missing measurements between them, is stuck. All checks
+    are done for the whole matrix at once.
 
     Parameters
     ----------
-    data_dict : dict
-        A dictionary with timesteps as keys and corresponding stations as
-        values.
-    reference_coordinate : str
-        String that specifies the reference coordinate, used in header as distance from.
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
 
     Returns
     -------
-    median_view_df : pandas dataframe
-        pandas data frame with median values for each time step.
-    """
-    median_array = []
-    for time_step, values in tqdm(data_dict.items()):
-        if values:
-            data = data_dict[time_step]
-            # Transforming data
-            stations = [item[0] for item in data]
-            values = [item[1] for item in data]
-            transformed_data = [stations, values]
-
-            time_step_station, time_step_median_value = \
-                quickselect_median(transformed_data)
-
-            if isinstance(time_step_station, tuple):
-                name = [station.get_name()
-                        for station in time_step_station]
-                distance = [int(1000 * round(station.get_distance(), 3))
-                            for station in time_step_station]
-            else:
-                name = time_step_station.get_name()
-                distance = int(
-                    1000 * round(time_step_station.get_distance(), 3))
-
-            time_step = datetime.utcfromtimestamp(
-                int(time_step)).strftime('%Y-%m-%d %H:%M:%S')
-            median_array.append(
-                [time_step, time_step_median_value, name, distance])
-
-    median_array = np.array(median_array, dtype=object)
+    flags : numpy array
+        QC_OUTLIER, QC_STUCK and QC_DRY bits of each value, zero for
+        values without faults and for missing values.
 
-    try:
-        print(median_array)
-        median_view_df = pd.DataFrame(median_array, columns=[
-            "Datum",
-            "Medianvärde regn [mm]",
-            "Stationsnamn",
-            f"Avstånd från punkt {reference_coordinate} [m]"])
+    """
+    flags = np.zeros(rain_matrix.shape, dtype=np.uint8)
+    interval = get_measure_interval(rain_matrix)
+
+    compared = np.flatnonzero(
+        np.sum(~np.isnan(rain_matrix), axis=1) >= QC_MIN_STATIONS)
+    if len(compared) > 0:
+        values = rain_matrix[compared]
+        median_values = calculate_median(values)[0][:, None]
+        deviation = np.abs(values - median_values)
+        # 1.4826 scales the MAD to the standard deviation of normal data
+        spread = np.maximum(1.4826 * calculate_median(deviation)[0][:, None],
+                            QC_MIN_SPREAD * interval / 3600)
+        # NaN compares as False, missing values are never flagged
+        flags[compared] |= np.where(
+            deviation > QC_THRESHOLD * spread, QC_OUTLIER, 0).astype(np.uint8)
+        flags[compared] |= np.where(
+            (values == 0) & (median_values >= QC_WET_MEDIAN),
+            QC_DRY, 0).astype(np.uint8)
+
+    # Measurements ordered by station and then time, equal values in a row
+    # are runs, a missing measurement ends the run
+    station_index, time_index = np.nonzero(~np.isnan(rain_matrix.T))
+    measurements = rain_matrix[time_index, station_index]
+    run_starts = np.flatnonzero(np.concatenate((
+        [True],
+        (station_index[1:] != station_index[:-1])
+        | (measurements[1:] != measurements[:-1])
+        | (np.diff(time_index) * TIME_STEP > interval[station_index[1:]]))))
+    run_lengths = np.diff(np.append(run_starts, len(measurements)))
+    stuck = (np.repeat(run_lengths, run_lengths) >= QC_STUCK_COUNT) \
+        & (measurements > 0)
+    flags[time_index[stuck], station_index[stuck]] |= QC_STUCK
+
+    return flags
+
+
+def get_measure_interval(rain_matrix):
+    """
+    Get the time between the measurements of each station.
 
-    except ValueError as exc:
-        raise ValueError("Ingen data kunde hittas vid skapande av datavy. \n"
-                         "Detta kan bland annat hända om vald period är"
-                         " kortar än valt tidssteg.") from exc
+    The shortest distance between two measurements of a station is its
+    scale, as gaps only make the distance longer.
 
-    return median_view_df
+    Parameters
+    ----------
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
 
+    Returns
+    -------
+    interval : numpy array
+        Seconds between measurements for each station, inf for stations
+        with less than two measurements.
 
-def format_standard_data_view(data_dict):
     """
-    Format the data with station names as headers and time steps as rows.
+    station_count = rain_matrix.shape[1]
+    interval = np.full(station_count, np.inf)
+    # Measurements ordered by station and then time, the distances of each
+    # station are one slice
+    station_index, time_index = np.nonzero(~np.isnan(rain_matrix.T))
+    distances = np.diff(time_index) * float(TIME_STEP)
+    distances[station_index[1:] != station_index[:-1]] = np.inf
+    starts = np.searchsorted(station_index[1:], np.arange(station_count))
+    ends = np.searchsorted(station_index[1:], np.arange(station_count),
+                           side='right')
+    has_distances = starts < ends
+    interval[has_distances] = np.minimum.reduceat(
+        distances, starts[has_distances])
+    return interval
+
+
+def find_gaps(rain_matrix, interval):
+    """
+    Find the time steps where stations are missing measurements.
+
+    A gap is where two measurements of a station, or a measurement and the
+    start or end of the period, are further apart than the interval of the
+    station.
 
     Parameters
     ----------
-    data_dict : dict
-        A dictionary with timesteps as keys and corresponding stations as
-        values.
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
+    interval : numpy array
+        Seconds between measurements for each station.
 
     Returns
     -------
-    standard_view_df : pandas dataframe
-        pandas data frame with station names as headers and time steps as rows.
-    """
-    station_names = list(set(station.get_name() for data in data_dict.values()
-                         for station, _ in data))
-    data_rows = {station_name: [] for station_name in station_names}
-    time_steps = data_dict.keys()
+    gaps : numpy array
+        True for the time steps of each station inside a gap.
 
-    for station_name in station_names:
-        for time_step in time_steps:
-            if time_step in data_dict:
-                data = data_dict[time_step]
-
-                # Get the rain value for the current station and time step
-                rain_value = next(
-                    (value for station,
-                     value in data if station.get_name() == station_name), '-')
-            else:
-                # The station doesn't have data for the current time step
-                rain_value = '-'
-            data_rows[station_name].append(rain_value)
-
-    standard_view_df = pd.DataFrame(data_rows)
-    dates = [datetime.utcfromtimestamp(int(time_step)).strftime('%Y-%m-%d %H:%M:%S')
-             for time_step in time_steps]
-    standard_view_df.index = pd.Index(dates, name="Datum")
+    """
+    time_step_count, station_count = rain_matrix.shape
+    # Measurements ordered by station and then time
+    station_index, time_index = np.nonzero(~np.isnan(rain_matrix.T))
+    new_station = station_index[1:] != station_index[:-1]
+    first = np.concatenate(([True], new_station))
+    last = np.concatenate((new_station, [True]))
+
+    # The gaps are marked as +1 at their start and -1 after their end
+    gap_edges = np.zeros((time_step_count + 1, station_count), dtype=np.int64)
+    previous = np.where(first, -1, np.roll(time_index, 1))
+    long = (time_index - previous) * TIME_STEP > interval[station_index]
+    np.add.at(gap_edges, (previous[long] + 1, station_index[long]), 1)
+    np.add.at(gap_edges, (time_index[long], station_index[long]), -1)
+
+    end_long = last & ((time_step_count - time_index) * TIME_STEP
+                       > interval[station_index])
+    np.add.at(gap_edges, (time_index[end_long] + 1, station_index[end_long]),
+              1)
+    np.add.at(gap_edges, (time_step_count, station_index[end_long]), -1)
+
+    return np.cumsum(gap_edges, axis=0)[:-1] > 0
+
+
+def calculate_max_rain(time_step_list, rain_matrix,
+                       windows=INTENSITY_WINDOWS):
+    """
+    Calculate the most rain over time windows for each station.
 
-    return standard_view_df
+    The rain of every window position is the difference of two cumulative
+    sums, so each window length costs one pass over the matrix. Windows
+    with a gap in the data of the station, see find_gaps, are left out.
+    Windows shorter than the time between the measurements of a station
+    are not calculated.
 
+    Parameters
+    ----------
+    time_step_list : numpy array
+        Unix dates of the time steps.
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
+    windows : dict, optional
+        Length of each window in seconds, by label. The default is
+        INTENSITY_WINDOWS.
 
+    Returns
+    -------
+    max_rain : numpy array
+        The most rain in mm, one row per window and one column per
+        station. NaN where no window could be calculated.
+    window_start : numpy array
+        Unix date of the first time step of the window with the most rain,
+        NaN where no window could be calculated.
 
-def format_data_map_view(input_data, data_dict):
     """
-    Format the data with each new row being a new data entry.
+    time_step_count, station_count = rain_matrix.shape
+    interval = get_measure_interval(rain_matrix)
+
+    rain_sum = np.zeros((time_step_count + 1, station_count))
+    np.cumsum(np.nan_to_num(rain_matrix), axis=0, out=rain_sum[1:])
+    gap_count = np.zeros((time_step_count + 1, station_count), dtype=np.int64)
+    np.cumsum(find_gaps(rain_matrix, interval), axis=0, out=gap_count[1:])
+
+    max_rain = np.full((len(windows), station_count), np.nan)
+    window_start = np.full((len(windows), station_count), np.nan)
+    columns = np.arange(station_count)
+    for i, window in enumerate(windows.values()):
+        steps = window // TIME_STEP
+        if steps > time_step_count:
+            continue
+
+        # Rounded, the sums have small errors from the subtraction, and
+        # equal windows should give the first one
+        window_rain = np.round(rain_sum[steps:] - rain_sum[:-steps], 6)
+        complete = gap_count[steps:] == gap_count[:-steps]
+        # Rain is never negative, so incomplete windows are never the most
+        window_rain[~complete] = -1
+        best = np.argmax(window_rain, axis=0)
+        best_rain = window_rain[best, columns]
+
+        valid = (best_rain >= 0) & (interval <= window)
+        max_rain[i, valid] = np.round(best_rain[valid], 3)
+        window_start[i, valid] = time_step_list[best[valid]]
+
+    return max_rain, window_start
+
+
+def find_rain_events(time_step_list, rain_matrix, dry_time=EVENT_DRY_TIME):
+    """
+    Split the rain of each station into rain events.
+
+    An event is rain that is separated from other rain by at least dry_time
+    without rain, time steps without data count as dry. The measurements
+    with rain of all stations are ordered by station and then time, each
+    event is then a run of them that starts where the station changes or
+    the time since the last rain is long enough. Sums and peaks of the runs
+    are calculated for all events at once.
 
     Parameters
     ----------
-    data_dict : dict
-        A dictionary with timesteps as keys and corresponding stations as
-        values.
+    time_step_list : numpy array
+        Unix dates of the time steps.
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
+    dry_time : int, optional
+        Seconds without rain that separate two events. The default is
+        EVENT_DRY_TIME.
 
     Returns
     -------
-    map_view_df : pandas dataframe
-        pandas data frame with rows being new data entries.
+    event_station : numpy array
+        Column of the station of each event. The events are ordered by
+        station and then start.
+    event_start : numpy array
+        Unix date of the first time step with rain of each event.
+    event_end : numpy array
+        Unix date of the end of the last measurement with rain of each
+        event.
+    event_depth : numpy array
+        Rain of each event in mm.
+    event_peak : numpy array
+        Highest intensity of each event in mm/h.
+
     """
-    data_rows = []
-    for i, (time_step, values) in tqdm(enumerate(data_dict.items())):
-
-        time_step_utc = datetime.utcfromtimestamp(
-            time_step).strftime('%Y-%m-%d %H:%M:%S')
-
-        if i == 0:
-            row = {
-                'Datum': time_step_utc,
-                'Stationsnamn': "Referenspunkt",
-                'Latitud': input_data.latitude,
-                'Longitud': input_data.longitude,
-                'Regnvärde [mm]': 0
-            }
-            data_rows.append(row)
-
-        if values:
-            data = data_dict[time_step]
-            for station, rain_value in data:
-                row = {
-                    'Datum': time_step_utc,
-                    'Stationsnamn': station.get_name(),
-                    'Latitud': station.get_latitude(),
-                    'Longitud': station.get_longitude(),
-                    'Regnvärde [mm]': rain_value
-                }
-                data_rows.append(row)
-
-    map_view_df = pd.DataFrame(data_rows)
-
-    return map_view_df
-  
-
-def collect_station_data(input_data, rain_station_list, start_stop_list, gui=None):
+    interval = get_measure_interval(rain_matrix)
+    # Stations with a single measurement get the interval of the others
+    finite = np.isfinite(interval)
+    interval[~finite] = interval[finite].min() if finite.any() else TIME_STEP
+
+    # NaN is never above zero, time steps without data are dry
+    station_index, time_index = np.nonzero(rain_matrix.T > 0)
+    if len(time_index) == 0:
+        return (np.zeros(0, dtype=int),) + tuple(np.zeros((4, 0)))
+
+    rain = rain_matrix[time_index, station_index]
+    dry = np.diff(time_index) * TIME_STEP - interval[station_index[1:]]
+    starts = np.flatnonzero(np.concatenate((
+        [True],
+        (station_index[1:] != station_index[:-1]) | (dry >= dry_time))))
+    ends = np.append(starts[1:], len(time_index)) - 1
+
+    event_station = station_index[starts]
+    event_interval = interval[event_station]
+    event_start = time_step_list[time_index[starts]].astype(float)
+    event_end = time_step_list[time_index[ends]] + event_interval
+    event_depth = np.round(np.add.reduceat(rain, starts), 3)
+    event_peak = np.round(
+        np.maximum.reduceat(rain, starts) * 3600 / event_interval, 3)
+
+    return event_station, event_start, event_end, event_depth, event_peak
+
+
+def iterate_station_data(input_data, stations, start_stop_list, amount=None,
+                         gui=None, cancel_token=None):
     """
-    For each station in station list, collect station data and return it.
+    Collect station data from the stations in order and yield it.
+
+    Stations without data are skipped and the next station in stations
+    takes their place, until amount stations with data have been found.
 
     Parameters
     ----------
     input_data : UserInputData object
         An object of class UserInputData containing the users input data.
-    rain_station_list : list
-        List of RainStation objects.
+    stations : StationTable
+        The candidate stations, best first.
     start_stop_list : list
         List of 2x1 matricies of start, stop value pairs for partitioning data.
+    amount : int, optional
+        Number of stations with data to collect. The default is None, which
+        tries all stations.
     gui : gui object, optional
         A gui object to update gui elements. The default is None.
+    cancel_token : CancellationToken, optional
+        If the token is cancelled no more stations are collected.
+        The default is None.
 
     Raises
     ------
     NoApiCallsLeftError
-        If amount of api calls is exceeded raise error.
+        If amount of api calls is exceeded before any station is collected.
 
-    Returns
-    -------
-    rain_data_list : list
-        A list of data from stations in rain_station_list.
+    Yields
+    ------
+    column : int
+        Number of stations with data found before this one.
+    i : int
+        Index of the station in stations.
+    station_data : numpy array
+        Data from the station.
 
     """
-    rain_data_list = []
-    for i, station in enumerate(rain_station_list):
+    if amount is None:
+        amount = len(stations)
+
+    column = 0
+    for i in range(len(stations)):
+        if column == amount:
+            return
+
+        if cancel_token is not None and cancel_token.cancelled:
+            if gui is not None:
+                gui.event_queue.put((
+                    "message", "Jobbet avbröts, "
+                    "sparar fil med redan hämtad data..."))
+            return
+
         if gui is not None:
             gui.event_queue.put((
-                "message", f"Hämtar stationsdata: {station.get_name()}"))
+                "message", f"Hämtar stationsdata: {stations.get_name(i)}"))
             gui.event_queue.put(("progress", np.ceil(
-                100 / (len(rain_station_list) + 1))))
+                100 / (amount + 1))))
 
         try:
             station_data = rain_data.get_measure(
                 input_data,
-                station,
+                stations.get_device_id(i),
+                stations.get_module_id(i),
                 start_stop_list,
                 save_calls=True,
-                gui=gui
+                gui=gui,
+                cancel_token=cancel_token
             )
 
-            rain_data_list.append(station_data)
-
         except NoApiCallsLeftError as exc:
-            if i > 0:
+            if column > 0:
                 if gui is not None:
                     gui.event_queue.put((
                         "message", "För många förfrågningar till Netatmo,"
                         "sparar fil med redan hämtad data..."))
-                return rain_data_list
+                return
 
             raise NoApiCallsLeftError from exc
 
-    return rain_data_list
+        if not np.any(station_data):
+            if gui is not None:
+                gui.event_queue.put((
+                    "message", f"Ingen data från {stations.get_name(i)}, "
+                    "provar nästa station"))
+            continue
+
+        yield column, i, station_data
+        column += 1
 
 
-def create_data_views_for_excel(input_data, rain_station_list, start_stop_list,
-                                reference_coordinate, gui=None):
+def fetch_to_queue(station_queue, input_data, stations, start_stop_list,
+                   amount=None, gui=None, cancel_token=None):
     """
-    Create three separate data views of the data using pandas dataframes.
+    Collect station data and put it on a queue, the producer of the pipeline.
+
+    Puts (column, i, station_data) for each station with data, then None
+    when done. If
+    collecting fails the exception is put on the queue instead.
 
     Parameters
     ----------
+    station_queue : queue.Queue
+        Queue read by collect_rain_matrix.
     input_data : UserInputData object
         An object of class UserInputData containing the users input data.
-    rain_station_list : list
-        List of RainStation objects.
-    start_stop_list : List
+    stations : StationTable
+        The candidate stations, best first.
+    start_stop_list : list
         List of 2x1 matricies of start, stop value pairs for partitioning data.
-    reference_coordinate : str
-        String that specifies the reference coordinate, used in header.
+    amount : int, optional
+        Number of stations with data to collect. The default is None.
     gui : gui object, optional
         A gui object to update gui elements. The default is None.
-
-    Returns
-    -------
-    standard_view_df : pandas dataframe
-        Standard data view with names as headers and timesteps as rows.
-    median_df : pandas dataframe
-        Data frame that shows median values of stations for each timestep.
-    map_view_df : pandas dataframe
-        Data frame with format for easy manipulation with map function in excel.
+    cancel_token : CancellationToken, optional
+        Token used to cancel the data collection. The default is None.
 
     """
+    try:
+        for item in iterate_station_data(input_data, stations,
+                                         start_stop_list, amount=amount,
+                                         gui=gui, cancel_token=cancel_token):
+            station_queue.put(item)
+    except Exception as exc:
+        station_queue.put(exc)
+        return
 
-    rain_data_list = collect_station_data(
-        input_data,
-        rain_station_list,
-        start_stop_list,
-        gui=gui
-    )
-  
-    time_step_list = np.arange(
-        start_stop_list[0][0], start_stop_list[-1][1], 900, dtype=int
-    )
+    station_queue.put(None)
 
-    rain_station_list = rain_station_list[0:len(rain_data_list)]
 
-    indices_to_delete = []
-    for i, value in enumerate(rain_data_list):
-        if not np.any(value):
-            indices_to_delete.append(i)
+def collect_rain_matrix(input_data, stations, start_stop_list,
+                        time_step_list, rain_matrix, gui=None,
+                        cancel_token=None):
+    """
+    Collect station data into a time x station matrix.
 
-    for index in reversed(indices_to_delete):
-        del rain_data_list[index]
-        del rain_station_list[index]
+    Fetching and aligning overlap: a producer thread fetches the stations
+    while each station is aligned into its column as soon as it arrives.
+    The candidates are tried in order and stations without data are
+    replaced by the next candidate, until every column is filled. Columns
+    left when there are too few stations with data stay NaN.
 
-    # print(rain_data_list)
-    unix_from_stations = convert_to_unix_from_stations(rain_data_list)
+    Parameters
+    ----------
+    input_data : UserInputData object
+        An object of class UserInputData containing the users input data.
+    stations : StationTable
+        The candidate stations, best first.
+    start_stop_list : List
+        List of 2x1 matricies of start, stop value pairs for partitioning data.
+    time_step_list : numpy array
+        Unix dates of the time steps, one per row of rain_matrix.
+    rain_matrix : numpy array
+        NaN filled matrix that the data is written to.
+    gui : gui object, optional
+        A gui object to update gui elements. The default is None.
+    cancel_token : CancellationToken, optional
+        Token used to cancel the data collection. The default is None.
 
-    data_time_step_dict = find_what_data_each_time_step(
-        rain_data_list,
-        rain_station_list,
-        unix_from_stations,
-        time_step_list
-    )
-    # print(data_time_step_dict)
-    if gui is not None:
-        gui.event_queue.put(("progress", 100 // (len(rain_station_list) + 1)))
-        gui.event_queue.put(("message", "Räknar ut median från stationer"))
+    Raises
+    ------
+    JobCancelledError
+        If the job was cancelled before any data was collected.
 
-    standard_view_df = format_standard_data_view(data_time_step_dict)
-    median_df = format_median_data_view(
-        data_time_step_dict, reference_coordinate)
-    map_view_df = format_data_map_view(input_data, data_time_step_dict)
+    Returns
+    -------
+    selected : numpy array
+        Index in stations of the station in each filled column.
 
-    return standard_view_df, median_df, map_view_df
+    """
+    station_queue = queue.Queue()
+    producer = threading.Thread(
+        target=fetch_to_queue,
+        args=(station_queue, input_data, stations, start_stop_list),
+        kwargs={"amount": rain_matrix.shape[1], "gui": gui,
+                "cancel_token": cancel_token},
+        daemon=True)
+    producer.start()
+
+    selected = []
+    while True:
+        item = station_queue.get()
+        if item is None:
+            break
+        if isinstance(item, Exception):
+            raise item
+
+        column, i, station_data = item
+        unix, values = get_station_series(station_data)
+        rain_matrix[:, column] = align_station_series(
+            unix, values, time_step_list)
+        selected.append(i)
+
+    producer.join()
+
+    if cancel_token is not None and cancel_token.cancelled \
+            and not selected:
+        raise JobCancelledError("Jobbet avbröts innan någon data hämtades")
+
+    return np.array(selected, dtype=int)
@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 21 09:47:30 2026
+
+@author: tagtyk0616
+"""
+
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from urllib.parse import quote
+from tornado.web import HTTPError, StaticFileHandler
+from back_end import output_store
+
+DOWNLOAD_PREFIX = "/download/"
+URL_TTL = 3600  # Seconds a download link is valid
+# Key the links are signed with. Server processes started together share
+# the generated key, set the variable to share it between containers.
+SECRET = os.environ.get("NETATMO_DOWNLOAD_SECRET",
+                        secrets.token_hex(32)).encode("utf-8")
+
+
+def get_signature(file_path, expires):
+    """
+    Sign the path of a file in the output store and the expiry of its link.
+
+    Parameters
+    ----------
+    file_path : str
+        Path of the file relative to output_store.FILES_DIR.
+    expires : int
+        Unix time the link expires.
+
+    Returns
+    -------
+    str
+        Hex digest of the HMAC.
+
+    """
+    message = f"{file_path}\n{expires}".encode("utf-8")
+    return hmac.new(SECRET, message, hashlib.sha256).hexdigest()
+
+
+def create_download_url(path, ttl=URL_TTL):
+    """
+    Create a signed link to a file in the output store.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file in the output store.
+    ttl : float, optional
+        Seconds the link is valid. The default is URL_TTL.
+
+    Returns
+    -------
+    str
+        The link, relative to the server root.
+
+    """
+    file_path = os.path.relpath(path, output_store.FILES_DIR)
+    expires = int(time.time() + ttl)
+    return (f"{DOWNLOAD_PREFIX}{quote(file_path)}?expires={expires}"
+            f"&signature={get_signature(file_path, expires)}")
+
+
+class DownloadHandler(StaticFileHandler):
+    """
+    Serve files of the output store by signed link.
+
+    The file is streamed in chunks by Tornado, with support for Range
+    requests, and is held in the output store while it is sent. Register
+    it with the path of the files:
+    (DOWNLOAD_PREFIX + "(.*)", DownloadHandler,
+    {"path": output_store.FILES_DIR})
+
+    """
+
+    async def get(self, path, include_body=True):
+        expires = self.get_query_argument("expires", "")
+        signature = self.get_query_argument("signature", "")
+        if not expires.isdigit() or int(expires) < time.time() \
+                or not hmac.compare_digest(get_signature(path, int(expires)),
+                                           signature):
+            raise HTTPError(403)
+
+        try:
+            with output_store.open_output(
+                    os.path.join(output_store.FILES_DIR, path)):
+                await super().get(path, include_body)
+        except FileNotFoundError:
+            # Evicted from the output store
+            raise HTTPError(404)
+
+    def set_extra_headers(self, path):
+        self.set_header(
+            "Content-Disposition",
+            f"attachment; filename*=UTF-8''{quote(os.path.basename(path))}")
+        self.set_header("Cache-Control", "private, no-store")
@@ -0,0 +1,1177 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 13:40:02 2026
+
+@author: tagtyk0616
+"""
+
+from contextlib import contextmanager
+import csv
+import io
+import zipfile
+import numpy as np
+from openpyxl import Workbook
+import pyarrow as pa
+import pyarrow.parquet as pq
+import xarray as xr
+from back_end import data_processing, shared_arrays
+
+ROW_BLOCK = 4096  # Time steps converted to cell values at a time
+MAX_ROWS = 1048576  # Rows of an Excel sheet, including the header
+# Views in file order, and the ones chosen if nothing else is asked for
+VIEWS = ('Allmän vy', "Median", 'Kartfunktion', "Intensitet",
+         "Regnhändelser", "Kvalitetskontroll")
+DEFAULT_VIEWS = ('Allmän vy', "Median", 'Kartfunktion')
+OUTPUT_FORMATS = {"Excel": ".xlsx",  # File extension of each output format
+                  "Parquet": ".zip",
+                  "Feather": ".zip",
+                  "CSV": ".zip",
+                  "NetCDF": ".nc"}
+NO_DATA_MESSAGE = ("Ingen data kunde hittas vid skapande av datavy. \n"
+                   "Detta kan bland annat hända om vald period är"
+                   " kortar än valt tidssteg.")
+
+
+class SplitSheet:
+    """
+    Sheet that continues on numbered sheets when it is full.
+
+    The first row appended is the header, it is repeated at the top of each
+    new sheet.
+
+    Parameters
+    ----------
+        workbook : openpyxl Workbook
+            Write only workbook the sheets are created in.
+        title : str
+            Title of the first sheet, the following sheets get a number
+            after it.
+        max_rows : int, optional
+            Rows of each sheet. The default is MAX_ROWS.
+
+    """
+
+    __slots__ = ("workbook", "title", "max_rows", "header", "sheet",
+                 "sheet_count", "row_count")
+
+    def __init__(self, workbook, title, max_rows=MAX_ROWS):
+        self.workbook = workbook
+        self.title = title
+        self.max_rows = max_rows
+        self.header = None
+        self.sheet = workbook.create_sheet(title)
+        self.sheet_count = 1
+        self.row_count = 0
+
+    def append(self, row):
+        if self.row_count == self.max_rows:
+            self.sheet_count += 1
+            self.sheet = self.workbook.create_sheet(
+                f"{self.title} {self.sheet_count}")
+            self.sheet.append(self.header)
+            self.row_count = 1
+        elif self.header is None:
+            self.header = row
+
+        self.sheet.append(row)
+        self.row_count += 1
+
+
+def predict_sheet_rows(time_step_count, station_count,
+                       dry_time=data_processing.EVENT_DRY_TIME):
+    """
+    Get the most rows each sheet of the Excel file can get.
+
+    Parameters
+    ----------
+    time_step_count : int
+        Most time steps a station can have data for.
+    station_count : int
+        Number of stations.
+    dry_time : int, optional
+        Seconds without rain between two rain events. The default is
+        EVENT_DRY_TIME of data_processing.
+
+    Returns
+    -------
+    dict
+        Upper bound of the rows of each sheet, including the header.
+
+    """
+    # Two rain events start at least one time step and the dry time apart
+    event_count = -(-time_step_count * data_processing.TIME_STEP
+                    // (data_processing.TIME_STEP + dry_time))
+    return {'Allmän vy': time_step_count + 1,
+            "Median": time_step_count + 1,
+            # One row per value, and the reference point
+            'Kartfunktion': time_step_count * station_count + 2,
+            # One row per station, and the median
+            "Intensitet": station_count + 2,
+            # Events of each station and of the median
+            "Regnhändelser": (station_count + 1) * event_count + 1,
+            "Kvalitetskontroll": station_count + 1}
+
+
+def plan_sheets(time_step_count, station_count,
+                dry_time=data_processing.EVENT_DRY_TIME, max_rows=MAX_ROWS):
+    """
+    Get how many sheets each view of the Excel file is split on.
+
+    Used before any data is fetched, so it is known up front that the file
+    can be written.
+
+    Parameters
+    ----------
+    time_step_count : int
+        Most time steps a station can have data for.
+    station_count : int
+        Number of stations.
+    dry_time : int, optional
+        Seconds without rain between two rain events. The default is
+        EVENT_DRY_TIME of data_processing.
+    max_rows : int, optional
+        Rows of each sheet. The default is MAX_ROWS.
+
+    Returns
+    -------
+    dict
+        Number of sheets of each view.
+
+    """
+    return {title: 1 + max(rows - 2, 0) // (max_rows - 1)
+            for title, rows
+            in predict_sheet_rows(time_step_count, station_count,
+                                  dry_time).items()}
+
+
+def get_datetimes(time_step_list):
+    """
+    Convert unix dates to datetimes that are written as Excel dates.
+
+    Parameters
+    ----------
+    time_step_list : numpy array
+        Unix dates.
+
+    Returns
+    -------
+    list of datetime
+        The dates in UTC without time zone, Excel has no time zones.
+
+    """
+    return np.asarray(time_step_list, dtype=np.int64).astype(
+        "datetime64[s]").tolist()
+
+
+def get_timestamps(time_step_list):
+    """
+    Convert unix dates to an Arrow array of timestamps.
+
+    Parameters
+    ----------
+    time_step_list : numpy array
+        Unix dates.
+
+    Returns
+    -------
+    pyarrow Array
+        The dates as timestamps in seconds, UTC.
+
+    """
+    return pa.array(np.asarray(time_step_list, dtype=np.int64).astype(
+        "datetime64[s]"), pa.timestamp("s", "UTC"))
+
+
+def get_row_blocks(row_count):
+    """
+    Split rows into blocks that are written one at a time.
+
+    Parameters
+    ----------
+    row_count : int
+        Number of rows.
+
+    Returns
+    -------
+    generator of slice
+        Slices of at most ROW_BLOCK rows.
+
+    """
+    return (slice(start, start + ROW_BLOCK)
+            for start in range(0, row_count, ROW_BLOCK))
+
+
+def run_quality_control(rain_matrix, views, exclude_flagged):
+    """
+    Flag the values of faulty gauges if the views need it.
+
+    Parameters
+    ----------
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
+    views : tuple of str
+        The views to write, from VIEWS.
+    exclude_flagged : bool
+        If flagged values are left out of the median.
+
+    Returns
+    -------
+    flags : numpy array or None
+        Flags from check_quality of data_processing, None if they are not
+        needed.
+    median_matrix : numpy array
+        Matrix the median is calculated from, rain_matrix or a copy of it
+        with the flagged values missing.
+
+    """
+    if "Kvalitetskontroll" not in views and not exclude_flagged:
+        return None, rain_matrix
+
+    flags = data_processing.check_quality(rain_matrix)
+    if not exclude_flagged:
+        return flags, rain_matrix
+
+    return flags, np.where(flags != 0, np.nan, rain_matrix)
+
+
+def write_standard_sheet(sheet, time_step_list, rain_matrix, stations):
+    """
+    Write the data with station names as headers and time steps as rows.
+
+    Time steps and stations without any data are left out, missing values
+    are written as '-'.
+
+    Parameters
+    ----------
+    sheet : SplitSheet
+        Sheet to write to.
+    time_step_list : numpy array
+        Unix dates of the time steps.
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
+    stations : StationTable
+        The stations, one per column of rain_matrix.
+
+    """
+    missing = np.isnan(rain_matrix)
+    has_data = np.flatnonzero(~np.all(missing, axis=1))
+    station_has_data = ~np.all(missing, axis=0)
+
+    sheet.append(["Datum"] + list(stations.names[station_has_data]))
+    for block in get_row_blocks(len(has_data)):
+        rows = has_data[block]
+        dates = get_datetimes(time_step_list[rows])
+        values = rain_matrix[rows][:, station_has_data]
+        for date, row_values, row_missing in zip(
+                dates, values.tolist(), np.isnan(values).tolist()):
+            sheet.append([date] + ['-' if is_missing else value
+                                   for value, is_missing
+                                   in zip(row_values, row_missing)])
+
+
+def write_median_sheet(sheet, time_step_list, rain_matrix, stations,
+                       reference_coordinate):
+    """
+    Write the median value of the stations for each time step.
+
+    Parameters
+    ----------
+    sheet : SplitSheet
+        Sheet to write to.
+    time_step_list : numpy array
+        Unix dates of the time steps.
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
+    stations : StationTable
+        The stations, one per column of rain_matrix.
+    reference_coordinate : str
+        String that specifies the reference coordinate, used in header.
+
+    """
+    has_data = np.flatnonzero(~np.all(np.isnan(rain_matrix), axis=1))
+
+    distances = (1000 * np.round(stations.distances, 3)).astype(int)
+    sheet.append(["Datum", "Medianvärde regn [mm]", "Stationsnamn",
+                  f"Avstånd från punkt {reference_coordinate} [m]"])
+    for block in get_row_blocks(len(has_data)):
+        rows = has_data[block]
+        median_values, lower_station, upper_station = \
+            data_processing.calculate_median(rain_matrix[rows])
+        for date, median, lower, upper in zip(
+                get_datetimes(time_step_list[rows]), median_values.tolist(),
+                lower_station.tolist(), upper_station.tolist()):
+            if lower == upper:
+                sheet.append([date, median, stations.get_name(lower),
+                              int(distances[lower])])
+            else:
+                # Both middle stations are given for an even number of
+                # stations, as text since a cell holds one value
+                sheet.append([
+                    date, median,
+                    str([stations.get_name(lower), stations.get_name(upper)]),
+                    str([int(distances[lower]), int(distances[upper])])])
+
+
+def write_map_sheet(sheet, reference_point, time_step_list, rain_matrix,
+                    stations):
+    """
+    Write the data with each new row being a new data entry.
+
+    The reference point is written first, with the date of the first entry.
+
+    Parameters
+    ----------
+    sheet : SplitSheet
+        Sheet to write to.
+    reference_point : tuple of float
+        Latitude and longitude of the reference point.
+    time_step_list : numpy array
+        Unix dates of the time steps.
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
+    stations : StationTable
+        The stations, one per column of rain_matrix.
+
+    """
+    sheet.append(['Datum', 'Stationsnamn', 'Latitud', 'Longitud',
+                  'Regnvärde [mm]'])
+    names = stations.names
+    latitudes = stations.latitudes.tolist()
+    longitudes = stations.longitudes.tolist()
+    reference_written = False
+    for block in get_row_blocks(rain_matrix.shape[0]):
+        block_matrix = rain_matrix[block]
+        time_index, station_index = np.nonzero(~np.isnan(block_matrix))
+        if len(time_index) == 0:
+            continue
+
+        dates = get_datetimes(time_step_list[block][time_index])
+        if not reference_written:
+            sheet.append([dates[0], "Referenspunkt", reference_point[0],
+                          reference_point[1], 0])
+            reference_written = True
+
+        for date, station, value in zip(
+                dates, station_index.tolist(),
+                block_matrix[time_index, station_index].tolist()):
+            sheet.append([date, names[station], latitudes[station],
+                          longitudes[station], value])
+
+
+def get_intensity_columns(time_step_list, rain_matrix, stations,
+                          median_matrix):
+    """
+    Calculate the most rain over each intensity window.
+
+    Parameters
+    ----------
+    time_step_list : numpy array
+        Unix dates of the time steps.
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
+    stations : StationTable
+        The stations, one per column of rain_matrix.
+    median_matrix : numpy array
+        Matrix the median is calculated from, see run_quality_control.
+
+    Returns
+    -------
+    names : list of str
+        The station names, and "Median" for the median series last.
+    max_rain : numpy array
+        The most rain in mm, one row per window in INTENSITY_WINDOWS and
+        one column per name.
+    window_start : numpy array
+        Unix date the window with the most rain starts.
+
+    """
+    matrix = np.column_stack(
+        [rain_matrix, data_processing.calculate_median_series(median_matrix)])
+    max_rain, window_start = data_processing.calculate_max_rain(
+        time_step_list, matrix)
+    return list(stations.names) + ["Median"], max_rain, window_start
+
+
+def write_intensity_sheet(sheet, time_step_list, rain_matrix, stations,
+                          median_matrix):
+    """
+    Write the most rain over 30 min to 24 h for each station and the median.
+
+    Windows that could not be calculated, because of gaps in the data or
+    a longer time between measurements, are written as '-'.
+
+    Parameters
+    ----------
+    sheet : SplitSheet
+        Sheet to write to.
+    time_step_list : numpy array
+        Unix dates of the time steps.
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
+    stations : StationTable
+        The stations, one per column of rain_matrix.
+    median_matrix : numpy array
+        Matrix the median is calculated from, see run_quality_control.
+
+    """
+    names, max_rain, window_start = get_intensity_columns(
+        time_step_list, rain_matrix, stations, median_matrix)
+
+    header = ["Stationsnamn"]
+    for label in data_processing.INTENSITY_WINDOWS:
+        header += [f"Max regn {label} [mm]", f"Start {label}"]
+    sheet.append(header)
+
+    for column, name in enumerate(names):
+        row = [name]
+        for rain, start in zip(max_rain[:, column].tolist(),
+                               window_start[:, column].tolist()):
+            if np.isnan(rain):
+                row += ['-', '-']
+            else:
+                row += [rain, get_datetimes([start])[0]]
+        sheet.append(row)
+
+
+def get_event_columns(time_step_list, rain_matrix, stations, median_matrix,
+                      dry_time):
+    """
+    Find the rain events of each station and of the median.
+
+    Parameters
+    ----------
+    time_step_list : numpy array
+        Unix dates of the time steps.
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
+    stations : StationTable
+        The stations, one per column of rain_matrix.
+    median_matrix : numpy array
+        Matrix the median is calculated from, see run_quality_control.
+    dry_time : int
+        Seconds without rain that separate two rain events.
+
+    Returns
+    -------
+    event_names : numpy array
+        Station name of each event, "Median" for the events of the median
+        series, which come last.
+    events : tuple of numpy arrays
+        The events from find_rain_events of data_processing, the station
+        of the median series is the column after the stations.
+
+    """
+    matrix = np.column_stack(
+        [rain_matrix, data_processing.calculate_median_series(median_matrix)])
+    events = data_processing.find_rain_events(time_step_list, matrix,
+                                              dry_time)
+    names = np.append(stations.names.astype(object), "Median")
+    return names[events[0]], events
+
+
+def write_event_sheet(sheet, time_step_list, rain_matrix, stations,
+                      median_matrix, dry_time):
+    """
+    Write the rain events of each station and of the median.
+
+    Parameters
+    ----------
+    sheet : SplitSheet
+        Sheet to write to.
+    time_step_list : numpy array
+        Unix dates of the time steps.
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
+    stations : StationTable
+        The stations, one per column of rain_matrix.
+    median_matrix : numpy array
+        Matrix the median is calculated from, see run_quality_control.
+    dry_time : int
+        Seconds without rain that separate two rain events.
+
+    """
+    event_names, (_, start, end, depth, peak) = get_event_columns(
+        time_step_list, rain_matrix, stations, median_matrix, dry_time)
+
+    sheet.append(["Stationsnamn", "Start", "Slut", "Varaktighet [h]",
+                  "Regnmängd [mm]", "Max intensitet [mm/h]"])
+    for block in get_row_blocks(len(event_names)):
+        for row in zip(event_names[block].tolist(),
+                       get_datetimes(start[block]),
+                       get_datetimes(end[block]),
+                       ((end[block] - start[block]) / 3600).tolist(),
+                       depth[block].tolist(), peak[block].tolist()):
+            sheet.append(row)
+
+
+def get_quality_columns(rain_matrix, flags):
+    """
+    Count the flagged values of each station.
+
+    Parameters
+    ----------
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
+    flags : numpy array
+        Flags from check_quality of data_processing.
+
+    Returns
+    -------
+    dict
+        Column of each count by title, one row per station.
+
+    """
+    value_count = np.count_nonzero(~np.isnan(rain_matrix), axis=0)
+    flagged_count = np.count_nonzero(flags, axis=0)
+    return {
+        "Antal värden": value_count,
+        "Avvikande värden": np.count_nonzero(
+            flags & data_processing.QC_OUTLIER, axis=0),
+        "Fastnade värden": np.count_nonzero(
+            flags & data_processing.QC_STUCK, axis=0),
+        "Noll när andra regnar": np.count_nonzero(
+            flags & data_processing.QC_DRY, axis=0),
+        "Andel flaggade [%]": np.round(
+            100 * flagged_count / np.maximum(value_count, 1), 1)}
+
+
+def write_quality_sheet(sheet, rain_matrix, stations, flags):
+    """
+    Write how many values of each station the quality control flagged.
+
+    Parameters
+    ----------
+    sheet : SplitSheet
+        Sheet to write to.
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
+    stations : StationTable
+        The stations, one per column of rain_matrix.
+    flags : numpy array
+        Flags from check_quality of data_processing.
+
+    """
+    columns = get_quality_columns(rain_matrix, flags)
+    sheet.append(["Stationsnamn"] + list(columns))
+    for row in zip(stations.names.tolist(),
+                   *(column.tolist() for column in columns.values())):
+        sheet.append(list(row))
+
+
+def write_excel_file(path, reference_point, time_step_list, rain_matrix,
+                     stations, reference_coordinate, views=DEFAULT_VIEWS,
+                     dry_time=data_processing.EVENT_DRY_TIME,
+                     exclude_flagged=False):
+    """
+    Write the data views to an Excel file.
+
+    The workbook is written in write only mode, rows are streamed to the
+    file sheet by sheet straight from the matrix so memory use does not grow
+    with the size of the file. Dates are written as Excel dates and rain
+    values as numbers. Views with more rows than a sheet holds continue on
+    numbered sheets. The other parameters are the ones of write_output_file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the Excel file.
+
+    """
+    flags, median_matrix = run_quality_control(rain_matrix, views,
+                                               exclude_flagged)
+    workbook = Workbook(write_only=True)
+    if 'Allmän vy' in views:
+        write_standard_sheet(SplitSheet(workbook, 'Allmän vy'),
+                             time_step_list, rain_matrix, stations)
+    if "Median" in views:
+        write_median_sheet(SplitSheet(workbook, "Median"), time_step_list,
+                           median_matrix, stations, reference_coordinate)
+    if 'Kartfunktion' in views:
+        write_map_sheet(SplitSheet(workbook, 'Kartfunktion'),
+                        reference_point, time_step_list, rain_matrix,
+                        stations)
+    if "Intensitet" in views:
+        write_intensity_sheet(SplitSheet(workbook, "Intensitet"),
+                              time_step_list, rain_matrix, stations,
+                              median_matrix)
+    if "Regnhändelser" in views:
+        write_event_sheet(SplitSheet(workbook, "Regnhändelser"),
+                          time_step_list, rain_matrix, stations,
+                          median_matrix, dry_time)
+    if "Kvalitetskontroll" in views:
+        write_quality_sheet(SplitSheet(workbook, "Kvalitetskontroll"),
+                            rain_matrix, stations, flags)
+    workbook.save(path)
+
+
+class CsvSheet:
+    """
+    CSV file that rows are appended to like a sheet.
+
+    Parameters
+    ----------
+        file : text file
+            Open file the rows are written to.
+
+    """
+
+    __slots__ = ("writer",)
+
+    def __init__(self, file):
+        self.writer = csv.writer(file)
+
+    def append(self, row):
+        self.writer.writerow(row)
+
+
+@contextmanager
+def open_csv_sheet(archive, title):
+    """
+    Open a CSV file in a zip archive as a sheet.
+
+    Parameters
+    ----------
+    archive : ZipFile
+        Archive opened for writing.
+    title : str
+        Name of the file, without extension.
+
+    Yields
+    ------
+    CsvSheet
+        The sheet, rows are compressed into the archive as they are written.
+
+    """
+    # utf-8-sig so Excel reads å, ä and ö right
+    with io.TextIOWrapper(archive.open(f"{title}.csv", "w", force_zip64=True),
+                          encoding="utf-8-sig", newline="") as file:
+        yield CsvSheet(file)
+
+
+def write_csv_files(path, reference_point, time_step_list, rain_matrix,
+                    stations, reference_coordinate, views=DEFAULT_VIEWS,
+                    dry_time=data_processing.EVENT_DRY_TIME,
+                    exclude_flagged=False):
+    """
+    Write the data views as CSV files in a zip archive.
+
+    The files have the same rows as the sheets of the Excel file and are
+    streamed into the archive in blocks. The other parameters are the ones
+    of write_output_file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the zip archive.
+
+    """
+    flags, median_matrix = run_quality_control(rain_matrix, views,
+                                               exclude_flagged)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        if 'Allmän vy' in views:
+            with open_csv_sheet(archive, 'Allmän vy') as sheet:
+                write_standard_sheet(sheet, time_step_list, rain_matrix,
+                                     stations)
+        if "Median" in views:
+            with open_csv_sheet(archive, "Median") as sheet:
+                write_median_sheet(sheet, time_step_list, median_matrix,
+                                   stations, reference_coordinate)
+        if 'Kartfunktion' in views:
+            with open_csv_sheet(archive, 'Kartfunktion') as sheet:
+                write_map_sheet(sheet, reference_point, time_step_list,
+                                rain_matrix, stations)
+        if "Intensitet" in views:
+            with open_csv_sheet(archive, "Intensitet") as sheet:
+                write_intensity_sheet(sheet, time_step_list, rain_matrix,
+                                      stations, median_matrix)
+        if "Regnhändelser" in views:
+            with open_csv_sheet(archive, "Regnhändelser") as sheet:
+                write_event_sheet(sheet, time_step_list, rain_matrix,
+                                  stations, median_matrix, dry_time)
+        if "Kvalitetskontroll" in views:
+            with open_csv_sheet(archive, "Kvalitetskontroll") as sheet:
+                write_quality_sheet(sheet, rain_matrix, stations, flags)
+
+
+def create_arrow_tables(reference_point, time_step_list, rain_matrix,
+                        stations, reference_coordinate, views=DEFAULT_VIEWS,
+                        dry_time=data_processing.EVENT_DRY_TIME,
+                        exclude_flagged=False):
+    """
+    Create the data views as Arrow tables.
+
+    Rain values are copied from the matrix into Arrow arrays with missing
+    values as null. Dates are timestamps in UTC. The median view gets one
+    column for each of the two middle stations instead of a list, and the
+    map view keeps the reference point in the metadata of the table. The
+    parameters are the ones of write_output_file, without path and
+    output_format.
+
+    Returns
+    -------
+    dict
+        The tables of the requested views by title.
+
+    """
+    missing = np.isnan(rain_matrix)
+    has_data = np.flatnonzero(~np.all(missing, axis=1))
+
+    tables = {}
+    dates = get_timestamps(time_step_list[has_data])
+    values = rain_matrix[has_data]
+    if 'Allmän vy' in views:
+        station_has_data = np.flatnonzero(~np.all(missing, axis=0))
+        tables['Allmän vy'] = pa.table(
+            [dates] + [pa.array(values[:, i], from_pandas=True)
+                       for i in station_has_data],
+            names=["Datum"] + list(stations.names[station_has_data]))
+
+    flags, median_matrix = run_quality_control(rain_matrix, views,
+                                               exclude_flagged)
+    if "Median" in views:
+        # Time steps where all values were left out get no median
+        median_rows = np.flatnonzero(~np.all(np.isnan(median_matrix),
+                                             axis=1))
+        tables["Median"] = create_median_table(
+            get_timestamps(time_step_list[median_rows]),
+            median_matrix[median_rows], stations, reference_coordinate)
+
+    if 'Kartfunktion' in views:
+        tables['Kartfunktion'] = create_map_table(
+            reference_point, time_step_list, rain_matrix, stations)
+
+    if "Intensitet" in views:
+        tables["Intensitet"] = create_intensity_table(
+            time_step_list, rain_matrix, stations, median_matrix)
+
+    if "Regnhändelser" in views:
+        tables["Regnhändelser"] = create_event_table(
+            time_step_list, rain_matrix, stations, median_matrix, dry_time)
+
+    if "Kvalitetskontroll" in views:
+        tables["Kvalitetskontroll"] = pa.table(
+            {"Stationsnamn": stations.names.tolist(),
+             **get_quality_columns(rain_matrix, flags)})
+
+    return tables
+
+
+def create_median_table(dates, values, stations, reference_coordinate):
+    """
+    Create the median view as an Arrow table.
+
+    Parameters
+    ----------
+    dates : pyarrow Array
+        Timestamps of the time steps with data.
+    values : numpy array
+        Rain matrix of the time steps with data.
+    stations : StationTable
+        The stations, one per column of values.
+    reference_coordinate : str
+        String that specifies the reference coordinate, used in header.
+
+    Returns
+    -------
+    pyarrow Table
+        The median view.
+
+    """
+    median_values, lower_station, upper_station = \
+        data_processing.calculate_median(values)
+    distances = (1000 * np.round(stations.distances, 3)).astype(int)
+    one_station = lower_station == upper_station
+    return pa.table({
+        "Datum": dates,
+        "Medianvärde regn [mm]": median_values,
+        "Stationsnamn": stations.names[lower_station].tolist(),
+        "Stationsnamn 2": pa.array(stations.names[upper_station].tolist(),
+                                   mask=one_station),
+        f"Avstånd från punkt {reference_coordinate} [m]":
+            distances[lower_station],
+        f"Avstånd 2 från punkt {reference_coordinate} [m]":
+            pa.array(distances[upper_station], mask=one_station)})
+
+
+def create_map_table(reference_point, time_step_list, rain_matrix, stations):
+    """
+    Create the map view as an Arrow table.
+
+    Parameters
+    ----------
+    reference_point : tuple of float
+        Latitude and longitude of the reference point.
+    time_step_list : numpy array
+        Unix dates of the time steps.
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
+    stations : StationTable
+        The stations, one per column of rain_matrix.
+
+    Returns
+    -------
+    pyarrow Table
+        The map view, the reference point is in the metadata.
+
+    """
+    time_index, station_index = np.nonzero(~np.isnan(rain_matrix))
+    return pa.table({
+        'Datum': get_timestamps(time_step_list[time_index]),
+        'Stationsnamn': pa.DictionaryArray.from_arrays(
+            station_index.astype(np.int32), stations.names.tolist()),
+        'Latitud': stations.latitudes[station_index],
+        'Longitud': stations.longitudes[station_index],
+        'Regnvärde [mm]': rain_matrix[time_index, station_index]
+    }).replace_schema_metadata({
+        "Referenspunkt": f"{reference_point[0]}, {reference_point[1]}"})
+
+
+def create_intensity_table(time_step_list, rain_matrix, stations,
+                           median_matrix):
+    """
+    Create the intensity view as an Arrow table.
+
+    Parameters
+    ----------
+    time_step_list : numpy array
+        Unix dates of the time steps.
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
+    stations : StationTable
+        The stations, one per column of rain_matrix.
+    median_matrix : numpy array
+        Matrix the median is calculated from, see run_quality_control.
+
+    Returns
+    -------
+    pyarrow Table
+        The most rain over each window and when the window starts, null
+        where it could not be calculated.
+
+    """
+    names, max_rain, window_start = get_intensity_columns(
+        time_step_list, rain_matrix, stations, median_matrix)
+
+    columns = {"Stationsnamn": names}
+    for i, label in enumerate(data_processing.INTENSITY_WINDOWS):
+        missing = np.isnan(max_rain[i])
+        columns[f"Max regn {label} [mm]"] = pa.array(max_rain[i],
+                                                     from_pandas=True)
+        columns[f"Start {label}"] = pa.array(
+            np.where(missing, 0, window_start[i]).astype("datetime64[s]"),
+            pa.timestamp("s", "UTC"), mask=missing)
+
+    return pa.table(columns)
+
+
+def create_event_table(time_step_list, rain_matrix, stations, median_matrix,
+                       dry_time):
+    """
+    Create the rain event view as an Arrow table.
+
+    Parameters
+    ----------
+    time_step_list : numpy array
+        Unix dates of the time steps.
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
+    stations : StationTable
+        The stations, one per column of rain_matrix.
+    median_matrix : numpy array
+        Matrix the median is calculated from, see run_quality_control.
+    dry_time : int
+        Seconds without rain that separate two rain events.
+
+    Returns
+    -------
+    pyarrow Table
+        One row per rain event.
+
+    """
+    event_names, (_, start, end, depth, peak) = get_event_columns(
+        time_step_list, rain_matrix, stations, median_matrix, dry_time)
+    return pa.table({
+        "Stationsnamn": pa.array(event_names.tolist(), pa.string())
+        .dictionary_encode(),
+        "Start": get_timestamps(start),
+        "Slut": get_timestamps(end),
+        "Varaktighet [h]": (end - start) / 3600,
+        "Regnmängd [mm]": depth,
+        "Max intensitet [mm/h]": peak})
+
+
+def write_parquet_files(path, reference_point, time_step_list, rain_matrix,
+                        stations, reference_coordinate, views=DEFAULT_VIEWS,
+                        dry_time=data_processing.EVENT_DRY_TIME,
+                        exclude_flagged=False):
+    """
+    Write the data views as Parquet files in a zip archive.
+
+    The other parameters are the ones of write_output_file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the zip archive.
+
+    """
+    tables = create_arrow_tables(reference_point, time_step_list, rain_matrix,
+                                 stations, reference_coordinate, views,
+                                 dry_time, exclude_flagged)
+    # The files are compressed already
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as archive:
+        for title, table in tables.items():
+            with archive.open(f"{title}.parquet", "w",
+                              force_zip64=True) as file:
+                pq.write_table(table, file, compression="zstd")
+
+
+def write_feather_files(path, reference_point, time_step_list, rain_matrix,
+                        stations, reference_coordinate, views=DEFAULT_VIEWS,
+                        dry_time=data_processing.EVENT_DRY_TIME,
+                        exclude_flagged=False):
+    """
+    Write the data views as Feather files in a zip archive.
+
+    The other parameters are the ones of write_output_file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the zip archive.
+
+    """
+    tables = create_arrow_tables(reference_point, time_step_list, rain_matrix,
+                                 stations, reference_coordinate, views,
+                                 dry_time, exclude_flagged)
+    options = pa.ipc.IpcWriteOptions(compression="lz4")
+    # The files are compressed already
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_STORED) as archive:
+        for title, table in tables.items():
+            # Feather version 2 is the Arrow IPC file format
+            with archive.open(f"{title}.feather", "w",
+                              force_zip64=True) as file, \
+                    pa.ipc.new_file(file, table.schema,
+                                    options=options) as writer:
+                writer.write_table(table)
+
+
+def write_netcdf_file(path, reference_point, time_step_list, rain_matrix,
+                      stations, reference_coordinate, views=DEFAULT_VIEWS,
+                      dry_time=data_processing.EVENT_DRY_TIME,
+                      exclude_flagged=False):
+    """
+    Write the data as a NetCDF file.
+
+    The rain values are a time x station variable with the position and
+    distance of each station as coordinates, and the median is a variable
+    over time. The rain values are written for the standard and the map
+    view, which have the same data. The other parameters are the ones of
+    write_output_file.
+
+    Parameters
+    ----------
+    path : str
+        Path of the NetCDF file.
+
+    """
+    has_data = np.flatnonzero(~np.all(np.isnan(rain_matrix), axis=1))
+
+    values = rain_matrix[has_data]
+    flags, median_matrix = run_quality_control(rain_matrix, views,
+                                               exclude_flagged)
+    variables = {}
+    if 'Allmän vy' in views or 'Kartfunktion' in views:
+        variables["rain"] = (("time", "station"), values,
+                             {"units": "mm", "long_name": "Regnvärde"})
+    if "Median" in views:
+        median_values, _, _ = data_processing.calculate_median(
+            median_matrix[has_data])
+        variables["median"] = ("time", median_values,
+                               {"units": "mm",
+                                "long_name": "Medianvärde regn"})
+
+    if "Intensitet" in views:
+        _, max_rain, window_start = get_intensity_columns(
+            time_step_list, rain_matrix, stations, median_matrix)
+        window_dims = ("window", "station")
+        variables["max_rain"] = (window_dims, max_rain[:, :-1],
+                                 {"units": "mm", "long_name": "Max regn"})
+        variables["max_rain_start"] = (
+            window_dims, window_start[:, :-1].astype("datetime64[s]")
+            .astype("datetime64[ns]"))
+        variables["median_max_rain"] = (
+            "window", max_rain[:, -1],
+            {"units": "mm", "long_name": "Max regn för medianvärdet"})
+        variables["window"] = (
+            "window", [window // 60 for window
+                       in data_processing.INTENSITY_WINDOWS.values()],
+            {"units": "minutes"})
+
+    if "Regnhändelser" in views:
+        _, (event_station, start, end, depth, peak) = get_event_columns(
+            time_step_list, rain_matrix, stations, median_matrix, dry_time)
+        variables["event_station"] = (
+            "event", np.append(stations.device_ids.astype(str),
+                               "median")[event_station])
+        variables["event_start"] = (
+            "event", start.astype("datetime64[s]").astype("datetime64[ns]"))
+        variables["event_end"] = (
+            "event", end.astype("datetime64[s]").astype("datetime64[ns]"))
+        variables["event_depth"] = ("event", depth,
+                                    {"units": "mm",
+                                     "long_name": "Regnmängd"})
+        variables["event_peak"] = ("event", peak,
+                                   {"units": "mm/h",
+                                    "long_name": "Max intensitet"})
+
+    if "Kvalitetskontroll" in views:
+        variables["quality_flag"] = (
+            ("time", "station"), flags[has_data],
+            {"long_name": "Kvalitetsflagga",
+             "flag_masks": np.array([data_processing.QC_OUTLIER,
+                                     data_processing.QC_STUCK,
+                                     data_processing.QC_DRY], dtype=np.uint8),
+             "flag_meanings": "outlier stuck dry_while_others_rain"})
+        quality_names = {"Antal värden": "value_count",
+                         "Avvikande värden": "outlier_count",
+                         "Fastnade värden": "stuck_count",
+                         "Noll när andra regnar": "dry_count",
+                         "Andel flaggade [%]": "flagged_percent"}
+        for title, column in get_quality_columns(rain_matrix,
+                                                 flags).items():
+            variables[quality_names[title]] = ("station", column,
+                                               {"long_name": title})
+
+    dataset = xr.Dataset(
+        variables,
+        coords={
+            "time": np.asarray(time_step_list[has_data],
+                               dtype="datetime64[s]").astype("datetime64[ns]"),
+            "station": stations.device_ids.astype(str),
+            "name": ("station", stations.names.astype(str)),
+            "latitude": ("station", stations.latitudes,
+                         {"units": "degrees_north"}),
+            "longitude": ("station", stations.longitudes,
+                          {"units": "degrees_east"}),
+            "distance": ("station", stations.distances,
+                         {"units": "km", "long_name":
+                          f"Avstånd från punkt {reference_coordinate}"})},
+        attrs={"reference_latitude": reference_point[0],
+               "reference_longitude": reference_point[1]})
+    dataset.to_netcdf(path)
+
+
+def write_output_file(path, output_format, reference_point, time_step_list,
+                      rain_matrix, stations, reference_coordinate,
+                      views=DEFAULT_VIEWS,
+                      dry_time=data_processing.EVENT_DRY_TIME,
+                      exclude_flagged=False):
+    """
+    Write the data views to a file of the chosen format.
+
+    Parameters
+    ----------
+    path : str
+        Path of the output file, with the extension in OUTPUT_FORMATS.
+    output_format : str
+        One of the formats in OUTPUT_FORMATS.
+    reference_point : tuple of float
+        Latitude and longitude of the reference point.
+    time_step_list : numpy array
+        Unix dates of the time steps.
+    rain_matrix : numpy array
+        Matrix with time steps as rows and stations as columns.
+    stations : StationTable
+        The stations, one per column of rain_matrix.
+    reference_coordinate : str
+        String that specifies the reference coordinate, used in header.
+    views : tuple of str, optional
+        The views to write, from VIEWS. The default is
+        DEFAULT_VIEWS.
+    dry_time : int, optional
+        Seconds without rain that separate two rain events. The default is
+        EVENT_DRY_TIME of data_processing.
+    exclude_flagged : bool, optional
+        If values flagged by the quality control are left out of the
+        median. The default is False.
+
+    Raises
+    ------
+    ValueError
+        If no station has any data.
+
+    """
+    # Checked before any writer starts, so no format gets a file with only
+    # headers
+    if np.all(np.isnan(rain_matrix)):
+        raise ValueError(NO_DATA_MESSAGE)
+
+    writers = {"Excel": write_excel_file,
+               "Parquet": write_parquet_files,
+               "Feather": write_feather_files,
+               "CSV": write_csv_files,
+               "NetCDF": write_netcdf_file}
+
+    writers[output_format](path, reference_point, time_step_list,
+                           rain_matrix, stations, reference_coordinate,
+                           views, dry_time, exclude_flagged)
+
+
+def create_output_file(path, reference_point, time_step_list, rain_matrix,
+                       stations, reference_coordinate, output_format="Excel",
+                       views=DEFAULT_VIEWS,
+                       dry_time=data_processing.EVENT_DRY_TIME,
+                       exclude_flagged=False):
+    """
+    Create the data views and write them to a file.
+
+    Meant to run in a worker process, only compact arrays are sent to it and
+    only the path of the file is sent back. The time x station matrix is
+    mapped from shared memory without copying.
+
+    Parameters
+    ----------
+    path : str
+        Path of the output file.
+    reference_point : tuple of float
+        Latitude and longitude of the reference point.
+    time_step_list : numpy array
+        Unix dates of the time steps.
+    rain_matrix : SharedArray
+        Descriptor of the time x station matrix in shared memory.
+    stations : StationTable
+        The stations of the first columns of the matrix, columns after them
+        were never filled and are left out.
+    reference_coordinate : str
+        String that specifies the reference coordinate, used in header.
+    output_format : str, optional
+        One of the formats in OUTPUT_FORMATS. The default is "Excel".
+    views : tuple of str, optional
+        The views to write, from VIEWS. The default is
+        DEFAULT_VIEWS.
+    dry_time : int, optional
+        Seconds without rain that separate two rain events. The default is
+        EVENT_DRY_TIME of data_processing.
+    exclude_flagged : bool, optional
+        If values flagged by the quality control are left out of the
+        median. The default is False.
+
+    Raises
+    ------
+    ValueError
+        If no station has any data.
+
+    Returns
+    -------
+    path : str
+        Path of the written file.
+
+    """
+    with shared_arrays.attach(rain_matrix) as attached_matrix:
+        write_output_file(path, output_format, reference_point,
+                          time_step_list, attached_matrix[:, :len(stations)],
+                          stations, reference_coordinate, views, dry_time,
+                          exclude_flagged)
+
+    return path
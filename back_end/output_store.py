@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 16:05:44 2026
+
+@author: tagtyk0616
+"""
+
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from back_end.shared_store import shared_store, JOB_TIMEOUT
+
+OUTPUT_DIR = os.environ.get(
+    "NETATMO_OUTPUT_DIR",
+    os.path.join(tempfile.gettempdir(), "netatmo_outputs"))
+STAGING_DIR = os.path.join(OUTPUT_DIR, "staging")  # Files being written
+FILES_DIR = os.path.join(OUTPUT_DIR, "files")  # Finished files
+# Total size of the finished files, the least recently used are removed
+# above it
+OUTPUT_QUOTA = int(os.environ.get("NETATMO_OUTPUT_QUOTA_MB", "2048")) \
+    * 1024 ** 2
+OUTPUT_TTL = 24 * 3600  # Files that are not reused, e.g. from cancelled jobs
+KEEP_RECENT = 3600  # Files used this recently are kept for the download
+READ_LEASE = 3600  # Seconds a reader holds a file if it is never released
+
+
+def create_staging_path(file_name):
+    """
+    Get a path to write an output file to before it is finished.
+
+    Parameters
+    ----------
+    file_name : str
+        Name of the file.
+
+    Returns
+    -------
+    str
+        Path in a new directory of its own.
+
+    """
+    staging_dir = os.path.join(STAGING_DIR, uuid.uuid4().hex)
+    os.makedirs(staging_dir)
+    return os.path.join(staging_dir, file_name)
+
+
+def discard_staging(staging_path):
+    """
+    Remove an output file that was never finished.
+
+    Parameters
+    ----------
+    staging_path : str
+        Path from create_staging_path.
+
+    """
+    shutil.rmtree(os.path.dirname(staging_path), ignore_errors=True)
+
+
+def commit_output(staging_path, ttl=OUTPUT_TTL):
+    """
+    Move a written file into the store.
+
+    The file is renamed on the same file system, so it is never seen half
+    written. Old files are then evicted to keep the store within its quota.
+
+    Parameters
+    ----------
+    staging_path : str
+        Path from create_staging_path that the file was written to.
+    ttl : float, optional
+        Seconds until the file may be removed. The default is OUTPUT_TTL.
+
+    Returns
+    -------
+    str
+        Path of the file in the store.
+
+    """
+    file_dir = os.path.join(FILES_DIR, uuid.uuid4().hex)
+    os.makedirs(file_dir)
+    path = os.path.join(file_dir, os.path.basename(staging_path))
+    os.replace(staging_path, path)
+    os.rmdir(os.path.dirname(staging_path))
+
+    shared_store.put_output(path, os.path.getsize(path), ttl)
+    evict()
+    return path
+
+
+def evict():
+    """
+    Remove expired and least recently used files above the quota.
+
+    Files being read or used within KEEP_RECENT are kept. Staging
+    directories left by jobs that died while writing are removed as well.
+
+    """
+    for path in shared_store.evict_outputs(OUTPUT_QUOTA,
+                                           time.time() - KEEP_RECENT):
+        shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+
+    if not os.path.isdir(STAGING_DIR):
+        return
+
+    abandoned_before = time.time() - JOB_TIMEOUT
+    for entry in os.scandir(STAGING_DIR):
+        try:
+            if entry.stat().st_mtime < abandoned_before:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except FileNotFoundError:
+            # Finished or removed by another process meanwhile
+            pass
+
+
+@contextmanager
+def open_output(path, lease=READ_LEASE):
+    """
+    Hold an output file while it is read, it is not evicted meanwhile.
+
+    The hold is shared by all processes and expires after the lease if the
+    reader dies without releasing it.
+
+    Parameters
+    ----------
+    path : str
+        Path of the file in the store.
+    lease : float, optional
+        Seconds the file is held at most. The default is READ_LEASE.
+
+    Raises
+    ------
+    FileNotFoundError
+        If the file is not in the store.
+
+    Yields
+    ------
+    str
+        The path of the file.
+
+    """
+    reader = uuid.uuid4().hex
+    if not shared_store.acquire_output(path, reader, lease):
+        raise FileNotFoundError(path)
+
+    try:
+        yield path
+    finally:
+        shared_store.release_output(reader)
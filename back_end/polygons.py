@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 09:14:52 2026
+
+@author: tagtyk0616
+"""
+
+import numpy as np
+from back_end.api_counter import InvalidInputError
+
+EDGE_BLOCK = 256  # Polygon edges tested against all points at once
+
+
+def read_geojson_polygons(geojson):
+    """
+    Get the polygons of a GeoJSON object.
+
+    Parameters
+    ----------
+    geojson : dict
+        A FeatureCollection, Feature, Polygon or MultiPolygon.
+
+    Raises
+    ------
+    InvalidInputError
+        If the object holds no polygons.
+
+    Returns
+    -------
+    polygons : list
+        List of polygons, each a list of rings where the first ring is the
+        outer border and the rest are holes. Each ring is an array of
+        (longitude, latitude) rows.
+
+    """
+    object_type = geojson.get("type")
+    if object_type == "FeatureCollection":
+        polygons = [polygon for feature in geojson.get("features", [])
+                    for polygon in read_geojson_polygons(feature)]
+    elif object_type == "Feature":
+        polygons = read_geojson_polygons(geojson.get("geometry") or {})
+    elif object_type == "GeometryCollection":
+        polygons = [polygon for geometry in geojson.get("geometries", [])
+                    for polygon in read_geojson_polygons(geometry)]
+    elif object_type == "Polygon":
+        polygons = [geojson["coordinates"]]
+    elif object_type == "MultiPolygon":
+        polygons = geojson["coordinates"]
+    else:
+        polygons = []
+
+    polygons = [[np.asarray(ring, dtype=float)[:, :2] for ring in polygon]
+                for polygon in polygons if polygon]
+    if not polygons:
+        raise InvalidInputError("Filen innehåller inga polygoner")
+
+    return polygons
+
+
+def polygon_bounds(polygons):
+    """
+    Get the box around polygons.
+
+    Parameters
+    ----------
+    polygons : list
+        Polygons from read_geojson_polygons.
+
+    Returns
+    -------
+    tuple of floats
+        (latitude_ne, longitude_ne, latitude_sw, longitude_sw)
+
+    """
+    points = np.vstack([polygon[0] for polygon in polygons])
+    return (points[:, 1].max(), points[:, 0].max(),
+            points[:, 1].min(), points[:, 0].min())
+
+
+def points_in_polygons(latitudes, longitudes, polygons):
+    """
+    Check which points lie inside any of the polygons.
+
+    All points are tested against blocks of edges at a time with the
+    even-odd rule, so holes are handled as well.
+
+    Parameters
+    ----------
+    latitudes : numpy array
+        Latitudes of the points.
+    longitudes : numpy array
+        Longitudes of the points.
+    polygons : list
+        Polygons from read_geojson_polygons.
+
+    Returns
+    -------
+    numpy array
+        True for each point inside a polygon.
+
+    """
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    inside = np.zeros(latitudes.shape, dtype=bool)
+
+    for polygon in polygons:
+        in_polygon = np.zeros(latitudes.shape, dtype=bool)
+        for ring in polygon:
+            x_start, y_start = ring[:, 0], ring[:, 1]
+            x_end, y_end = np.roll(x_start, -1), np.roll(y_start, -1)
+            for block in range(0, len(ring), EDGE_BLOCK):
+                edges = slice(block, block + EDGE_BLOCK)
+                x0, y0 = x_start[edges, None], y_start[edges, None]
+                x1, y1 = x_end[edges, None], y_end[edges, None]
+                crosses = (y0 > latitudes) != (y1 > latitudes)
+                # Horizontal edges never cross, their division is not used
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    x_cross = x0 + (latitudes - y0) * (x1 - x0) / (y1 - y0)
+                in_polygon ^= np.logical_xor.reduce(
+                    crosses & (longitudes < x_cross), axis=0)
+
+        inside |= in_polygon
+
+    return inside
+
+
+def _orientation(ax, ay, bx, by, cx, cy):
+    return np.sign((bx - ax) * (cy - ay) - (by - ay) * (cx - ax))
+
+
+def box_intersects_polygons(latitude_ne, longitude_ne, latitude_sw,
+                            longitude_sw, polygons):
+    """
+    Check if a box overlaps any of the polygons.
+
+    Parameters
+    ----------
+    latitude_ne : float
+        North East corner of the box, latitude
+    longitude_ne : float
+        North East corner of the box, longitude
+    latitude_sw : float
+        South west corner of the box, latitude
+    longitude_sw : float
+        South west corner of the box, longitude
+    polygons : list
+        Polygons from read_geojson_polygons.
+
+    Returns
+    -------
+    bool
+        True if the box and a polygon overlap.
+
+    """
+    corner_lats = np.array([latitude_sw, latitude_sw, latitude_ne,
+                            latitude_ne])
+    corner_lons = np.array([longitude_sw, longitude_ne, longitude_ne,
+                            longitude_sw])
+    if points_in_polygons(corner_lats, corner_lons, polygons).any():
+        return True
+
+    for polygon in polygons:
+        for ring in polygon:
+            x_start, y_start = ring[:, 0], ring[:, 1]
+            if np.any((x_start >= longitude_sw) & (x_start <= longitude_ne)
+                      & (y_start >= latitude_sw) & (y_start <= latitude_ne)):
+                return True
+
+            # A polygon may pass through the box without a vertex in it
+            x_end, y_end = np.roll(x_start, -1), np.roll(y_start, -1)
+            for i in range(4):
+                cx, cy = corner_lons[i], corner_lats[i]
+                dx, dy = corner_lons[(i + 1) % 4], corner_lats[(i + 1) % 4]
+                crosses = (
+                    (_orientation(x_start, y_start, x_end, y_end, cx, cy)
+                     != _orientation(x_start, y_start, x_end, y_end, dx, dy))
+                    & (_orientation(cx, cy, dx, dy, x_start, y_start)
+                       != _orientation(cx, cy, dx, dy, x_end, y_end)))
+                if crosses.any():
+                    return True
+
+    return False
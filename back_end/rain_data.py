@@ -10,16 +10,33 @@ Created on Thu Jul 13 11:54:07 2023
 """
 
 from datetime import datetime
+import time
 import numpy as np
 import requests
 from tqdm import tqdm
 from back_end.api_counter import api_counter
+from back_end.shared_store import shared_store
+from back_end import station_coverage
 from back_end.api_counter import (InternalServerError,
                                   NetatmoGeneralError, NoActiveTokenError,
-                                  NoApiCallsLeftError, InvalidInputError)
+                                  NoApiCallsLeftError, InvalidInputError,
+                                  JobCancelledError)
 
 #from backend_handeler import MaxApiCallReachedError
 
+MEASURE_URL = "https://api.netatmo.com/api/getmeasure"
+CACHE_TTL = 30 * 24 * 3600  # Measurements for finished periods
+RECENT_CACHE_TTL = 15 * 60  # Measurements that may still change
+# Connect and read timeout of getmeasure, seconds. Closing the session of a
+# cancelled job does not stop a request in progress, it ends within these.
+MEASURE_TIMEOUT = (5, 10)
+SCALE_SECONDS = {"30min": 1800,  # Length of the time step of each scale
+                 "1hour": 3600,
+                 "3hours": 3 * 3600,
+                 "1day": 86400,
+                 "1week": 604800,
+                 "1month": 2629743}
+
 
 def is_closest_date_in_list(input_list, input_value, mode):
     """
@@ -159,18 +176,11 @@ def divide_time(date_begin, date_end, scale, limit=1024, gui=None):
         update_gui("Fel: Samma start och slutdatum")
         raise ValueError("Samma start och slutdatum")
 
-    time_options = {"30min": 1800,
-                    "1hour": 3600,
-                    "3hours": 3 * 3600,
-                    "1day": 86400,
-                    "1week": 604800,
-                    "1month": 2629743}
-
-    if scale not in time_options:
+    if scale not in SCALE_SECONDS:
         raise KeyError("Invalid scale. Expected one of '30min', '1hour',"
                        "'3hours', '1day', '1week', '1month'.")
 
-    time_step = time_options[scale]
+    time_step = SCALE_SECONDS[scale]
     whole_number = int(np.floor(span / (time_step * limit)))
     remainder = span % (time_step * limit)  # (i tid)
 
@@ -186,6 +196,80 @@ def divide_time(date_begin, date_end, scale, limit=1024, gui=None):
     return start_stop_list
 
 
+def count_time_steps(start_stop_list, scale):
+    """
+    Get the most time steps a station can have data for.
+
+    Parameters
+    ----------
+    start_stop_list : list
+        List of 2x1 matricies of start, stop value pairs from divide_time.
+    scale : str
+        The scale the chunks were divided with, API format.
+
+    Returns
+    -------
+    int
+        Upper bound of the number of measurements of one station.
+
+    """
+    time_step = SCALE_SECONDS[scale]
+    return sum(int(np.ceil((stop - start) / time_step)) + 1
+               for start, stop in start_stop_list)
+
+
+def request_measure(auth_token, params, cancel_token=None):
+    """
+    Get one chunk of measurements from Netatmo.
+
+    The response is shared between all server processes: it is taken from
+    the shared cache if possible, only one process fetches a chunk at a time
+    and every call is counted against the token's shared rate limit.
+
+    Args
+    ----
+        auth_token : string
+            Users Authorization token.
+        params : dict
+            Parameters of the getmeasure call.
+        cancel_token : CancellationToken, optional
+            Token used to abort the request.
+
+    Returns
+    -------
+        The response from Netatmo as a dictionary.
+
+    Raises
+    ------
+        NoApiCallsLeftError: If the hourly quota of the token is used.
+        JobCancelledError: If the job is cancelled during the request.
+    """
+    header = {
+        "Authorization": "Bearer " + auth_token
+    }
+    key = "|".join(str(params[name]) for name in (
+        "device_id", "module_id", "scale", "date_begin", "date_end"))
+
+    if params["date_end"] > time.time() - 24 * 3600:
+        ttl = RECENT_CACHE_TTL
+    else:
+        ttl = CACHE_TTL
+
+    def fetch():
+        # A cancelled job does not use the shared quota
+        shared_store.acquire_api_call(auth_token, cancel_token=cancel_token)
+        if cancel_token is not None:
+            response = cancel_token.get(MEASURE_URL, headers=header,
+                                        params=params,
+                                        timeout=MEASURE_TIMEOUT)
+        else:
+            response = requests.get(MEASURE_URL, headers=header,
+                                    params=params, timeout=MEASURE_TIMEOUT)
+        return response.json()
+
+    return shared_store.fetch_once(key, fetch, ttl)
+
+
 def get_values_from_individual_station(rain_data, gui=None):
     """
     Get out organized values from a rain_data response from the Netatmo api.
@@ -265,8 +349,8 @@ def get_values_from_individual_station(rain_data, gui=None):
     return date_list, rain_value_list, date_list_unix_full
 
 
-def get_all_rain_data(input_data, station, scale, start_stop_list,
-                      period_exists_list=None, gui=None):
+def get_all_rain_data(input_data, device_id, module_id, scale, start_stop_list,
+                      period_exists_list=None, gui=None, cancel_token=None):
     """
 
 
@@ -292,6 +376,9 @@ def get_all_rain_data(input_data, station, scale, start_stop_list,
         DESCRIPTION. The default is None.
     gui : TYPE, optional
         DESCRIPTION. The default is None.
+    cancel_token : CancellationToken, optional
+        Token checked between chunks, if the job is cancelled the data
+        collected so far is returned. The default is None.
 
     Raises
     ------
@@ -309,16 +396,15 @@ def get_all_rain_data(input_data, station, scale, start_stop_list,
             gui.event_queue.put(("message", message))
             # gui.progress_window.update_text_box(message)
 
-    url_2 = "https://api.netatmo.com/api/getmeasure"
-    header = {
-        "Authorization": "Bearer " + input_data.auth_token
-    }
     limit = 1024
     j = 0
     station_data_array = []
     station_data_array = np.array([], dtype=object)
-    interupted_calls = 0
     for date in tqdm(start_stop_list):
+        if cancel_token is not None and cancel_token.cancelled:
+            update_gui("Avbryter hämtning...")
+            break
+
         if period_exists_list is not None:
             start_has_values = is_closest_date_in_list(
                 period_exists_list, date[0], "begining"
@@ -328,11 +414,10 @@ def get_all_rain_data(input_data, station, scale, start_stop_list,
             )
 
             if not start_has_values and not stop_has_values:
-                interupted_calls += 1
                 continue
 
-        params = {"device_id": station.get_device_id(),
-                  "module_id": station.get_module_id(),
+        params = {"device_id": device_id,
+                  "module_id": module_id,
                   "scale": scale,
                   "type": {"sum_rain"},
                   "date_begin": date[0],
@@ -344,9 +429,13 @@ def get_all_rain_data(input_data, station, scale, start_stop_list,
         if api_counter.get_count() > 498:
             print("User usage reached")
         """
-        response_rain_data = requests.get(
-            url_2, headers=header, params=params, timeout=25)
-        rain_data = response_rain_data.json()
+        try:
+            rain_data = request_measure(
+                input_data.auth_token, params, cancel_token=cancel_token)
+        except JobCancelledError:
+            update_gui("Avbryter hämtning...")
+            break
+
         # api_counter.increment()
 
         try:
@@ -371,11 +460,55 @@ def get_all_rain_data(input_data, station, scale, start_stop_list,
                 (station_data_array, station_data_array2))
         j += 1
 
-    print("Interupted calls:", interupted_calls, "\n")
     return station_data_array
 
 
-def get_measure(input_data, station, start_stop_list, save_calls=False, gui=None):
+def probe_months(input_data, device_id, module_id, gui=None,
+                 cancel_token=None):
+    """
+    Get the monthly rain data of a station, to find the periods with data.
+
+    The months with data are saved in the shared store, where they are used
+    to rank stations by coverage.
+
+    Parameters
+    ----------
+    input_data : UserInputData object
+        An object of class UserInputData containing the users input data.
+    device_id : str
+        The device ID of the station.
+    module_id : str
+        The module ID of the rain module of the station.
+    gui : gui object, optional
+        A gui object to update gui elements. The default is None.
+    cancel_token : CancellationToken, optional
+        Token used to abort the fetch. The default is None.
+
+    Returns
+    -------
+    station_data_month : numpy array
+        The monthly data of the station, empty if it has none.
+    start_stop_list_month : list
+        List of 2x1 matricies of start, stop value pairs used for the months.
+
+    """
+    start_stop_list_month = divide_time(
+        input_data.date_begin_unix, input_data.date_end_unix, "1month", gui=gui)
+
+    station_data_month = get_all_rain_data(
+        input_data, device_id, module_id, "1month",
+        start_stop_list_month, gui=gui, cancel_token=cancel_token
+    )
+    if cancel_token is None or not cancel_token.cancelled:
+        station_coverage.record_coverage(
+            device_id, station_data_month, input_data.date_begin_unix,
+            input_data.date_end_unix)
+
+    return station_data_month, start_stop_list_month
+
+
+def get_measure(input_data, device_id, module_id, start_stop_list,
+                save_calls=False, gui=None, cancel_token=None):
     """
 
 
@@ -401,6 +534,8 @@ def get_measure(input_data, station, start_stop_list, save_calls=False, gui=None
         DESCRIPTION. The default is False.
     gui : TYPE, optional
         DESCRIPTION. The default is None.
+    cancel_token : CancellationToken, optional
+        Token used to abort the fetch. The default is None.
 
     Returns
     -------
@@ -413,14 +548,9 @@ def get_measure(input_data, station, start_stop_list, save_calls=False, gui=None
 
         time_step_month = 2629743
 
-        start_stop_list_month = divide_time(
-            input_data.date_begin_unix, input_data.date_end_unix, "1month", gui=gui)
-
-        station_data_month = get_all_rain_data(
-            input_data, station, "1month",
-            start_stop_list_month, gui=gui
-        )
-        print("station_data_month", station_data_month)
+        station_data_month, start_stop_list_month = probe_months(
+            input_data, device_id, module_id, gui=gui,
+            cancel_token=cancel_token)
         time_step_list = np.arange(
             start_stop_list_month[0][0],
             start_stop_list_month[0][1],
@@ -431,18 +561,20 @@ def get_measure(input_data, station, start_stop_list, save_calls=False, gui=None
             period_exists_list = check_if_rain_data_each_timestep(
                 station_data_month, time_step_list
             )
-            print("period_exists_list", period_exists_list)
             station_data = get_all_rain_data(
-                input_data, station, input_data.scale, start_stop_list,
+                input_data, device_id, module_id, input_data.scale,
+                start_stop_list,
                 period_exists_list=period_exists_list,
-                gui=gui
+                gui=gui, cancel_token=cancel_token
             )
             return station_data
         else:
             return []
 
     station_data = get_all_rain_data(
-        input_data, station, input_data.scale, start_stop_list, gui=gui
+        input_data, device_id, module_id, input_data.scale, start_stop_list,
+        gui=gui,
+        cancel_token=cancel_token
     )
 
     return station_data
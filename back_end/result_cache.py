@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 14:31:08 2026
+
+@author: tagtyk0616
+"""
+
+import hashlib
+import json
+import time
+import numpy as np
+from back_end.export import VIEWS
+from back_end.rain_data import CACHE_TTL, RECENT_CACHE_TTL
+from back_end.shared_store import shared_store
+
+COORDINATE_DECIMALS = 6  # About 0.1 m, clicks closer than this are the same
+
+
+def get_result_key(input_data):
+    """
+    Get the hash identifying the output of a request.
+
+    The token is left out so the same request from any user gives the same
+    key. A polygon request is identified by its polygons, the point and the
+    station amount are left out. The scale must already be in API format.
+
+    Parameters
+    ----------
+    input_data : UserInputData object
+        An object of class UserInputData containing the users input data.
+
+    Returns
+    -------
+    str
+        Hex digest of the normalized request.
+
+    """
+    request = {
+        "date_begin": input_data.date_begin,
+        "date_end": input_data.date_end,
+        "scale": input_data.scale,
+        "output_format": input_data.output_format,
+        "views": [view for view in VIEWS if view in input_data.views],
+        # The dry time only changes the file if it has the rain events
+        "dry_hours": (input_data.dry_hours
+                      if "Regnhändelser" in input_data.views else None),
+        "exclude_flagged": bool(input_data.exclude_flagged),
+    }
+    if input_data.polygons is not None:
+        # All stations in the area are used and the reference point is
+        # taken from the polygons, so only the polygons set the stations
+        request["polygons"] = [
+            [np.round(ring, COORDINATE_DECIMALS).tolist() for ring in polygon]
+            for polygon in input_data.polygons]
+    else:
+        request["latitude"] = round(float(input_data.latitude),
+                                    COORDINATE_DECIMALS)
+        request["longitude"] = round(float(input_data.longitude),
+                                     COORDINATE_DECIMALS)
+        request["station_amount"] = int(input_data.station_amount)
+
+    return hashlib.sha256(
+        json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_result_ttl(input_data):
+    """
+    Get how long the output of a request may be reused.
+
+    Parameters
+    ----------
+    input_data : UserInputData object
+        An object of class UserInputData containing the users input data.
+
+    Returns
+    -------
+    float
+        Seconds, short if the period reaches today and may get more data.
+
+    """
+    if input_data.date_end_unix > time.time() - 24 * 3600:
+        return RECENT_CACHE_TTL
+
+    return CACHE_TTL
+
+
+def find_result(input_data):
+    """
+    Get the output file of an identical earlier request.
+
+    Parameters
+    ----------
+    input_data : UserInputData object
+        An object of class UserInputData containing the users input data.
+
+    Returns
+    -------
+    str or None
+        Path of the file, None if there is no fresh file.
+
+    """
+    result = shared_store.get_result(get_result_key(input_data))
+    # The file is marked as used so it is kept for the download
+    if result is None or not shared_store.touch_output(result[0]):
+        return None
+
+    return result[0]
+
+
+def store_result(input_data, path, stations):
+    """
+    Keep an output file for identical requests.
+
+    Parameters
+    ----------
+    input_data : UserInputData object
+        An object of class UserInputData containing the users input data.
+    path : str
+        Path of the finished output file in the output store.
+    stations : StationTable
+        The stations in the file.
+
+    """
+    shared_store.put_result(get_result_key(input_data), path,
+                            list(stations.device_ids),
+                            get_result_ttl(input_data))
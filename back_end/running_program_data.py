@@ -4,3 +4,230 @@ Created on Thu Aug  3 13:16:03 2023
 
 @author: tagtyk0616
 """
+
+import threading
+import time
+import uuid
+import requests
+from back_end.api_counter import JobCancelledError
+from back_end.shared_store import shared_store
+
+JOB_TOUCH_INTERVAL = 60  # Seconds between updates of a running job
+
+
+class CancellationToken:
+    """
+    Cancellation token shared between the gui and a running job.
+
+    The token is checked by the job between chunks and stations, and before
+    each call to Netatmo is reserved, so no calls are spent after a cancel.
+    Cancelling also closes the HTTP sessions used by the job. A request
+    already in progress is not aborted by this, it ends within its timeout
+    and its response is dropped. The job is registered in the shared store,
+    so it can be cancelled from any server process.
+
+    Parameters
+    ----------
+        job_id : str, optional
+            Unique id of the job, a new id is created if not given.
+
+    Methods
+    -------
+        cancel():
+            Marks the job as cancelled and closes open HTTP sessions.
+        raise_if_cancelled():
+            Raises JobCancelledError if the job has been cancelled.
+        get(url, **kwargs):
+            Does a GET request that is aborted if the job is cancelled.
+
+    """
+
+    def __init__(self, job_id=None):
+        self.job_id = job_id if job_id is not None else uuid.uuid4().hex
+        self._last_check = 0
+        self._last_touch = time.monotonic()
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._sessions = []
+
+    @property
+    def cancelled(self):
+        if self._event.is_set():
+            return True
+
+        # Look for cancellation requested by other processes at most
+        # once a second
+        now = time.monotonic()
+        if now - self._last_check > 1:
+            self._last_check = now
+            if shared_store.is_cancel_requested(self.job_id):
+                self._cancel_local()
+
+        # The job is checked while it makes progress, so it is alive
+        if now - self._last_touch > JOB_TOUCH_INTERVAL:
+            self._last_touch = now
+            shared_store.touch_job(self.job_id)
+
+        return self._event.is_set()
+
+    def cancel(self):
+        """
+        Cancel the job and close all HTTP sessions opened by it.
+
+        """
+        shared_store.request_cancel(self.job_id)
+        self._cancel_local()
+
+    def _cancel_local(self):
+        self._event.set()
+        with self._lock:
+            sessions = list(self._sessions)
+            self._sessions.clear()
+
+        for session in sessions:
+            session.close()
+
+    def raise_if_cancelled(self):
+        """
+        Raise JobCancelledError if the job has been cancelled.
+
+        Raises
+        ------
+        JobCancelledError
+            If cancel has been called on the token.
+
+        """
+        if self.cancelled:
+            raise JobCancelledError("Jobbet avbröts av användaren")
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            self._local.session = session
+            with self._lock:
+                self._sessions.append(session)
+
+        return session
+
+    def get(self, url, **kwargs):
+        """
+        Do a GET request bound to the token.
+
+        Parameters
+        ----------
+        url : str
+            Url to request.
+        **kwargs : dict
+            Keyword arguments passed on to requests.
+
+        Raises
+        ------
+        JobCancelledError
+            If the job is cancelled before or during the request.
+
+        Returns
+        -------
+        response : requests.Response
+            The response of the request.
+
+        """
+        self.raise_if_cancelled()
+        try:
+            response = self._session().get(url, **kwargs)
+        except requests.RequestException:
+            self.raise_if_cancelled()
+            raise
+
+        self.raise_if_cancelled()
+        return response
+
+
+class JobMetrics:
+    """
+    Counters of what happened during a job.
+
+    The counters are shared by all threads of the job and are reported to
+    the user when the job is done.
+
+    Methods
+    -------
+        increment(name, amount=1):
+            Adds amount to the counter name.
+        add_item(name, item):
+            Counts item under name, items are only counted once.
+        get(name):
+            Returns the value of the counter name.
+        as_dict():
+            Returns a copy of all counters.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._items = {}
+
+    def increment(self, name, amount=1):
+        """
+        Add to a counter.
+
+        Parameters
+        ----------
+        name : str
+            Name of the counter.
+        amount : int, optional
+            Amount to add. The default is 1.
+
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def add_item(self, name, item):
+        """
+        Count an item, such as a device id, only once.
+
+        Parameters
+        ----------
+        name : str
+            Name of the counter.
+        item : hashable
+            The item to count.
+
+        """
+        with self._lock:
+            if item not in self._items.setdefault(name, set()):
+                self._items[name].add(item)
+                self._counters[name] = self._counters.get(name, 0) + 1
+
+    def get(self, name):
+        """
+        Get the value of a counter.
+
+        Parameters
+        ----------
+        name : str
+            Name of the counter.
+
+        Returns
+        -------
+        int
+            The value of the counter, 0 if never incremented.
+
+        """
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def as_dict(self):
+        """
+        Get all counters.
+
+        Returns
+        -------
+        dict
+            Copy of the counters.
+
+        """
+        with self._lock:
+            return dict(self._counters)
@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 15:05:36 2026
+
+@author: tagtyk0616
+"""
+
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+import numpy as np
+
+SharedArray = namedtuple("SharedArray", ["name", "shape", "dtype"])
+
+
+class SharedArrayStore:
+    """
+    Numpy arrays placed in shared memory for the worker processes.
+
+    Only the small SharedArray descriptors are pickled when sending work to
+    a worker process, the worker maps the arrays without copying them. The
+    store owns the shared memory blocks and removes them when it is closed,
+    use it as a context manager around the job.
+
+    Methods
+    -------
+        create(shape, fill_value):
+            Creates a new array in shared memory to be filled in place.
+        close():
+            Frees all shared memory blocks of the store.
+
+    """
+
+    def __init__(self):
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def create(self, shape, fill_value=np.nan, dtype=np.float64):
+        """
+        Create a new array in shared memory.
+
+        Parameters
+        ----------
+        shape : tuple of int
+            Shape of the array.
+        fill_value : float, optional
+            Initial value of all elements. The default is NaN.
+        dtype : numpy dtype, optional
+            Data type of the array. The default is float64.
+
+        Returns
+        -------
+        descriptor : SharedArray
+            Descriptor used to map the array in another process.
+        array : numpy array
+            The array, backed by the shared memory block.
+
+        """
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        block = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+        self._blocks.append(block)
+        array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        array.fill(fill_value)
+        return SharedArray(block.name, tuple(shape), dtype.str), array
+
+    def close(self):
+        """
+        Free all shared memory blocks of the store.
+
+        """
+        for block in self._blocks:
+            try:
+                block.close()
+            except BufferError:
+                # An array created by the store is still referenced, the
+                # memory is released when it is garbage collected
+                pass
+            block.unlink()
+
+        self._blocks = []
+
+
+@contextmanager
+def attach(descriptor):
+    """
+    Map an array from shared memory without copying it.
+
+    The array is only valid inside the with block and must not be kept
+    after it.
+
+    Parameters
+    ----------
+    descriptor : SharedArray
+        Descriptor of the array.
+
+    Yields
+    ------
+    numpy array
+        The array, backed by the shared memory block.
+
+    """
+    # The block is only closed here, never unlinked, the owning store does
+    # that. Worker processes share the resource tracker of the server so
+    # the block is not removed when a worker exits.
+    block = shared_memory.SharedMemory(name=descriptor.name)
+    try:
+        yield np.ndarray(descriptor.shape, dtype=np.dtype(descriptor.dtype),
+                         buffer=block.buf)
+    finally:
+        try:
+            block.close()
+        except BufferError:
+            # The array is still referenced, the mapping is released when
+            # the worker process ends
+            pass
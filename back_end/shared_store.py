@@ -0,0 +1,821 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:12:41 2026
+
+@author: tagtyk0616
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from back_end.api_counter import NoApiCallsLeftError
+
+DB_PATH = os.environ.get(
+    "NETATMO_SHARED_DB",
+    os.path.join(tempfile.gettempdir(), "netatmo_panel_app.sqlite"))
+
+# Netatmo allows 50 calls per 10 seconds and 500 calls per hour per user
+CALLS_PER_10_SECONDS = 50
+CALLS_PER_HOUR = 500
+FETCH_LEASE = 60  # Seconds a worker may hold a fetch before others take over
+AREA_LEASE = 300  # Seconds a worker may hold the fetch of an area
+JOB_TIMEOUT = 3 * 3600  # Jobs not updated for this long are seen as dead
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS measure_cache (
+    key TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS measure_cache_expires ON measure_cache (expires_at);
+CREATE TABLE IF NOT EXISTS fetch_claims (
+    key TEXT PRIMARY KEY,
+    owner TEXT NOT NULL,
+    lease_until REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS api_calls (
+    token_key TEXT NOT NULL,
+    called_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS api_calls_token ON api_calls (token_key, called_at);
+CREATE TABLE IF NOT EXISTS stations (
+    device_id TEXT PRIMARY KEY,
+    module_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS station_areas (
+    lat_cell INTEGER NOT NULL,
+    lon_cell INTEGER NOT NULL,
+    refreshed_at REAL NOT NULL,
+    PRIMARY KEY (lat_cell, lon_cell)
+);
+CREATE TABLE IF NOT EXISTS station_months (
+    device_id TEXT NOT NULL,
+    month TEXT NOT NULL,
+    has_data INTEGER NOT NULL,
+    checked_at REAL NOT NULL,
+    PRIMARY KEY (device_id, month)
+);
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    device_ids TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS outputs (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS output_readers (
+    reader TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    lease_until REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id TEXT PRIMARY KEY,
+    token_key TEXT NOT NULL,
+    description TEXT NOT NULL,
+    status TEXT NOT NULL,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    started_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+def hash_token(auth_token):
+    """
+    Hash an authorization token so it is never stored in clear text.
+
+    Parameters
+    ----------
+    auth_token : str
+        Users authorization token.
+
+    Returns
+    -------
+    str
+        Hex digest identifying the token.
+
+    """
+    return hashlib.sha256(auth_token.encode("utf-8")).hexdigest()
+
+
+class SharedStore:
+    """
+    State shared between all server processes through a SQLite file.
+
+    SQLite's file locking makes it safe to use the same file from several
+    processes started with ``panel serve --num-procs``. The store holds the
+    measurement cache, the known stations and the areas they were fetched
+    for, the output files and who is reading them, the running jobs and the
+    calls made per token so that workers do not fetch the same data twice
+    or together exceed the Netatmo quota.
+
+    Parameters
+    ----------
+        path : str
+            Path to the SQLite file.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        # Connections are kept per thread and per process, a connection
+        # must never be shared over a fork.
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def acquire_api_call(self, auth_token, cancel_token=None):
+        """
+        Reserve one call to the Netatmo api for the token.
+
+        Blocks until the call fits within the per 10 seconds limit, shared by
+        all processes using the token.
+
+        Parameters
+        ----------
+        auth_token : str
+            Users authorization token.
+        cancel_token : CancellationToken, optional
+            Token of the job making the call, no call is reserved once it is
+            cancelled. The default is None.
+
+        Raises
+        ------
+        NoApiCallsLeftError
+            If the hourly quota of the token has been used.
+        JobCancelledError
+            If the job is cancelled before the call is reserved.
+
+        """
+        token_key = hash_token(auth_token)
+        while True:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+
+            with self._transaction() as connection:
+                now = time.time()
+                connection.execute(
+                    "DELETE FROM api_calls WHERE token_key = ? "
+                    "AND called_at < ?", (token_key, now - 3600))
+                (hour_count,) = connection.execute(
+                    "SELECT COUNT(*) FROM api_calls WHERE token_key = ?",
+                    (token_key,)).fetchone()
+                if hour_count >= CALLS_PER_HOUR:
+                    raise NoApiCallsLeftError
+
+                recent_calls = connection.execute(
+                    "SELECT called_at FROM api_calls WHERE token_key = ? "
+                    "AND called_at > ? ORDER BY called_at",
+                    (token_key, now - 10)).fetchall()
+                if len(recent_calls) < CALLS_PER_10_SECONDS:
+                    connection.execute(
+                        "INSERT INTO api_calls VALUES (?, ?)",
+                        (token_key, now))
+                    return
+
+                wait = recent_calls[0][0] + 10 - now
+
+            time.sleep(max(wait, 0.05))
+
+    def get_cached(self, key):
+        """
+        Get a cached api response.
+
+        Parameters
+        ----------
+        key : str
+            Cache key.
+
+        Returns
+        -------
+        dict or None
+            The cached response or None if missing or expired.
+
+        """
+        row = self._connection().execute(
+            "SELECT payload FROM measure_cache WHERE key = ? "
+            "AND expires_at > ?", (key, time.time())).fetchone()
+        if row is None:
+            return None
+
+        return json.loads(row[0])
+
+    def put_cached(self, key, payload, ttl):
+        """
+        Cache an api response.
+
+        Parameters
+        ----------
+        key : str
+            Cache key.
+        payload : dict
+            The api response.
+        ttl : float
+            Seconds until the response expires.
+
+        """
+        self._connection().execute(
+            "INSERT OR REPLACE INTO measure_cache VALUES (?, ?, ?)",
+            (key, json.dumps(payload), time.time() + ttl))
+
+    def _claim(self, key, owner):
+        with self._transaction() as connection:
+            now = time.time()
+            row = connection.execute(
+                "SELECT owner, lease_until FROM fetch_claims WHERE key = ?",
+                (key,)).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                return False
+
+            connection.execute(
+                "INSERT OR REPLACE INTO fetch_claims VALUES (?, ?, ?)",
+                (key, owner, now + FETCH_LEASE))
+            return True
+
+    def _release(self, key, owner):
+        self._connection().execute(
+            "DELETE FROM fetch_claims WHERE key = ? AND owner = ?",
+            (key, owner))
+
+    def fetch_once(self, key, fetch, ttl):
+        """
+        Get a response from the cache or fetch it, once over all processes.
+
+        If another process is already fetching the same key this waits for
+        its result instead of making the same call again.
+
+        Parameters
+        ----------
+        key : str
+            Cache key.
+        fetch : callable
+            Function without arguments returning the api response as a dict.
+        ttl : float
+            Seconds the response is cached.
+
+        Returns
+        -------
+        dict
+            The api response.
+
+        """
+        owner = f"{os.getpid()}-{threading.get_ident()}"
+        while True:
+            payload = self.get_cached(key)
+            if payload is not None:
+                return payload
+
+            if self._claim(key, owner):
+                break
+
+            time.sleep(0.2)
+
+        try:
+            payload = fetch()
+            # Errors from Netatmo are never cached
+            if "body" in payload:
+                self.put_cached(key, payload, ttl)
+        finally:
+            self._release(key, owner)
+
+        return payload
+
+    def _claim_areas(self, cells, owner, fetched_after):
+        with self._transaction() as connection:
+            now = time.time()
+            claimed = []
+            waiting = []
+            for lat_cell, lon_cell in cells:
+                row = connection.execute(
+                    "SELECT refreshed_at FROM station_areas WHERE lat_cell = ? "
+                    "AND lon_cell = ?", (lat_cell, lon_cell)).fetchone()
+                if row is not None and row[0] >= fetched_after:
+                    continue
+
+                row = connection.execute(
+                    "SELECT owner, lease_until FROM fetch_claims WHERE key = ?",
+                    (f"area|{lat_cell}|{lon_cell}",)).fetchone()
+                if row is not None and row[0] != owner and row[1] > now:
+                    waiting.append((lat_cell, lon_cell))
+                else:
+                    claimed.append((lat_cell, lon_cell))
+
+            connection.executemany(
+                "INSERT OR REPLACE INTO fetch_claims VALUES (?, ?, ?)",
+                [(f"area|{lat_cell}|{lon_cell}", owner, now + AREA_LEASE)
+                 for lat_cell, lon_cell in claimed])
+
+        return claimed, waiting
+
+    def _release_areas(self, cells, owner):
+        with self._transaction() as connection:
+            connection.executemany(
+                "DELETE FROM fetch_claims WHERE key = ? AND owner = ?",
+                [(f"area|{lat_cell}|{lon_cell}", owner)
+                 for lat_cell, lon_cell in cells])
+
+    def fetch_areas_once(self, cells, fetch, fetched_after,
+                         cancel_token=None):
+        """
+        Fetch the stations of grid cells, once over all processes.
+
+        Cells fetched after fetched_after are skipped. Cells another process
+        is fetching are waited for instead of fetched again, unless its
+        claim runs out after AREA_LEASE seconds.
+
+        Parameters
+        ----------
+        cells : list
+            List of (lat_cell, lon_cell) tuples.
+        fetch : callable
+            Function fetching the stations of a list of cells.
+        fetched_after : float
+            Unix time after which a fetch of a cell is still used.
+        cancel_token : CancellationToken, optional
+            Token of the job fetching the cells, it stops waiting for other
+            processes once cancelled. The default is None.
+
+        Raises
+        ------
+        JobCancelledError
+            If the job is cancelled while waiting.
+
+        """
+        owner = f"{os.getpid()}-{threading.get_ident()}"
+        while True:
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+
+            claimed, waiting = self._claim_areas(cells, owner, fetched_after)
+            if claimed:
+                try:
+                    fetch(claimed)
+                    self.mark_areas_refreshed(claimed)
+                finally:
+                    self._release_areas(claimed, owner)
+            elif waiting:
+                time.sleep(0.2)
+            else:
+                return
+
+    def put_stations(self, stations):
+        """
+        Save or update known stations.
+
+        Parameters
+        ----------
+        stations : list
+            List of (device_id, module_id, name, latitude, longitude) tuples.
+
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO stations VALUES (?, ?, ?, ?, ?, ?)",
+                [(*station, now) for station in stations])
+
+    def get_stations(self, seen_after=0):
+        """
+        Get all known stations.
+
+        Parameters
+        ----------
+        seen_after : float, optional
+            Only return stations seen after this unix time. The default is 0.
+
+        Returns
+        -------
+        list
+            List of (device_id, module_id, name, latitude, longitude,
+            last_seen) tuples.
+
+        """
+        return self._connection().execute(
+            "SELECT device_id, module_id, name, latitude, longitude, "
+            "last_seen FROM stations WHERE last_seen > ?",
+            (seen_after,)).fetchall()
+
+    def get_area_refresh_times(self, cells):
+        """
+        Get when the stations of grid cells were last fetched.
+
+        Parameters
+        ----------
+        cells : list
+            List of (lat_cell, lon_cell) tuples.
+
+        Returns
+        -------
+        dict
+            Unix time of the last fetch per cell, cells never fetched are
+            missing.
+
+        """
+        connection = self._connection()
+        refresh_times = {}
+        for lat_cell, lon_cell in cells:
+            row = connection.execute(
+                "SELECT refreshed_at FROM station_areas WHERE lat_cell = ? "
+                "AND lon_cell = ?", (lat_cell, lon_cell)).fetchone()
+            if row is not None:
+                refresh_times[(lat_cell, lon_cell)] = row[0]
+
+        return refresh_times
+
+    def mark_areas_refreshed(self, cells):
+        """
+        Mark the stations of grid cells as fetched now.
+
+        Parameters
+        ----------
+        cells : list
+            List of (lat_cell, lon_cell) tuples.
+
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO station_areas VALUES (?, ?, ?)",
+                [(*cell, now) for cell in cells])
+
+    def put_station_months(self, device_id, months):
+        """
+        Save which months a station has data for.
+
+        Parameters
+        ----------
+        device_id : str
+            The device ID of the station.
+        months : dict
+            True or False for each month in "YYYY-MM" format.
+
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO station_months VALUES (?, ?, ?, ?)",
+                [(device_id, month, int(has_data), now)
+                 for month, has_data in months.items()])
+
+    def get_station_months(self, device_ids, months):
+        """
+        Get how many months of a period stations are known to have data for.
+
+        Parameters
+        ----------
+        device_ids : list of str
+            The device IDs of the stations.
+        months : list of str
+            The months of the period in "YYYY-MM" format.
+
+        Returns
+        -------
+        dict
+            (months checked, months with data) per device ID, stations never
+            checked are missing.
+
+        """
+        connection = self._connection()
+        known_months = {}
+        for device_id in device_ids:
+            row = connection.execute(
+                "SELECT COUNT(*), SUM(has_data) FROM station_months "
+                "WHERE device_id = ? AND month BETWEEN ? AND ?",
+                (device_id, months[0], months[-1])).fetchone()
+            if row[0]:
+                known_months[device_id] = (row[0], row[1])
+
+        return known_months
+
+    def get_result(self, key):
+        """
+        Get a finished output file.
+
+        Parameters
+        ----------
+        key : str
+            Hash of the request that created the file.
+
+        Returns
+        -------
+        tuple or None
+            (path, device_ids) of the file, None if missing or expired.
+
+        """
+        row = self._connection().execute(
+            "SELECT path, device_ids FROM results WHERE key = ? "
+            "AND expires_at > ?", (key, time.time())).fetchone()
+        if row is None:
+            return None
+
+        return row[0], json.loads(row[1])
+
+    def put_result(self, key, path, device_ids, ttl):
+        """
+        Save a finished output file.
+
+        Parameters
+        ----------
+        key : str
+            Hash of the request that created the file.
+        path : str
+            Path of the file.
+        device_ids : list of str
+            The device IDs of the stations in the file.
+        ttl : float
+            Seconds the file may be used for the same request.
+
+        """
+        now = time.time()
+        self._connection().execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+            (key, path, json.dumps(device_ids), now, now + ttl))
+
+    def put_output(self, path, size, ttl):
+        """
+        Save an output file written to the output store.
+
+        Parameters
+        ----------
+        path : str
+            Path of the file.
+        size : int
+            Size of the file in bytes.
+        ttl : float
+            Seconds until the file may be deleted.
+
+        """
+        now = time.time()
+        self._connection().execute(
+            "INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)",
+            (path, size, now, now + ttl))
+
+    def touch_output(self, path):
+        """
+        Mark an output file as used now.
+
+        Parameters
+        ----------
+        path : str
+            Path of the file.
+
+        Returns
+        -------
+        bool
+            False if the file is not in the store.
+
+        """
+        cursor = self._connection().execute(
+            "UPDATE outputs SET last_used = ? WHERE path = ?",
+            (time.time(), path))
+        return cursor.rowcount > 0
+
+    def acquire_output(self, path, reader, lease):
+        """
+        Register a reader of an output file, it is not deleted while read.
+
+        Parameters
+        ----------
+        path : str
+            Path of the file.
+        reader : str
+            Unique id of the reader.
+        lease : float
+            Seconds the reader holds the file unless released before.
+
+        Returns
+        -------
+        bool
+            False if the file is not in the store.
+
+        """
+        now = time.time()
+        with self._transaction() as connection:
+            cursor = connection.execute(
+                "UPDATE outputs SET last_used = ? WHERE path = ?",
+                (now, path))
+            if cursor.rowcount == 0:
+                return False
+
+            connection.execute(
+                "INSERT OR REPLACE INTO output_readers VALUES (?, ?, ?)",
+                (reader, path, now + lease))
+            return True
+
+    def release_output(self, reader):
+        """
+        Remove a reader of an output file.
+
+        Parameters
+        ----------
+        reader : str
+            Unique id of the reader.
+
+        """
+        self._connection().execute(
+            "DELETE FROM output_readers WHERE reader = ?", (reader,))
+
+    def evict_outputs(self, quota, used_before):
+        """
+        Remove output files from the store to keep it within its quota.
+
+        Expired files are removed first, then the least recently used ones
+        until the total size is within the quota. Files being read or used
+        after used_before are kept. The files are removed from the results
+        in the same transaction, so they are no longer handed out. Finished
+        jobs, jobs not updated within JOB_TIMEOUT, expired api responses and
+        fetch claims whose lease has run out are removed as well, so the
+        shared file does not grow without limit.
+
+        Parameters
+        ----------
+        quota : int
+            Total size of the files in bytes.
+        used_before : float
+            Only files last used before this unix time are removed.
+
+        Returns
+        -------
+        list of str
+            Paths of the removed files, to be deleted from disk.
+
+        """
+        with self._transaction() as connection:
+            now = time.time()
+            connection.execute(
+                "DELETE FROM output_readers WHERE lease_until <= ?", (now,))
+            connection.execute(
+                "DELETE FROM jobs WHERE status != 'running' "
+                "OR updated_at < ?", (now - JOB_TIMEOUT,))
+            connection.execute(
+                "DELETE FROM measure_cache WHERE expires_at <= ?", (now,))
+            connection.execute(
+                "DELETE FROM fetch_claims WHERE lease_until <= ?", (now,))
+            rows = connection.execute(
+                "SELECT path, size, last_used, expires_at, EXISTS("
+                "SELECT 1 FROM output_readers "
+                "WHERE output_readers.path = outputs.path) "
+                "FROM outputs ORDER BY last_used").fetchall()
+
+            total_size = sum(row[1] for row in rows)
+            evicted = []
+            for path, size, last_used, expires_at, in_use in rows:
+                if in_use or last_used >= used_before:
+                    continue
+                if expires_at <= now or total_size > quota:
+                    evicted.append(path)
+                    total_size -= size
+
+            for path in evicted:
+                connection.execute("DELETE FROM outputs WHERE path = ?",
+                                   (path,))
+                connection.execute("DELETE FROM results WHERE path = ?",
+                                   (path,))
+
+        return evicted
+
+    def register_job(self, job_id, auth_token, description):
+        """
+        Register a running job so it is visible to all processes.
+
+        Parameters
+        ----------
+        job_id : str
+            Unique id of the job.
+        auth_token : str
+            Users authorization token.
+        description : str
+            Description of the job.
+
+        """
+        now = time.time()
+        self._connection().execute(
+            "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, 'running', 0, ?, ?)",
+            (job_id, hash_token(auth_token), description, now, now))
+
+    def finish_job(self, job_id, status="done"):
+        """
+        Mark a job as finished.
+
+        Parameters
+        ----------
+        job_id : str
+            Unique id of the job.
+        status : str, optional
+            Final status of the job. The default is "done".
+
+        """
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, updated_at = ? WHERE job_id = ?",
+            (status, time.time(), job_id))
+
+    def touch_job(self, job_id):
+        """
+        Mark a job as still running.
+
+        Parameters
+        ----------
+        job_id : str
+            Unique id of the job.
+
+        """
+        self._connection().execute(
+            "UPDATE jobs SET updated_at = ? WHERE job_id = ? "
+            "AND status = 'running'", (time.time(), job_id))
+
+    def request_cancel(self, job_id):
+        """
+        Ask the process running the job to cancel it.
+
+        Parameters
+        ----------
+        job_id : str
+            Unique id of the job.
+
+        """
+        self._connection().execute(
+            "UPDATE jobs SET cancel_requested = 1 WHERE job_id = ?",
+            (job_id,))
+
+    def is_cancel_requested(self, job_id):
+        """
+        Check if cancellation of a job has been requested.
+
+        Parameters
+        ----------
+        job_id : str
+            Unique id of the job.
+
+        Returns
+        -------
+        bool
+            True if the job should be cancelled.
+
+        """
+        row = self._connection().execute(
+            "SELECT cancel_requested FROM jobs WHERE job_id = ?",
+            (job_id,)).fetchone()
+        return row is not None and bool(row[0])
+
+    def running_jobs(self, auth_token=None):
+        """
+        Get the jobs currently running in any process.
+
+        Parameters
+        ----------
+        auth_token : str, optional
+            Only return jobs for this token. The default is None.
+
+        Returns
+        -------
+        list
+            List of (job_id, description, started_at) tuples.
+
+        """
+        query = "SELECT job_id, description, started_at FROM jobs " \
+            "WHERE status = 'running' AND updated_at > ?"
+        params = [time.time() - JOB_TIMEOUT]
+        if auth_token is not None:
+            query += " AND token_key = ?"
+            params.append(hash_token(auth_token))
+
+        return self._connection().execute(query, params).fetchall()
+
+
+shared_store = SharedStore(DB_PATH)
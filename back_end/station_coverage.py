@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 19:02:47 2026
+
+@author: tagtyk0616
+"""
+
+from datetime import datetime, timezone
+import time
+import numpy as np
+from back_end.shared_store import shared_store
+
+# Candidates looked up per requested station, the spare ones replace
+# stations without data
+CANDIDATE_FACTOR = 2
+MIN_COVERAGE = 0.05  # Coverage used for ranking stations almost without data
+
+
+def get_period_months(date_begin, date_end):
+    """
+    Get the calendar months of a period.
+
+    Parameters
+    ----------
+    date_begin : float or int
+        Start of the period, UNIX format.
+    date_end : float or int
+        End of the period, UNIX format.
+
+    Returns
+    -------
+    list of str
+        The months in "YYYY-MM" format.
+
+    """
+    begin = datetime.fromtimestamp(date_begin, timezone.utc)
+    end = datetime.fromtimestamp(date_end, timezone.utc)
+    months = []
+    year, month = begin.year, begin.month
+    while (year, month) <= (end.year, end.month):
+        months.append(f"{year:04d}-{month:02d}")
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+    return months
+
+
+def get_month_of_dates(unix_dates):
+    """
+    Get the calendar month of dates.
+
+    Parameters
+    ----------
+    unix_dates : numpy array
+        Dates in UNIX format.
+
+    Returns
+    -------
+    list of str
+        The months in "YYYY-MM" format.
+
+    """
+    return [datetime.fromtimestamp(unix_date, timezone.utc).strftime("%Y-%m")
+            for unix_date in unix_dates]
+
+
+def record_coverage(device_id, station_data_month, date_begin, date_end):
+    """
+    Save which months of a period a station has data for.
+
+    Only months that have ended are saved, the current month may still get
+    data.
+
+    Parameters
+    ----------
+    device_id : str
+        The device ID of the station.
+    station_data_month : numpy array
+        Monthly data of the station with dates in UNIX format on dimention 2,
+        empty if the station had no data.
+    date_begin : float or int
+        Start of the period, UNIX format.
+    date_end : float or int
+        End of the period, UNIX format.
+
+    """
+    months_with_data = set()
+    if np.size(station_data_month) != 0:
+        # Monthly values are stamped at local midnight, half a day later is
+        # safely within the month in UTC
+        months_with_data = set(get_month_of_dates(
+            np.asarray(station_data_month[2, :], dtype=float) + 43200))
+
+    current_month = get_period_months(time.time(), time.time())[0]
+    shared_store.put_station_months(device_id, {
+        month: month in months_with_data
+        for month in get_period_months(date_begin, date_end)
+        if month < current_month})
+
+
+def get_coverage(stations, date_begin, date_end):
+    """
+    Get the part of a period the stations are expected to have data for.
+
+    Months never checked for a station are expected to have data.
+
+    Parameters
+    ----------
+    stations : StationTable
+        The stations.
+    date_begin : float or int
+        Start of the period, UNIX format.
+    date_end : float or int
+        End of the period, UNIX format.
+
+    Returns
+    -------
+    numpy array
+        Coverage between 0 and 1 for each station.
+
+    """
+    months = get_period_months(date_begin, date_end)
+    known_months = shared_store.get_station_months(
+        list(stations.device_ids), months)
+
+    coverage = np.ones(len(stations))
+    for i, device_id in enumerate(stations.device_ids):
+        checked, with_data = known_months.get(device_id, (0, 0))
+        coverage[i] = (len(months) - checked + with_data) / len(months)
+
+    return coverage
+
+
+def rank_candidates(candidates, date_begin, date_end):
+    """
+    Order candidate stations by distance and expected data coverage.
+
+    The distance of each station is divided by its coverage, so a station
+    with data for half the period ranks as if it was twice as far away.
+    Stations known to have no data in the period are ranked last.
+
+    Parameters
+    ----------
+    candidates : StationTable
+        The candidate stations with their distances.
+    date_begin : float or int
+        Start of the period, UNIX format.
+    date_end : float or int
+        End of the period, UNIX format.
+
+    Returns
+    -------
+    StationTable
+        The candidates, best first.
+
+    """
+    coverage = get_coverage(candidates, date_begin, date_end)
+    ranking = np.where(coverage > 0,
+                       candidates.distances / np.maximum(coverage,
+                                                         MIN_COVERAGE),
+                       np.inf)
+    return candidates.take(np.lexsort((candidates.distances, ranking)))
@@ -0,0 +1,588 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 17:21:08 2026
+
+@author: tagtyk0616
+"""
+
+import threading
+import time
+from functools import partial
+import numpy as np
+from back_end import station_info, polygons
+from back_end.station_info import StationTable, haversine_distance
+from back_end.shared_store import shared_store
+
+CELL_SIZE = 0.02  # Size of the grid cells, in lat/long
+STATION_TTL = 30 * 24 * 3600  # Stations not seen for this long are dropped
+REFRESH_AFTER = 7 * 24 * 3600  # Areas older than this are fetched again
+RELOAD_INTERVAL = 60  # Seconds between reloads from the shared store
+START_DISTANCE = 5  # Radius of the first station search, km
+MAX_DISTANCE = 80  # Largest radius searched for stations, km
+POLYGON_TILE_SIZE = 0.1  # Tiles tested against polygon areas, in lat/long
+KM_PER_DEGREE = np.pi * station_info.EARTH_RADIUS / 180
+LON_CELLS = int(round(360 / CELL_SIZE))  # Cells around the earth
+
+
+def get_cells(latitudes, longitudes):
+    """
+    Get the grid cells of coordinates.
+
+    Parameters
+    ----------
+    latitudes : float or numpy array
+        Latitudes in degrees.
+    longitudes : float or numpy array
+        Longitudes in degrees.
+
+    Returns
+    -------
+    lat_cells : int or numpy array
+        Latitude index of the cells.
+    lon_cells : int or numpy array
+        Longitude index of the cells.
+
+    """
+    lat_cells = np.floor(np.asarray(latitudes) / CELL_SIZE).astype(np.int64)
+    lon_cells = np.floor(np.asarray(longitudes) / CELL_SIZE).astype(np.int64)
+    return lat_cells, lon_cells
+
+
+def cells_in_box(latitude_ne, longitude_ne, latitude_sw, longitude_sw):
+    """
+    Get the grid cells covering a box.
+
+    Parameters
+    ----------
+    latitude_ne : float
+        North East corner of area, latitude
+    longitude_ne : float
+        North East corner of area, longitude
+    latitude_sw : float
+        South west corner of area, latitude
+    longitude_sw : float
+        South west corner of area, longitude
+
+    Returns
+    -------
+    list
+        List of (lat_cell, lon_cell) tuples of all cells overlapping the box.
+
+    """
+    # Borders lying on the grid are not moved a cell by rounding errors
+    lat_cells = range(int(np.floor(latitude_sw / CELL_SIZE + 1e-9)),
+                      int(np.ceil(latitude_ne / CELL_SIZE - 1e-9)))
+    lon_cells = range(int(np.floor(longitude_sw / CELL_SIZE + 1e-9)),
+                      int(np.ceil(longitude_ne / CELL_SIZE - 1e-9)))
+    return [(lat_cell, lon_cell)
+            for lat_cell in lat_cells for lon_cell in lon_cells]
+
+
+def cell_boxes(cells):
+    """
+    Group grid cells into as few boxes as the rows of cells allow.
+
+    Cells next to each other in a row are joined, and rows with the same
+    joined cells are stacked, so a ring of cells around a box becomes four
+    boxes.
+
+    Parameters
+    ----------
+    cells : list
+        List of (lat_cell, lon_cell) tuples.
+
+    Returns
+    -------
+    list
+        List of ((latitude_ne, longitude_ne, latitude_sw, longitude_sw),
+        cells) tuples, one per box with the cells it covers.
+
+    """
+    rows = {}
+    for lat_cell, lon_cell in sorted(set(cells)):
+        runs = rows.setdefault(lat_cell, [])
+        if runs and runs[-1][1] == lon_cell - 1:
+            runs[-1][1] = lon_cell
+        else:
+            runs.append([lon_cell, lon_cell])
+
+    # Boxes still growing northwards, keyed by their columns
+    open_boxes = {}
+    boxes = []
+    for lat_cell in sorted(rows):
+        for lon_start, lon_end in rows[lat_cell]:
+            box = open_boxes.get((lon_start, lon_end))
+            if box is not None and box[1] == lat_cell - 1:
+                box[1] = lat_cell
+            else:
+                box = [lat_cell, lat_cell]
+                open_boxes[(lon_start, lon_end)] = box
+                boxes.append((box, lon_start, lon_end))
+
+    return [(((lat_end + 1) * CELL_SIZE, (lon_end + 1) * CELL_SIZE,
+              lat_start * CELL_SIZE, lon_start * CELL_SIZE),
+             [(lat_cell, lon_cell)
+              for lat_cell in range(lat_start, lat_end + 1)
+              for lon_cell in range(lon_start, lon_end + 1)])
+            for (lat_start, lat_end), lon_start, lon_end in boxes]
+
+
+def fetch_boxes(cells):
+    """
+    Get the boxes to fetch grid cells with, in as few calls as possible.
+
+    Netatmo counts calls and not area, so the cells are fetched either as
+    the boxes of cell_boxes or as one box around them all, whichever
+    crawl_stations splits into fewer tiles. A ring around a small area
+    fetched before is cheaper as one box, a ring around a large area as
+    four.
+
+    Parameters
+    ----------
+    cells : list
+        List of (lat_cell, lon_cell) tuples.
+
+    Returns
+    -------
+    list
+        List of (latitude_ne, longitude_ne, latitude_sw, longitude_sw)
+        tuples.
+
+    """
+    def count_calls(box):
+        lat_tiles, lon_tiles = station_info.count_tiles(*box)
+        return lat_tiles * lon_tiles
+
+    boxes = [box for box, _ in cell_boxes(cells)]
+    lat_cells, lon_cells = zip(*cells)
+    bounding_box = ((max(lat_cells) + 1) * CELL_SIZE,
+                    (max(lon_cells) + 1) * CELL_SIZE,
+                    min(lat_cells) * CELL_SIZE, min(lon_cells) * CELL_SIZE)
+    if count_calls(bounding_box) <= sum(count_calls(box) for box in boxes):
+        return [bounding_box]
+
+    return boxes
+
+
+def get_search_box(latitude, longitude, distance):
+    """
+    Get the smallest box containing all points within a distance of a point.
+
+    Parameters
+    ----------
+    latitude : float
+        Latitude of the center point.
+    longitude : float
+        Longitude of the center point.
+    distance : float
+        Distance from the center point, km.
+
+    Returns
+    -------
+    tuple of floats
+        (latitude_ne, longitude_ne, latitude_sw, longitude_sw)
+
+    """
+    lat_half = distance / KM_PER_DEGREE
+    # Degrees of longitude get shorter towards the poles, use the width at
+    # the edge of the box furthest from the equator
+    lowest_cos = np.cos(np.radians(min(abs(latitude) + lat_half, 89)))
+    lon_half = lat_half / lowest_cos
+    return (latitude + lat_half, longitude + lon_half,
+            latitude - lat_half, longitude - lon_half)
+
+
+class StationIndex:
+    """
+    Spatial index of all rain stations seen, for nearest station lookups.
+
+    The stations are kept in the shared store and loaded into a grid of
+    CELL_SIZE degrees, sorted so the stations of each cell are one slice of
+    the table. Nearest station queries search the cells ring by ring around
+    the reference point, without calling Netatmo. The store also remembers
+    when the stations of each cell were last fetched, areas never fetched
+    or older than REFRESH_AFTER are fetched from getpublicdata by the job
+    that uses them. Large areas are fetched in tiles, so the
+    index can also be filled for a whole region at once with ensure_area.
+
+    Parameters
+    ----------
+        store : SharedStore
+            The store holding the known stations.
+
+    Methods
+    -------
+        reload():
+            Loads the stations from the shared store.
+        ensure_cells(auth_token, cells, gui=None, metrics=None,
+                     cancel_token=None):
+            Makes sure the stations of grid cells are known.
+        ensure_area(auth_token, latitude_ne, longitude_ne, latitude_sw,
+                    longitude_sw, gui=None, metrics=None, cancel_token=None):
+            Makes sure the stations of an area are known.
+        nearest(latitude, longitude, amount, max_distance=None):
+            Returns the known stations closest to a point.
+        find_stations(auth_token, latitude, longitude, amount, gui=None,
+                      metrics=None, cancel_token=None):
+            Searches a growing area until enough stations are found.
+        within_polygons(polygons):
+            Returns the known stations inside polygons.
+        find_stations_in_polygons(auth_token, polygons, gui=None,
+                                  metrics=None, cancel_token=None):
+            Fetches the area of polygons and returns the stations inside.
+
+    """
+
+    def __init__(self, store):
+        self._store = store
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._stations = StationTable()
+        self._cells = {}
+
+    def reload(self):
+        """
+        Load the stations seen within STATION_TTL from the shared store.
+
+        """
+        rows = self._store.get_stations(seen_after=time.time() - STATION_TTL)
+        stations = StationTable(*list(zip(*rows))[:5]) if rows \
+            else StationTable()
+
+        lat_cells, lon_cells = get_cells(stations.latitudes,
+                                         stations.longitudes)
+        order = np.lexsort((lon_cells, lat_cells))
+        stations = stations.take(order)
+        keys = np.stack([lat_cells[order], lon_cells[order]], axis=1)
+        unique_keys, starts = np.unique(keys, axis=0, return_index=True)
+        ends = np.append(starts[1:], len(stations))
+        cells = {(int(lat_cell), int(lon_cell)): (start, end)
+                 for (lat_cell, lon_cell), start, end
+                 in zip(unique_keys, starts, ends)}
+
+        with self._lock:
+            self._stations = stations
+            self._cells = cells
+            self._loaded_at = time.monotonic()
+
+    def _invalidate(self):
+        # The stations are loaded once when next used, not after each fetch
+        with self._lock:
+            self._loaded_at = None
+
+    def _current(self):
+        if self._loaded_at is None \
+                or time.monotonic() - self._loaded_at > RELOAD_INTERVAL:
+            self.reload()
+
+        with self._lock:
+            return self._stations, self._cells
+
+    def _fetch_area(self, auth_token, cells, gui=None, metrics=None,
+                    cancel_token=None):
+        # Stations found are saved in the shared store by crawl_boxes
+        station_info.crawl_boxes(auth_token, fetch_boxes(cells), gui=gui,
+                                 metrics=metrics, cancel_token=cancel_token)
+
+    def ensure_cells(self, auth_token, cells, gui=None, metrics=None,
+                     cancel_token=None):
+        """
+        Make sure the stations of grid cells are known by the index.
+
+        Cells never fetched, or not fetched within REFRESH_AFTER, are
+        fetched from Netatmo at once, all in one crawl, with the token,
+        metrics and cancellation of the job. Only the cells that need it are
+        fetched, so a search area grown around an area already fetched only
+        costs the ring around it. Cells another process is fetching are
+        waited for instead of fetched again.
+
+        Parameters
+        ----------
+        auth_token : str
+            Users authorization token.
+        cells : list
+            List of (lat_cell, lon_cell) tuples.
+        gui : gui object, optional
+            A gui object to update gui elements. The default is None.
+        metrics : JobMetrics, optional
+            Metrics of the job the cells are fetched for.
+            The default is None.
+        cancel_token : CancellationToken, optional
+            Token used to stop the fetch. The default is None.
+
+        """
+        refresh_times = self._store.get_area_refresh_times(cells)
+        now = time.time()
+
+        missing = [cell for cell in cells
+                   if refresh_times.get(cell, 0) < now - REFRESH_AFTER]
+
+        if missing:
+            # Processes asking for the same area at once fetch it only once
+            self._store.fetch_areas_once(
+                missing, partial(self._fetch_area, auth_token, gui=gui,
+                                 metrics=metrics, cancel_token=cancel_token),
+                now - REFRESH_AFTER, cancel_token=cancel_token)
+            self._invalidate()
+
+    def ensure_area(self, auth_token, latitude_ne, longitude_ne, latitude_sw,
+                    longitude_sw, gui=None, metrics=None, cancel_token=None):
+        """
+        Make sure the stations of an area are known by the index.
+
+        The area is widened to the grid cells covering it, see ensure_cells.
+
+        Parameters
+        ----------
+        auth_token : str
+            Users authorization token.
+        latitude_ne : float
+            North East corner of area, latitude
+        longitude_ne : float
+            North East corner of area, longitude
+        latitude_sw : float
+            South west corner of area, latitude
+        longitude_sw : float
+            South west corner of area, longitude
+        gui : gui object, optional
+            A gui object to update gui elements. The default is None.
+        metrics : JobMetrics, optional
+            Metrics of the job the area is fetched for. The default is None.
+        cancel_token : CancellationToken, optional
+            Token used to stop the fetch. The default is None.
+
+        """
+        self.ensure_cells(
+            auth_token,
+            cells_in_box(latitude_ne, longitude_ne, latitude_sw, longitude_sw),
+            gui=gui, metrics=metrics, cancel_token=cancel_token)
+
+    def nearest(self, latitude, longitude, amount, max_distance=None):
+        """
+        Get the known stations closest to a point, sorted by distance.
+
+        The grid is searched ring by ring around the point until the rings
+        searched are known to hold the nearest stations. The rings wrap
+        around the antimeridian.
+
+        Parameters
+        ----------
+        latitude : float
+            Latitude of the reference point.
+        longitude : float
+            Longitude of the reference point.
+        amount : int
+            Number of stations to return.
+        max_distance : float, optional
+            Only return stations within this distance in km.
+            The default is None.
+
+        Returns
+        -------
+        StationTable
+            The nearest stations in ascending distance order, with the
+            distances from the reference point.
+
+        """
+        stations, cells = self._current()
+        if not cells:
+            return StationTable()
+
+        center_lat, center_lon = get_cells(latitude, longitude)
+        cell_keys = np.array(list(cells))
+        lon_steps = np.abs(cell_keys[:, 1] - center_lon) % LON_CELLS
+        lon_steps = np.minimum(lon_steps, LON_CELLS - lon_steps)
+        last_ring = int(max(np.abs(cell_keys[:, 0] - center_lat).max(),
+                            lon_steps.max()))
+
+        slices = []
+        # Wide rings reach the same cells from both sides
+        found = set()
+        ring = 0
+        while True:
+            for lat_cell in range(center_lat - ring, center_lat + ring + 1):
+                if abs(lat_cell - center_lat) == ring:
+                    lon_cells = range(center_lon - ring, center_lon + ring + 1)
+                else:
+                    lon_cells = (center_lon - ring, center_lon + ring)
+
+                for lon_cell in lon_cells:
+                    cell = (lat_cell,
+                            (lon_cell + LON_CELLS // 2) % LON_CELLS
+                            - LON_CELLS // 2)
+                    if cell in cells and cell not in found:
+                        found.add(cell)
+                        slices.append(np.arange(*cells[cell]))
+
+            # Stations outside the searched rings are at least this far away
+            lowest_cos = np.cos(np.radians(
+                min(abs(latitude) + (ring + 1) * CELL_SIZE, 90)))
+            searched_distance = ring * CELL_SIZE * KM_PER_DEGREE * lowest_cos
+
+            if ring >= last_ring or (max_distance is not None
+                                     and searched_distance >= max_distance):
+                break
+
+            if slices:
+                indices = np.concatenate(slices)
+                distances = haversine_distance(
+                    stations.latitudes[indices], stations.longitudes[indices],
+                    latitude, longitude)
+                if np.count_nonzero(distances <= searched_distance) >= amount:
+                    break
+
+            ring += 1
+
+        if not slices:
+            return StationTable()
+
+        candidates = stations.take(np.concatenate(slices))
+        candidates.save_distances_from(latitude, longitude)
+        if max_distance is not None:
+            candidates = candidates.take(candidates.distances <= max_distance)
+
+        return candidates.nearest(amount)
+
+    def find_stations(self, auth_token, latitude, longitude, amount,
+                      gui=None, metrics=None, cancel_token=None):
+        """
+        Find the stations closest to a point in a growing search area.
+
+        The search starts within START_DISTANCE km and the distance is
+        doubled until the requested amount of stations is found within it,
+        so only the area needed is fetched from Netatmo. Each search area
+        is served from the index as far as it has been fetched before, so
+        each doubling only fetches the ring outside the last area. Devices
+        without a rain module are never in the index, so the next nearest
+        stations take their place.
+
+        Parameters
+        ----------
+        auth_token : str
+            Users authorization token.
+        latitude : float
+            Latitude of the reference point.
+        longitude : float
+            Longitude of the reference point.
+        amount : int
+            Number of stations to find.
+        gui : gui object, optional
+            A gui object to update gui elements. The default is None.
+        metrics : JobMetrics, optional
+            Metrics of the job the stations are found for.
+            The default is None.
+        cancel_token : CancellationToken, optional
+            Token used to stop the search. The default is None.
+
+        Returns
+        -------
+        StationTable
+            The nearest stations in ascending distance order, fewer than
+            amount if there are not enough within MAX_DISTANCE km.
+
+        """
+        distance = START_DISTANCE
+        while True:
+            if gui is not None:
+                gui.event_queue.put((
+                    "message", f"Söker stationer inom {distance} km"))
+
+            self.ensure_area(auth_token,
+                             *get_search_box(latitude, longitude, distance),
+                             gui=gui, metrics=metrics,
+                             cancel_token=cancel_token)
+            stations = self.nearest(latitude, longitude, amount,
+                                    max_distance=distance)
+            if len(stations) >= amount or distance >= MAX_DISTANCE:
+                break
+
+            distance = min(2 * distance, MAX_DISTANCE)
+
+        return stations
+
+    def within_polygons(self, polygon_list):
+        """
+        Get the known stations inside polygons.
+
+        Parameters
+        ----------
+        polygon_list : list
+            Polygons from polygons.read_geojson_polygons.
+
+        Returns
+        -------
+        StationTable
+            The stations inside any of the polygons.
+
+        """
+        stations, _ = self._current()
+        latitude_ne, longitude_ne, latitude_sw, longitude_sw = \
+            polygons.polygon_bounds(polygon_list)
+        in_bounds = np.flatnonzero(
+            (stations.latitudes >= latitude_sw)
+            & (stations.latitudes <= latitude_ne)
+            & (stations.longitudes >= longitude_sw)
+            & (stations.longitudes <= longitude_ne))
+        candidates = stations.take(in_bounds)
+        return candidates.take(polygons.points_in_polygons(
+            candidates.latitudes, candidates.longitudes, polygon_list))
+
+    def find_stations_in_polygons(self, auth_token, polygon_list, gui=None,
+                                  metrics=None, cancel_token=None):
+        """
+        Find all stations inside polygons.
+
+        The box around the polygons is split into tiles on the grid and only
+        the cells of the tiles overlapping a polygon are fetched, in one
+        crawl and only if not fetched before.
+
+        Parameters
+        ----------
+        auth_token : str
+            Users authorization token.
+        polygon_list : list
+            Polygons from polygons.read_geojson_polygons.
+        gui : gui object, optional
+            A gui object to update gui elements. The default is None.
+        metrics : JobMetrics, optional
+            Metrics of the job the stations are found for.
+            The default is None.
+        cancel_token : CancellationToken, optional
+            Token used to stop the search. The default is None.
+
+        Returns
+        -------
+        StationTable
+            The stations inside the polygons sorted by distance from the
+            center of the polygons.
+
+        """
+        latitude_ne, longitude_ne, latitude_sw, longitude_sw = \
+            polygons.polygon_bounds(polygon_list)
+        latitudes = np.arange(
+            np.floor(latitude_sw / POLYGON_TILE_SIZE) * POLYGON_TILE_SIZE,
+            latitude_ne, POLYGON_TILE_SIZE)
+        longitudes = np.arange(
+            np.floor(longitude_sw / POLYGON_TILE_SIZE) * POLYGON_TILE_SIZE,
+            longitude_ne, POLYGON_TILE_SIZE)
+        tiles = [(latitude + POLYGON_TILE_SIZE, longitude + POLYGON_TILE_SIZE,
+                  latitude, longitude)
+                 for latitude in latitudes for longitude in longitudes]
+        tiles = [tile for tile in tiles
+                 if polygons.box_intersects_polygons(*tile, polygon_list)]
+
+        if gui is not None:
+            gui.event_queue.put((
+                "message", f"Hämtar stationer i {len(tiles)} rutor"))
+
+        cells = {cell for tile in tiles for cell in cells_in_box(*tile)}
+        self.ensure_cells(auth_token, sorted(cells), gui=gui, metrics=metrics,
+                          cancel_token=cancel_token)
+
+        stations = self.within_polygons(polygon_list)
+        stations.save_distances_from((latitude_ne + latitude_sw) / 2,
+                                     (longitude_ne + longitude_sw) / 2)
+        return stations.nearest(len(stations))
+
+
+station_index = StationIndex(shared_store)
@@ -5,314 +5,258 @@ Created on Tue Jul 11 15:56:55 2023
 @author: tagtyk0616
 """
 
+import codecs
+import json
+import re
+import sys
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import requests
 import numpy as np
 from back_end.api_counter import (InternalServerError,
                                   NetatmoGeneralError, NoActiveTokenError,
                                   NoApiCallsLeftError, InvalidInputError)
-
-
-class RainStation:
+from back_end.shared_store import shared_store
+
+EARTH_RADIUS = 6371.0088  # Mean earth radius, km
+PUBLICDATA_URL = "https://api.netatmo.com/api/getpublicdata"
+# Tiles returning this many stations may have been cut off by Netatmo
+PUBLICDATA_LIMIT = 500
+MAX_TILE_SIZE = 0.5  # Largest tile fetched in one call, in lat/long
+MIN_TILE_SIZE = 0.01  # Capped tiles are not split below this, in lat/long
+CRAWL_WORKERS = 4  # Tiles fetched at the same time
+STREAM_CHUNK_SIZE = 64 * 1024  # Bytes read at a time from getpublicdata
+# Connect and read timeout of getpublicdata, seconds. The read timeout is the
+# longest wait for the next part of the response, not for all of it.
+PUBLICDATA_TIMEOUT = (5, 10)
+BODY_START = re.compile(r'"body"\s*:\s*\[')
+
+
+def haversine_distance(latitudes, longitudes, ref_latitude, ref_longitude):
     """
-    Represents a rain station.
+    Calculate the great circle distance from a reference point.
+
+    Works on single coordinates as well as on arrays of coordinates, in
+    which case all distances are calculated at once.
 
     Parameters
     ----------
-        name : str
-            The name of the rain station.
-        device_id : str, optional
-            The device ID of the rain station.
-        module_id : str, optional
-            The module ID of the rain station.
-        latitude : float, optional
-            The latitude coordinate of the rain station.
-        longitude : float, optional
-            The longitude coordinate of the rain station.
-
-    Attributes
-    ----------
-        name : str
-            The name of the rain station.
-        device_id :str
-            The device ID of the rain station.
-        module_id : str
-            The module ID of the rain station.
-        latitude : float
-            The latitude coordinate of the rain station.
-        longitude : float
-            The longitude coordinate of the rain station.
-        data : list
-            A list of data associated with the rain station.
-        distance_from : float
-            The distance from a reference point.
+        latitudes : float or numpy array
+            Latitudes in degrees.
+        longitudes : float or numpy array
+            Longitudes in degrees.
+        ref_latitude : float
+            Latitude of the reference point in degrees.
+        ref_longitude : float
+            Longitude of the reference point in degrees.
 
-    Methods
+    Returns
     -------
-        update_name(name):
-            Updates the name of the rain station.
-        update_device_id(device_id):
-            Updates the device ID of the rain station.
-        update_module_id(module_id):
-            Updates the module ID of the rain station.
-        update_latitude(latitude):
-            Updates the latitude coordinate of the rain station.
-        update_longitude(longitude):
-            Updates the longitude coordinate of the rain station.
-        update_data(data):
-            Updates the data associated with the rain station.
-        save_distance_from(ref_latitude, ref_longitude):
-            Calculates and saves the distance from a reference point.
-        get_name():
-            Returns the name of the rain station.
-        get_device_id():
-            Returns the device ID of the rain station.
-        get_module_id():
-            Returns the module ID of the rain station.
-        get_latitude():
-            Returns the latitude coordinate of the rain station.
-        get_longitude():
-            Returns the longitude coordinate of the rain station.
-        get_data():
-            Returns the data associated with the rain station.
-        get_distance():
-            Returns the distance from the reference point.
-        calculate_distance_from_point(ref_latitude, ref_longitude):
-            Calculates the distance from a given point.
+    float or numpy array
+        Distances in km.
 
     """
+    latitudes = np.radians(latitudes)
+    ref_latitude = np.radians(ref_latitude)
+    delta_latitude = latitudes - ref_latitude
+    delta_longitude = np.radians(longitudes) - np.radians(ref_longitude)
 
-    def __init__(self, name, device_id="", module_id="", coordinates=(0, 0)):
-        """
-        Initialize a RainStation object.
-
-        Parameters
-        ----------
-            name : str
-                The name of the rain station.
-            device_id : str, optional
-                The device ID of the rain station.
-            module_id : str, optional
-                The module ID of the rain station.
-            coorinates : tuple of float, optional
-                Fist value is the latitude coordinate of the rain station.
-                Second value is the longitude coordinate of the rain station.
-
-        """
-        self.name = name
-        self.device_id = device_id
-        self.module_id = module_id
-        self.latitude = coordinates[0]
-        self.longitude = coordinates[1]
-        self.data = []
-        self.distance_from = None
-
-    def update_name(self, name):
-        """
-        Update the name of the rain station.
-
-        Parameters
-        ----------
-            name : str
-                The new name of the rain station.
-
-        """
-        self.name = name
+    a = np.sin(delta_latitude / 2) ** 2 + np.cos(latitudes) \
+        * np.cos(ref_latitude) * np.sin(delta_longitude / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.minimum(a, 1)))
 
-    def update_device_id(self, device_id):
-        """
-        Update the device ID of the rain station.
 
-        Parameters
-        ----------
-            device_id : str
-                The new device ID of the rain station.
+class StationTable:
+    """
+    Columnar table of rain stations.
 
-        """
-        self.device_id = device_id
+    Stations are stored as one array per attribute and are referred to by
+    their integer index, which is also their column in the time x station
+    matrix. Names are interned so equal names share one string.
 
-    def update_module_id(self, module_id):
-        """
-        Update the module ID of the rain station.
+    Parameters
+    ----------
+        device_ids : list of str
+            The device IDs of the rain stations.
+        module_ids : list of str
+            The module IDs of the rain stations.
+        names : list of str
+            The names of the rain stations.
+        latitudes : list of float
+            The latitude coordinates of the rain stations.
+        longitudes : list of float
+            The longitude coordinates of the rain stations.
+        distances : list of float, optional
+            The distances from a reference point in km, NaN if not given.
 
-        Parameters
-        ----------
-            module_id : str
-                The new module ID of the rain station.
+    Methods
+    -------
+        save_distances_from(ref_latitude, ref_longitude):
+            Calculates and saves the distances from a reference point.
+        take(indices):
+            Returns a new table with the stations at indices.
+        nearest(amount):
+            Returns a new table with the nearest stations sorted by distance.
+        get_name(i):
+            Returns the name of station i.
+        get_device_id(i):
+            Returns the device ID of station i.
+        get_module_id(i):
+            Returns the module ID of station i.
+        get_latitude(i):
+            Returns the latitude coordinate of station i.
+        get_longitude(i):
+            Returns the longitude coordinate of station i.
+        get_distance(i):
+            Returns the distance of station i from the reference point.
 
-        """
-        self.module_id = module_id
+    """
 
-    def update_latitude(self, latitude):
-        """
-        Update the latitude coordinate of the rain station.
+    __slots__ = ("device_ids", "module_ids", "names", "latitudes",
+                 "longitudes", "distances")
+
+    def __init__(self, device_ids=(), module_ids=(), names=(), latitudes=(),
+                 longitudes=(), distances=None):
+        self.device_ids = np.array(
+            [sys.intern(str(device_id)) for device_id in device_ids],
+            dtype=object)
+        self.module_ids = np.array(
+            [sys.intern(str(module_id)) for module_id in module_ids],
+            dtype=object)
+        self.names = np.array([sys.intern(str(name)) for name in names],
+                              dtype=object)
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        if distances is None:
+            self.distances = np.full(len(self.latitudes), np.nan)
+        else:
+            self.distances = np.asarray(distances, dtype=float)
+
+    def __len__(self):
+        return len(self.device_ids)
+
+    def save_distances_from(self, ref_latitude, ref_longitude):
+        """
+        Calculate and save the distances from a reference point.
 
         Parameters
         ----------
-            latitude : float
-                The new latitude coordinate of the rain station.
+            ref_latitude : float
+                The latitude coordinate of the reference point.
+            ref_longitude : float
+                The longitude coordinate of the reference point.
 
         """
-        self.latitude = latitude
+        self.distances = haversine_distance(
+            self.latitudes, self.longitudes, ref_latitude, ref_longitude)
 
-    def update_longitude(self, longitude):
+    def take(self, indices):
         """
-        Update the longitude coordinate of the rain station.
+        Get a new table with the stations at the given indices.
 
         Parameters
         ----------
-            longitude : float
-                The new longitude coordinate of the rain station.
-
-        """
-        self.longitude = longitude
+            indices : numpy array
+                Integer indices or boolean mask of the stations.
 
-    def update_data(self, data):
-        """
-        Update the data associated with the rain station.
-
-        Parameters
-        ----------
-            data : list
-                The new data associated with the rain station.
+        Returns
+        -------
+            StationTable: The selected stations in the order of indices.
 
         """
-        self.data = data
+        return StationTable(self.device_ids[indices], self.module_ids[indices],
+                            self.names[indices], self.latitudes[indices],
+                            self.longitudes[indices], self.distances[indices])
 
-    def find_scale_factor_to_km(self, latitude):
+    def nearest(self, amount):
         """
+        Get the stations closest to the reference point, sorted by distance.
 
+        Only the nearest stations are sorted, they are first picked out with
+        a partial selection in linear time.
 
         Parameters
         ----------
-        latitude : TYPE
-            DESCRIPTION.
+            amount : int
+                Number of stations to return.
 
         Returns
         -------
-        latitude_to_km : TYPE
-            DESCRIPTION.
-        longitude_to_km : TYPE
-            DESCRIPTION.
-
-        """
-        longitude_to_km = 40075 * np.cos(latitude) / 360
-        latitude_to_km = 111.32
-        return latitude_to_km, longitude_to_km
-
-    def save_distance_from(self, ref_latitude, ref_longitude):
-        """
-        Calculate and save the distance from a reference point.
-
-        Parameters
-        ----------
-            ref_latitude : float
-                The latitude coordinate of the reference point.
-            ref_longitude : float
-                The longitude coordinate of the reference point.
+            StationTable: The nearest stations in ascending distance order.
 
         """
-        mid_latitude = (self.latitude + ref_latitude)/2
-        latidue_to_km, longitude_to_km = self.find_scale_factor_to_km(
-            mid_latitude)
+        if amount < len(self):
+            nearest = np.argpartition(self.distances, amount - 1)[:amount]
+        else:
+            nearest = np.arange(len(self))
 
-        self.distance_from = np.sqrt((latidue_to_km*(self.latitude - ref_latitude))**2 +
-                                     (longitude_to_km*(self.longitude - ref_longitude))**2)
+        return self.take(
+            nearest[np.argsort(self.distances[nearest], kind="stable")])
 
-    def get_name(self):
+    def get_name(self, i):
         """
-        Get the name of the rain station.
+        Get the name of a rain station.
 
         Returns
         -------
             str: The name of the rain station.
 
         """
-        return self.name
+        return self.names[i]
 
-    def get_device_id(self):
+    def get_device_id(self, i):
         """
-        Get the device ID of the rain station.
+        Get the device ID of a rain station.
 
         Returns
         -------
             str: The device ID of the rain station.
 
         """
-        return self.device_id
+        return self.device_ids[i]
 
-    def get_module_id(self):
+    def get_module_id(self, i):
         """
-        Get the module ID of the rain station.
+        Get the module ID of a rain station.
 
         Returns
         -------
             str: The module ID of the rain station.
 
         """
-        return self.module_id
+        return self.module_ids[i]
 
-    def get_latitude(self):
+    def get_latitude(self, i):
         """
-        Get the latitude coordinate of the rain station.
+        Get the latitude coordinate of a rain station.
 
         Returns
         -------
             float: The latitude coordinate of the rain station.
 
         """
-        return self.latitude
+        return float(self.latitudes[i])
 
-    def get_longitude(self):
+    def get_longitude(self, i):
         """
-        Get the longitude coordinate of the rain station.
+        Get the longitude coordinate of a rain station.
 
         Returns
         -------
             float: The longitude coordinate of the rain station.
 
         """
-        return self.longitude
+        return float(self.longitudes[i])
 
-    def get_data(self):
-        """
-        Get the data associated with the rain station.
-
-        Returns
-        -------
-            list: The data associated with the rain station.
-
-        """
-        return self.data
-
-    def get_distance(self):
+    def get_distance(self, i):
         """
         Get the distance from the reference point.
 
         Returns
         -------
-            float: The distance from the reference point.
-
-        """
-        return self.distance_from
+            float: The distance from the reference point in km.
 
-    def calculate_distance_from_point(self, ref_latitude, ref_longitude):
         """
-        Calculate the distance from a given point.
-
-        Parameters
-        ----------
-            ref_latitude (float):
-                The latitude coordinate of the reference point.
-            ref_longitude (float):
-                The longitude coordinate of the reference point.
-
-        Returns
-        -------
-            float: The distance from the given point.
-
-        """
-        return np.sqrt((self.latitude - ref_latitude)**2 +
-                       (self.longitude - ref_longitude)**2)
+        return float(self.distances[i])
 
 
 def calculate_corner_coorinates(latitude, longitude, radius):
@@ -344,57 +288,123 @@ def calculate_corner_coorinates(latitude, longitude, radius):
     return latitude_ne, longitude_ne, latitude_sw, longitude_sw
 
 
-def quicksort_rain_station_list(rain_station_list, test=False):
+def raise_netatmo_error(response_json):
     """
-    Quicksort the station list based on distance from point.
+    Raise the error matching an error response from Netatmo.
+
+    Args
+    ----
+        response_json : dict
+            The response from Netatmo.
+
+    Raises
+    ------
+        The exception matching the error presented by Netatmo.
+
+    """
+    error_message = response_json.get("error")
+    if error_message == {'code': 500, 'message': 'Internal Server Error'}:
+        raise InternalServerError
+    if error_message == {'code': 2, 'message': 'Invalid access_token'}:
+        raise NoActiveTokenError
+    if error_message == {'code': 26, 'message': 'User usage reached'}:
+        raise NoApiCallsLeftError
+
+    raise NetatmoGeneralError(error_message)
+
+
+def _slim_device(device):
+    # Only the parts used by parse_public_data are kept, the measures of
+    # all modules are dropped
+    place = device["place"]
+    return {
+        "_id": device["_id"],
+        "place": {key: place[key] for key in ("location", "street", "city")
+                  if key in place},
+        "module_types": {module: module_type for module, module_type
+                         in device.get("module_types", {}).items()
+                         if module_type == "NAModule3"},
+    }
 
-    Parameters
-    ----------
-        rain_station_list : list
-            The rain station list that should be sorted based on distance
-        test : Bool
-            optional parameter, used for testing that the list is correctly sorted
-        Returns
-    -------
-    Sorted rain_staion_list in accending order
 
+def stream_public_devices(chunks):
     """
+    Parse the devices of a getpublicdata response while it is downloaded.
 
-    def partition(rain_station_list, low, high):
-        pivot = rain_station_list[high].get_distance()
-        i = low - 1
+    Devices are decoded one at a time from the body list and only their id,
+    place and rain module are kept, so the full response is never held in
+    memory.
 
-        for j in range(low, high):
-            if rain_station_list[j].get_distance() <= pivot:
-                i += 1
-                (rain_station_list[i], rain_station_list[j]) = \
-                    (rain_station_list[j], rain_station_list[i])
+    Args
+    ----
+        chunks : iterable of bytes
+            The response body in chunks.
 
-        (rain_station_list[i + 1], rain_station_list[high]) = \
-            (rain_station_list[high], rain_station_list[i + 1])
+    Yields
+    ------
+        The devices, with only the keys used by parse_public_data.
 
-        return i + 1
+    Raises
+    ------
+        The exception matching the error presented by Netatmo if the
+        response has no body.
 
-    def quicksort(rain_station_list, low, high):
-        if low < high:
-            part = partition(rain_station_list, low, high)
-            quicksort(rain_station_list, low, part - 1)
-            quicksort(rain_station_list, part + 1, high)
+    """
+    chunks = iter(chunks)
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    json_decoder = json.JSONDecoder()
+    buffer = ""
+
+    def read_more():
+        nonlocal buffer
+        for chunk in chunks:
+            text = text_decoder.decode(chunk)
+            if text:
+                buffer += text
+                return True
+
+        buffer += text_decoder.decode(b"", final=True)
+        return False
+
+    while True:
+        match = BODY_START.search(buffer)
+        if match is not None:
+            position = match.end()
+            break
+
+        if not read_more():
+            # No body in the response, it is an error message
+            raise_netatmo_error(json.loads(buffer))
+
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n,":
+            position += 1
+
+        if position < len(buffer) and buffer[position] == "]":
+            return
 
-    quicksort(rain_station_list, 0, len(rain_station_list) - 1)
-    if test:
-        k = 0
-        for station in rain_station_list:
-            print(f"{k} ", station.get_distance())
-            k += 1
+        try:
+            device, position = json_decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # The device is not fully downloaded yet
+            buffer = buffer[position:]
+            position = 0
+            if not read_more():
+                raise
 
-    return rain_station_list
+            continue
 
+        yield _slim_device(device)
 
-def get_station_from_coords(auth_token, latitude_ne, longitude_ne, latitude_sw,
-                            longitude_sw, required_data="rain", gui=None):
+
+def request_public_data(auth_token, latitude_ne, longitude_ne, latitude_sw,
+                        longitude_sw, required_data="rain", cancel_token=None):
     """
-    Get rain station information from Netatmo using their Api.
+    Get the public stations within an area from Netatmo.
+
+    The response is parsed while it is downloaded, see stream_public_devices.
+    The call is counted against the token's shared rate limit, and not made
+    at all once the job is cancelled.
 
     Args
     ----
@@ -410,28 +420,19 @@ def get_station_from_coords(auth_token, latitude_ne, longitude_ne, latitude_sw,
             South west corner of area, longitude
         required_data : string, optional
             Set to rain, application currently only addapted for rain data
+        cancel_token : CancellationToken, optional
+            Token used to abort the request.
 
     Returns
     -------
-        Returns a list of Rain_station objects containing name, device_id,
-        module_id, latitude, longitude, and distance from center of longitude
-        and latitude input parameters of the rain station,
-        found within the range.
+        List of the devices in the body of the response.
 
     Raises
     ------
-        ValueError: If the rain module NAModule3 is not present
-        in one of the stations.
-        KeyError: If there is no body present in the response,
-        returns the error presented by Netatmo.
+        NoApiCallsLeftError: If the hourly quota of the token is used.
+        JobCancelledError: If the job is cancelled during the request.
 
     """
-
-    def update_gui(message):
-        if gui is not None:
-            gui.event_queue.put(("message", message))
-
-    url = "https://api.netatmo.com/api/getpublicdata"
     header = {
         "Authorization": "Bearer " + auth_token
     }
@@ -442,23 +443,52 @@ def get_station_from_coords(auth_token, latitude_ne, longitude_ne, latitude_sw,
               "required_data": required_data
               }
 
-    response = requests.get(url, headers=header, params=params, timeout=25)
-    stations_in_area = response.json()
+    # A cancelled job does not use the shared quota
+    shared_store.acquire_api_call(auth_token, cancel_token=cancel_token)
+    if cancel_token is not None:
+        response = cancel_token.get(PUBLICDATA_URL, headers=header,
+                                    params=params, timeout=PUBLICDATA_TIMEOUT,
+                                    stream=True)
+    else:
+        response = requests.get(PUBLICDATA_URL, headers=header, params=params,
+                                timeout=PUBLICDATA_TIMEOUT, stream=True)
+
+    with response:
+        try:
+            devices = list(stream_public_devices(
+                response.iter_content(chunk_size=STREAM_CHUNK_SIZE)))
+        except requests.RequestException:
+            # Cancelling closes the session while the response is read
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            raise
+
+    if cancel_token is not None:
+        cancel_token.raise_if_cancelled()
+
+    return devices
+
+
+def parse_public_data(body, metrics=None):
+    """
+    Get the rain stations from a getpublicdata response.
+
+    Devices without the rain module NAModule3 are skipped.
 
-    try:
-        body = stations_in_area["body"]
-    except KeyError as exc:
-        error_message = stations_in_area.get("error")
-        if error_message == {'code': 500, 'message': 'Internal Server Error'}:
-            raise InternalServerError from exc
-        if error_message == {'code': 2, 'message': 'Invalid access_token'}:
-            raise NoActiveTokenError
-        if error_message == {'code': 26, 'message': 'User usage reached'}:
-            raise NoApiCallsLeftError from exc
+    Args
+    ----
+        body : list
+            The list of devices in the body of the response.
+        metrics : JobMetrics, optional
+            Counts the skipped devices as "skipped_devices".
+            The default is None.
 
-        raise NetatmoGeneralError(stations_in_area.get("error")) from exc
+    Returns
+    -------
+        List of (device_id, module_id, name, latitude, longitude) tuples.
 
-    rain_station_list = []
+    """
+    stations = []
     for device in body:
         device_id = device["_id"]
         location = device["place"]["location"]
@@ -483,13 +513,269 @@ def get_station_from_coords(auth_token, latitude_ne, longitude_ne, latitude_sw,
                 break
 
         if not found:
-            update_gui("could not find NAMoudule3")
-            raise ValueError("could not find NAMoudule3")
+            if metrics is not None:
+                metrics.add_item("skipped_devices", device_id)
+            continue
+
+        stations.append((device_id, module_id, name, latitude, longitude))
 
-        station = RainStation(name, device_id, module_id,
-                              (latitude, longitude))
-        station.save_distance_from(
-            (latitude_ne + latitude_sw) / 2, (longitude_ne + longitude_sw) / 2)
-        rain_station_list.append(station)
+    return stations
 
-    return rain_station_list
+
+def create_station_table(stations, latitude, longitude):
+    """
+    Create a StationTable and save the stations in the shared store.
+
+    Args
+    ----
+        stations : list
+            List of (device_id, module_id, name, latitude, longitude) tuples.
+        latitude : float
+            Latitude of the point distances are measured from.
+        longitude : float
+            Longitude of the point distances are measured from.
+
+    Returns
+    -------
+        A StationTable with the stations.
+
+    """
+    # Share the found stations with the other server processes
+    shared_store.put_stations(stations)
+
+    station_table = StationTable(*zip(*stations)) if stations \
+        else StationTable()
+    station_table.save_distances_from(latitude, longitude)
+    return station_table
+
+
+def get_station_from_coords(auth_token, latitude_ne, longitude_ne, latitude_sw,
+                            longitude_sw, required_data="rain", metrics=None,
+                            cancel_token=None):
+    """
+    Get rain station information from Netatmo using their Api.
+
+    Args
+    ----
+        auth_token : string
+            Users Authorization token, recieved previously
+        latitude_ne : float
+            North East corner of area, latitude
+        longitude_ne : float
+            North East corner of area, longitude
+        latitude_sw : float
+            South west corner of area, latitude
+        longitude_sw : float
+            South west corner of area, longitude
+        required_data : string, optional
+            Set to rain, application currently only addapted for rain data
+        metrics : JobMetrics, optional
+            Counts the devices skipped for missing a rain module.
+            The default is None.
+        cancel_token : CancellationToken, optional
+            Token used to abort the request. The default is None.
+
+    Returns
+    -------
+        Returns a StationTable containing name, device_id, module_id,
+        latitude, longitude, and distance from center of longitude
+        and latitude input parameters of the rain stations,
+        found within the range.
+
+    Raises
+    ------
+        NetatmoGeneralError: If there is no body present in the response,
+        or the matching error for errors known from Netatmo.
+
+    """
+    body = request_public_data(auth_token, latitude_ne, longitude_ne,
+                               latitude_sw, longitude_sw, required_data,
+                               cancel_token=cancel_token)
+    return create_station_table(
+        parse_public_data(body, metrics=metrics),
+        (latitude_ne + latitude_sw) / 2, (longitude_ne + longitude_sw) / 2)
+
+
+def split_box(latitude_ne, longitude_ne, latitude_sw, longitude_sw,
+              lat_tiles, lon_tiles):
+    """
+    Split a box into a grid of equally sized tiles.
+
+    Args
+    ----
+        latitude_ne : float
+            North East corner of area, latitude
+        longitude_ne : float
+            North East corner of area, longitude
+        latitude_sw : float
+            South west corner of area, latitude
+        longitude_sw : float
+            South west corner of area, longitude
+        lat_tiles : int
+            Number of tiles from south to north.
+        lon_tiles : int
+            Number of tiles from west to east.
+
+    Returns
+    -------
+        List of (latitude_ne, longitude_ne, latitude_sw, longitude_sw) tuples.
+
+    """
+    latitudes = np.linspace(latitude_sw, latitude_ne, lat_tiles + 1)
+    longitudes = np.linspace(longitude_sw, longitude_ne, lon_tiles + 1)
+    return [(float(latitudes[i + 1]), float(longitudes[j + 1]),
+             float(latitudes[i]), float(longitudes[j]))
+            for i in range(lat_tiles) for j in range(lon_tiles)]
+
+
+def count_tiles(latitude_ne, longitude_ne, latitude_sw, longitude_sw):
+    """
+    Get how many tiles crawl_stations splits a box into at first.
+
+    Args
+    ----
+        latitude_ne : float
+            North East corner of area, latitude
+        longitude_ne : float
+            North East corner of area, longitude
+        latitude_sw : float
+            South west corner of area, latitude
+        longitude_sw : float
+            South west corner of area, longitude
+
+    Returns
+    -------
+        Tuple (lat_tiles, lon_tiles) of the tiles from south to north and
+        from west to east.
+
+    """
+    # Boxes on the grid are not given an extra tile by rounding errors
+    lat_tiles = max(int(np.ceil((latitude_ne - latitude_sw) / MAX_TILE_SIZE
+                                - 1e-9)), 1)
+    lon_tiles = max(int(np.ceil((longitude_ne - longitude_sw) / MAX_TILE_SIZE
+                                - 1e-9)), 1)
+    return lat_tiles, lon_tiles
+
+
+def _fetch_tile(auth_token, tile, metrics, cancel_token):
+    body = request_public_data(auth_token, *tile, cancel_token=cancel_token)
+    return len(body), parse_public_data(body, metrics=metrics)
+
+
+def crawl_boxes(auth_token, boxes, gui=None, metrics=None,
+                cancel_token=None):
+    """
+    Get all rain stations of several areas from Netatmo.
+
+    Netatmo caps the stations returned by one getpublicdata call, so the
+    areas are split into tiles of at most MAX_TILE_SIZE degrees. The tiles
+    of all areas are fetched by one pool of CRAWL_WORKERS threads through
+    the rate limiter. Tiles returning PUBLICDATA_LIMIT stations or more may
+    be missing stations and are split into four smaller tiles, down to
+    MIN_TILE_SIZE degrees. Stations found in several tiles are only kept
+    once. If a tile fails or the job is cancelled, the tiles not yet
+    started are cancelled.
+
+    Args
+    ----
+        auth_token : string
+            Users Authorization token, recieved previously
+        boxes : list
+            List of (latitude_ne, longitude_ne, latitude_sw, longitude_sw)
+            tuples.
+        gui : gui object, optional
+            A gui object to update gui elements. The default is None.
+        metrics : JobMetrics, optional
+            Counts the devices skipped for missing a rain module.
+            The default is None.
+        cancel_token : CancellationToken, optional
+            Token used to stop the crawl. The default is None.
+
+    Returns
+    -------
+        List of (device_id, module_id, name, latitude, longitude) tuples,
+        also saved in the shared store.
+
+    """
+    tiles = [tile for box in boxes
+             for tile in split_box(*box, *count_tiles(*box))]
+
+    stations = {}
+    with ThreadPoolExecutor(max_workers=CRAWL_WORKERS) as executor:
+        pending = {
+            executor.submit(_fetch_tile, auth_token, tile, metrics,
+                            cancel_token): tile
+            for tile in tiles}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                tile = pending.pop(future)
+                try:
+                    device_amount, tile_stations = future.result()
+                except BaseException:
+                    # Tiles not started yet would spend calls for nothing
+                    for other_future in pending:
+                        other_future.cancel()
+                    raise
+
+                for station in tile_stations:
+                    stations.setdefault(station[0], station)
+
+                if device_amount >= PUBLICDATA_LIMIT \
+                        and tile[0] - tile[2] > MIN_TILE_SIZE:
+                    for sub_tile in split_box(*tile, 2, 2):
+                        future = executor.submit(
+                            _fetch_tile, auth_token, sub_tile, metrics,
+                            cancel_token)
+                        pending[future] = sub_tile
+
+    if gui is not None:
+        gui.event_queue.put((
+            "message", f"Hittade {len(stations)} stationer i området"))
+
+    # Share the found stations with the other server processes
+    shared_store.put_stations(list(stations.values()))
+    return list(stations.values())
+
+
+def crawl_stations(auth_token, latitude_ne, longitude_ne, latitude_sw,
+                   longitude_sw, gui=None, metrics=None, cancel_token=None):
+    """
+    Get all rain stations of a large area from Netatmo.
+
+    The area is fetched in tiles, see crawl_boxes.
+
+    Args
+    ----
+        auth_token : string
+            Users Authorization token, recieved previously
+        latitude_ne : float
+            North East corner of area, latitude
+        longitude_ne : float
+            North East corner of area, longitude
+        latitude_sw : float
+            South west corner of area, latitude
+        longitude_sw : float
+            South west corner of area, longitude
+        gui : gui object, optional
+            A gui object to update gui elements. The default is None.
+        metrics : JobMetrics, optional
+            Counts the devices skipped for missing a rain module.
+            The default is None.
+        cancel_token : CancellationToken, optional
+            Token used to stop the crawl. The default is None.
+
+    Returns
+    -------
+        A StationTable with the rain stations of the area and their distance
+        from its center.
+
+    """
+    stations = crawl_boxes(
+        auth_token, [(latitude_ne, longitude_ne, latitude_sw, longitude_sw)],
+        gui=gui, metrics=metrics, cancel_token=cancel_token)
+    station_table = StationTable(*zip(*stations)) if stations \
+        else StationTable()
+    station_table.save_distances_from((latitude_ne + latitude_sw) / 2,
+                                      (longitude_ne + longitude_sw) / 2)
+    return station_table
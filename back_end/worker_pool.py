@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 13:52:17 2026
+
+@author: tagtyk0616
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# Number of worker processes for CPU heavy work, 0 runs the work in the
+# calling process instead
+PROCESS_WORKERS = int(os.environ.get("NETATMO_PROCESS_WORKERS", "2"))
+PRELOADED_MODULES = ["numpy", "openpyxl", "back_end.data_processing",
+                     "back_end.export"]
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def preload_modules():
+    """
+    Import the heavy modules once when a worker process starts.
+
+    """
+    for module in PRELOADED_MODULES:
+        __import__(module)
+
+
+def get_process_pool():
+    """
+    Get the process pool of this server process, created on first use.
+
+    The pool uses the forkserver start method with numpy, openpyxl and the
+    export modules preloaded, so workers start fast and are never forked
+    from a process running the Tornado event loop and its threads.
+
+    Returns
+    -------
+    ProcessPoolExecutor
+        The process pool.
+
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(PRELOADED_MODULES)
+            _pool = ProcessPoolExecutor(max_workers=PROCESS_WORKERS,
+                                        mp_context=context,
+                                        initializer=preload_modules)
+            _pool_pid = os.getpid()
+
+        return _pool
+
+
+def run_in_worker(function, *args):
+    """
+    Run a function in a worker process and wait for the result.
+
+    The calling thread waits without holding the GIL, so the server can keep
+    handling other sessions meanwhile.
+
+    Parameters
+    ----------
+    function : callable
+        Module level function to run.
+    *args :
+        Arguments to the function, should be compact (numpy arrays, strings).
+
+    Returns
+    -------
+        The return value of the function.
+
+    """
+    if PROCESS_WORKERS == 0:
+        return function(*args)
+
+    return get_process_pool().submit(function, *args).result()
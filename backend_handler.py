@@ -5,21 +5,27 @@ Created on Wed Aug  2 15:22:25 2023
 @author: tagtyk0616
 """
 from datetime import datetime
-import tempfile
-import os
-import pandas as pd
-from back_end import (station_info, rain_data, data_processing)
+from back_end import (rain_data, data_processing, export, worker_pool,
+                      shared_arrays, station_coverage, result_cache,
+                      output_store)
+from back_end.shared_store import shared_store
+from back_end.station_index import station_index
+from back_end.running_program_data import CancellationToken, JobMetrics
 from back_end.api_counter import (InternalServerError,
                                   NetatmoGeneralError, NoActiveTokenError,
-                                  NoApiCallsLeftError, InvalidInputError)
+                                  NoApiCallsLeftError, InvalidInputError,
+                                  NoDataInStationError)
 
-RADIUS = 0.25  # How big area to check, in lat/long
 STRING_FORMAT = "%Y-%m-%d"
+PREFETCH_PROBES = 10  # Most stations probed for data when the map is clicked
 
 
 class UserInputData:
     def __init__(self, auth_token, latitude, longitude, date_begin,
-                 date_end, scale, station_amount, path):
+                 date_end, scale, station_amount, path, polygons=None,
+                 output_format="Excel", views=None,
+                 dry_hours=data_processing.EVENT_DRY_TIME // 3600,
+                 exclude_flagged=False):
         self._auth_token = auth_token
         self._latitude = latitude
         self._longitude = longitude
@@ -29,6 +35,11 @@ class UserInputData:
         self._scale = scale
         self._station_amount = station_amount
         self._path = path
+        self._polygons = polygons
+        self._output_format = output_format
+        self._views = tuple(export.DEFAULT_VIEWS if views is None else views)
+        self._dry_hours = dry_hours
+        self._exclude_flagged = exclude_flagged
 
         formated_date_begin = datetime.strptime(
             self._date_begin, STRING_FORMAT)
@@ -69,6 +80,26 @@ class UserInputData:
     def path(self):
         return self._path
 
+    @property
+    def polygons(self):
+        return self._polygons
+
+    @property
+    def output_format(self):
+        return self._output_format
+
+    @property
+    def views(self):
+        return self._views
+
+    @property
+    def dry_hours(self):
+        return self._dry_hours
+
+    @property
+    def exclude_flagged(self):
+        return self._exclude_flagged
+
     @property
     def date_begin_unix(self):
         return self._date_begin_unix
@@ -92,73 +123,325 @@ class UserInputData:
             raise InvalidInputError
 
 
-def run_program(input_data, gui=None):
+def find_candidates(input_data, gui=None, metrics=None, cancel_token=None):
+    """
+    Find the candidate stations of a job, best first.
+
+    Parameters
+    ----------
+    input_data : UserInputData object
+        An object of class UserInputData containing the users input data.
+    gui : gui object, optional
+        A gui object to update gui elements. The default is None.
+    metrics : JobMetrics, optional
+        Metrics of the job. The default is None.
+    cancel_token : CancellationToken, optional
+        Token used to stop the search. The default is None.
+
+    Raises
+    ------
+    NoDataInStationError
+        If there are no stations in the area.
+
+    Returns
+    -------
+    candidates : StationTable
+        The candidate stations ranked by distance and coverage.
+
+    """
+    # Stations are looked up in the local index, Netatmo is only asked
+    # for areas not fetched before. Spare candidates replace stations
+    # without data.
+    if input_data.polygons is not None:
+        candidates = station_index.find_stations_in_polygons(
+            input_data.auth_token,
+            input_data.polygons,
+            gui=gui,
+            metrics=metrics,
+            cancel_token=cancel_token
+        )
+    else:
+        candidates = station_index.find_stations(
+            input_data.auth_token,
+            input_data.latitude,
+            input_data.longitude,
+            station_coverage.CANDIDATE_FACTOR * input_data.station_amount,
+            gui=gui,
+            metrics=metrics,
+            cancel_token=cancel_token
+        )
+
+    if len(candidates) == 0:
+        raise NoDataInStationError("Inga stationer hittades i området")
+
+    return station_coverage.rank_candidates(
+        candidates, input_data.date_begin_unix, input_data.date_end_unix)
+
+
+def prefetch_stations(input_data, cancel_token=None, metrics=None):
+    """
+    Look up the stations of a job and probe them for data before it starts.
+
+    Used when a point is chosen on the map, while the user fills in the
+    rest of the form. The stations found and the months they have data for
+    are cached, so the job can start fetching measurements at once.
+
+    Parameters
+    ----------
+    input_data : UserInputData object
+        An object of class UserInputData containing the users input data.
+    cancel_token : CancellationToken, optional
+        Token used to stop the prefetch. The default is None.
+    metrics : JobMetrics, optional
+        Metrics of the job the stations are looked up for.
+        The default is None.
+
+    Returns
+    -------
+    candidates : StationTable
+        The candidate stations ranked by distance and coverage.
+
+    """
+    candidates = find_candidates(input_data, metrics=metrics,
+                                 cancel_token=cancel_token)
+    probe_amount = min(len(candidates), input_data.station_amount,
+                       PREFETCH_PROBES)
+    for i in range(probe_amount):
+        if cancel_token is not None and cancel_token.cancelled:
+            break
+
+        rain_data.probe_months(
+            input_data,
+            candidates.get_device_id(i),
+            candidates.get_module_id(i),
+            cancel_token=cancel_token
+        )
+
+    # Ranked again with the coverage found by the probes
+    return station_coverage.rank_candidates(
+        candidates, input_data.date_begin_unix, input_data.date_end_unix)
+
+
+def get_sheet_split_messages(input_data, station_count):
+    """
+    Tell which views of an Excel file will be split on several sheets.
+
+    The size of the file is known from the dates, scale and number of
+    stations before anything is fetched, so the user can choose another
+    file format before the job starts.
+
+    Parameters
+    ----------
+    input_data : UserInputData object
+        An object of class UserInputData containing the users input data,
+        with the scale in API format.
+    station_count : int
+        Number of stations of the file.
+
+    Returns
+    -------
+    list of str
+        One message per chosen view split on several sheets, empty if the
+        file is not an Excel file.
+
     """
+    if input_data.output_format != "Excel":
+        return []
 
+    start_stop_list = rain_data.divide_time(
+        input_data.date_begin_unix, input_data.date_end_unix, input_data.scale)
+    sheet_plan = export.plan_sheets(
+        rain_data.count_time_steps(start_stop_list, input_data.scale),
+        station_count, input_data.dry_hours * 3600)
+    return [f"Vyn {title} får inte plats på ett blad och delas upp på upp "
+            f"till {sheet_count} blad, välj Parquet, Feather eller NetCDF "
+            "för att få den i en tabell"
+            for title, sheet_count in sheet_plan.items()
+            if sheet_count > 1 and title in input_data.views]
+
+
+def run_program(input_data, gui=None, cancel_token=None, candidates=None,
+                metrics=None):
+    """
+    Fetch the rain data of the users request and write it to a file.
+
+    An identical earlier request gives its file back without any calls.
 
     Parameters
     ----------
-    auth_token : TYPE
-        DESCRIPTION.
-    input_data : TYPE
-        DESCRIPTION.
-    gui : TYPE, optional
-        DESCRIPTION. The default is None.
+    input_data : UserInputData object
+        An object of class UserInputData containing the users input data.
+    gui : gui object, optional
+        Its event_queue gets ("message", text) and ("progress", percent)
+        events about the current step, and ("notice", text) events the
+        user should still see when the job is done. The default is None.
+    cancel_token : CancellationToken, optional
+        Token used to cancel the job. If the job is cancelled while fetching
+        data a file with the data fetched so far is created.
+        The default is None.
+    candidates : StationTable, optional
+        Candidate stations from prefetch_stations, looked up if not given.
+        The default is None.
+    metrics : JobMetrics, optional
+        Metrics of the job, such as the ones of prefetch_stations for the
+        candidates. The default is None.
+
+    Raises
+    ------
+    InvalidInputError
+        If the file format, the views or the dry time are not valid.
+    NoDataInStationError
+        If no stations with data are found.
+    JobCancelledError
+        If the job is cancelled before any data is fetched.
 
     Returns
     -------
-    None.
+    output_path : str
+        Path of the output file in the output store.
 
     """
 
-    name = f"Regnvärden kring ({input_data.latitude}, {input_data.longitude}), " \
-        f"{input_data.date_begin} - {input_data.date_end}, upplösning {input_data.scale}, " \
-        f"{input_data.station_amount} stationer"
-    print("got here?")
+    if input_data.polygons is not None:
+        name = f"Regnvärden inom valt område, " \
+            f"{input_data.date_begin} - {input_data.date_end}, upplösning {input_data.scale}"
+    else:
+        name = f"Regnvärden kring ({input_data.latitude}, {input_data.longitude}), " \
+            f"{input_data.date_begin} - {input_data.date_end}, upplösning {input_data.scale}, " \
+            f"{input_data.station_amount} stationer"
     input_data.convert_scale_to_api_format()
-    print("got here!")
-    latitude_ne, longitude_ne, latitude_sw, longitude_sw = (
-        station_info.calculate_corner_coorinates(
-            input_data.latitude, input_data.longitude, RADIUS)
-    )
-
-    rain_station_list = station_info.get_station_from_coords(
-        input_data.auth_token,
-        latitude_ne,
-        longitude_ne,
-        latitude_sw,
-        longitude_sw
-    )
-
-    relevant_station_list = station_info.quicksort_rain_station_list(
-        rain_station_list)[0:input_data.station_amount]
+    if input_data.output_format not in export.OUTPUT_FORMATS:
+        raise InvalidInputError(
+            f"Okänt filformat: {input_data.output_format}")
+    if not input_data.views \
+            or not set(input_data.views).issubset(export.VIEWS):
+        raise InvalidInputError("Välj minst en av datavyerna "
+                                f"{', '.join(export.VIEWS)}")
+    if "Regnhändelser" in input_data.views and not input_data.dry_hours > 0:
+        raise InvalidInputError(
+            "Torrperioden mellan regnhändelser måste vara minst en timme")
+
+    # An identical request gives the same file, no calls are needed
+    result_path = result_cache.find_result(input_data)
+    if result_path is not None:
+        if gui is not None:
+            gui.event_queue.put((
+                "notice", f"Använder fil från en likadan förfrågan \n "
+                f"Fil sparad: \n {name}"))
+        return result_path
+
+    if cancel_token is None:
+        cancel_token = CancellationToken()
+
+    # Register the job so it is visible to, and can be cancelled from,
+    # all server processes
+    shared_store.register_job(cancel_token.job_id, input_data.auth_token, name)
+    try:
+        output_path = _run_job(input_data, name, gui, cancel_token,
+                               candidates, metrics)
+    except BaseException:
+        shared_store.finish_job(cancel_token.job_id, "failed")
+        raise
+
+    shared_store.finish_job(cancel_token.job_id)
+    return output_path
+
+
+def _run_job(input_data, name, gui, cancel_token, candidates, metrics):
+    cancel_token.raise_if_cancelled()
+    if metrics is None:
+        metrics = JobMetrics()
+
+    if candidates is None:
+        candidates = find_candidates(input_data, gui=gui, metrics=metrics,
+                                     cancel_token=cancel_token)
+
+    if input_data.polygons is not None:
+        station_amount = len(candidates)
+    else:
+        station_amount = input_data.station_amount
 
     start_stop_list = rain_data.divide_time(
         input_data.date_begin_unix, input_data.date_end_unix, input_data.scale, gui=gui)
 
-    df1, df2, df3 = data_processing.create_data_views_for_excel(
-        input_data,
-        relevant_station_list,
-        start_stop_list,
-        f"({input_data.latitude}, {input_data.longitude})",
-        gui=gui
-    )
-    
-    temp_dir = tempfile.mkdtemp()
-    # Full path for the Excel file in the temporary directory
-    temp_file_path = os.path.join(temp_dir, f"{name}.xlsx")
-    
-    with pd.ExcelWriter(temp_file_path) as writer:
-        df1.to_excel(writer, sheet_name='Allmän vy')
-        df2.to_excel(writer, sheet_name="Median", index=False)
-        df3.to_excel(writer, sheet_name='Kartfunktion',
-                     index=False, header=True)
+    time_step_list = data_processing.create_time_step_list(start_stop_list)
 
     if gui is not None:
-        gui.event_queue.put(("progress", 100 // (len(rain_station_list) + 1)))
+        for message in get_sheet_split_messages(
+                input_data, min(station_amount, len(candidates))):
+            gui.event_queue.put(("notice", message))
+
+    # The time x station matrix is kept in shared memory, filled while the
+    # stations are fetched, until the worker process has written the file.
+    # It is freed when the job ends.
+    with shared_arrays.SharedArrayStore() as array_store:
+        matrix_descriptor, rain_matrix = array_store.create(
+            (len(time_step_list), min(station_amount, len(candidates))))
+
+        selected = data_processing.collect_rain_matrix(
+            input_data,
+            candidates,
+            start_stop_list,
+            time_step_list,
+            rain_matrix,
+            gui=gui,
+            cancel_token=cancel_token
+        )
+        # Only the worker process uses the matrix from here on
+        del rain_matrix
+        stations = candidates.take(selected)
+
+        if len(stations) < station_amount and gui is not None \
+                and not cancel_token.cancelled:
+            gui.event_queue.put((
+                "notice", f"Hittade bara {len(stations)} av "
+                f"{station_amount} stationer med data"))
+
+        if cancel_token.cancelled:
+            name = f"{name} (avbruten)"
+
+        # The file is written beside the output store and moved in when
+        # it is complete
+        staging_path = output_store.create_staging_path(
+            f"{name}{export.OUTPUT_FORMATS[input_data.output_format]}")
+
+        if gui is not None:
+            gui.event_queue.put(("message", "Räknar ut median från stationer"))
+
+        # Creating the views and writing the file is CPU heavy, it is done
+        # in a worker process to keep the server responsive
+        try:
+            worker_pool.run_in_worker(
+                export.create_output_file,
+                staging_path,
+                (input_data.latitude, input_data.longitude),
+                time_step_list,
+                matrix_descriptor,
+                stations,
+                f"({input_data.latitude}, {input_data.longitude})",
+                input_data.output_format,
+                input_data.views,
+                input_data.dry_hours * 3600,
+                input_data.exclude_flagged
+            )
+        except BaseException:
+            output_store.discard_staging(staging_path)
+            raise
+
+    if gui is not None:
+        gui.event_queue.put(("progress", 100 // (len(stations) + 1)))
+        if metrics.get("skipped_devices"):
+            gui.event_queue.put((
+                "notice", f"Hoppade över {metrics.get('skipped_devices')} "
+                "enheter utan regnmätare"))
         gui.event_queue.put((
             "message", f"Programmet är klart \n Fil sparad: \n {name}"))
 
-    print(name)
-    print(str(name))
-    return temp_file_path
+    if cancel_token.cancelled:
+        output_path = output_store.commit_output(staging_path)
+    else:
+        output_path = output_store.commit_output(
+            staging_path, result_cache.get_result_ttl(input_data))
+        result_cache.store_result(input_data, output_path, stations)
+
+    return output_path
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Oct 20 09:41:27 2026
+
+@author: tagtyk0616
+"""
+
+import argparse
+import time
+import numpy as np
+from back_end import shared_arrays, worker_pool
+
+# (time steps, stations) of the matrices timed, 30 min data for a month,
+# a year and three years
+SHAPES = [(1440, 10), (17520, 50), (52560, 200)]
+
+
+def _sum_matrix(matrix):
+    return float(np.nansum(matrix))
+
+
+def _sum_shared_matrix(descriptor):
+    with shared_arrays.attach(descriptor) as matrix:
+        return _sum_matrix(matrix)
+
+
+def benchmark_transfer(shape, repeats=5):
+    """
+    Compare sending the rain matrix to a worker by pickling and shared memory.
+
+    Both ways send a time x station matrix to a worker process of
+    worker_pool that sums the values. The shared memory way is the one the
+    jobs use: the matrix is created with SharedArrayStore.create, filled in
+    place and mapped by the worker with attach.
+
+    Parameters
+    ----------
+    shape : tuple of int
+        Time steps and stations of the matrix.
+    repeats : int, optional
+        Number of times each transfer is timed. The default is 5.
+
+    Returns
+    -------
+    pickle_time : float
+        Mean seconds to send the matrix to the worker pickled.
+    fill_time : float
+        Mean seconds to create and fill the matrix in shared memory, done
+        by the fetch stage as the data arrives.
+    shared_time : float
+        Mean seconds to send the descriptor to the worker and map it.
+
+    """
+    matrix = np.random.default_rng(0).random(shape)
+    pool = worker_pool.get_process_pool()
+    pool.submit(_sum_matrix, np.zeros(1)).result()
+
+    start = time.perf_counter()
+    for _ in range(repeats):
+        pool.submit(_sum_matrix, matrix).result()
+    pickle_time = (time.perf_counter() - start) / repeats
+
+    fill_time = 0
+    shared_time = 0
+    for _ in range(repeats):
+        with shared_arrays.SharedArrayStore() as store:
+            start = time.perf_counter()
+            descriptor, shared_matrix = store.create(shape)
+            shared_matrix[...] = matrix
+            fill_time += time.perf_counter() - start
+            del shared_matrix
+
+            start = time.perf_counter()
+            pool.submit(_sum_shared_matrix, descriptor).result()
+            shared_time += time.perf_counter() - start
+
+    return pickle_time, fill_time / repeats, shared_time / repeats
+
+
+def main():
+    """
+    Time sending the rain matrix of a job to a worker process.
+
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    for shape in SHAPES:
+        pickle_time, fill_time, shared_time = \
+            benchmark_transfer(shape, args.repeats)
+        print(f"{shape[0]} time steps x {shape[1]} stations: "
+              f"pickle {1000 * pickle_time:.1f} ms, "
+              f"shared memory {1000 * shared_time:.1f} ms "
+              f"(+ {1000 * fill_time:.1f} ms fill in fetch stage)")
+
+
+if __name__ == "__main__":
+    main()
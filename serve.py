@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Wed Oct 21 10:12:05 2026
+
+@author: tagtyk0616
+"""
+
+import argparse
+import os
+import panel as pn
+from back_end import output_store
+from back_end.download import DOWNLOAD_PREFIX, DownloadHandler
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+
+def main():
+    """
+    Serve the app together with the download handler.
+
+    ``panel serve`` can not register extra Tornado handlers, so the server
+    is started here instead. Output files are then downloaded over plain
+    HTTP instead of through the session websocket.
+
+    """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--address", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    # 0 starts one process per CPU core
+    parser.add_argument("--num-procs", type=int, default=1)
+    parser.add_argument("--allow-websocket-origin", default="*")
+    args = parser.parse_args()
+
+    os.makedirs(output_store.FILES_DIR, exist_ok=True)
+    # The app is served at the root as well, like --index app did
+    pn.serve(
+        {"/": APP_PATH, "app": APP_PATH},
+        address=args.address,
+        port=args.port,
+        num_procs=args.num_procs,
+        websocket_origin=args.allow_websocket_origin,
+        extra_patterns=[(DOWNLOAD_PREFIX + "(.*)", DownloadHandler,
+                         {"path": output_store.FILES_DIR})],
+        show=False,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:12:44 2026
+
+@author: tagtyk0616
+"""
+
+import numpy as np
+from back_end import data_processing
+from back_end.data_processing import (QC_DRY, QC_OUTLIER, QC_STUCK,
+                                      TIME_STEP, align_station_series,
+                                      calculate_median, check_quality,
+                                      find_rain_events)
+
+NAN = np.nan
+
+
+def get_time_steps(count):
+    return np.arange(count, dtype=np.int64) * TIME_STEP
+
+
+class TestAlignStationSeries:
+
+    def test_unsorted_measurements_are_aligned(self):
+        column = align_station_series(
+            np.array([1900, 100, 950]), np.array([3.0, 1.0, 2.0]),
+            get_time_steps(3))
+
+        np.testing.assert_array_equal(column, [1.0, 2.0, 3.0])
+
+    def test_measurements_too_far_away_are_missing(self):
+        column = align_station_series(
+            np.array([449, 2700]), np.array([1.0, 2.0]), get_time_steps(4))
+
+        np.testing.assert_array_equal(column, [NAN, NAN, NAN, 2.0])
+
+    def test_single_measurement(self):
+        column = align_station_series(
+            np.array([1000]), np.array([0.5]), get_time_steps(3))
+
+        np.testing.assert_array_equal(column, [NAN, 0.5, NAN])
+
+    def test_no_measurements(self):
+        column = align_station_series(
+            np.array([], dtype=np.int64), np.array([]), get_time_steps(2))
+
+        assert np.all(np.isnan(column))
+
+    def test_equal_distance_takes_the_earlier_measurement(self):
+        column = align_station_series(
+            np.array([1300, 500]), np.array([2.0, 1.0]), get_time_steps(2))
+
+        np.testing.assert_array_equal(column, [NAN, 1.0])
+
+
+class TestCalculateMedian:
+
+    def test_odd_station_count(self):
+        median, lower, upper = calculate_median(np.array([[3.0, 1.0, 2.0]]))
+
+        np.testing.assert_array_equal(median, [2.0])
+        np.testing.assert_array_equal(lower, [2])
+        np.testing.assert_array_equal(upper, [2])
+
+    def test_even_station_count_gives_both_middle_stations(self):
+        median, lower, upper = calculate_median(
+            np.array([[4.0, 1.0, 3.0, 2.0]]))
+
+        np.testing.assert_array_equal(median, [2.5])
+        np.testing.assert_array_equal(lower, [3])
+        np.testing.assert_array_equal(upper, [2])
+
+    def test_missing_values_are_ordered_last(self):
+        median, lower, upper = calculate_median(
+            np.array([[NAN, 5.0, NAN, 1.0],
+                      [2.0, NAN, NAN, NAN]]))
+
+        np.testing.assert_array_equal(median, [3.0, 2.0])
+        np.testing.assert_array_equal(lower, [3, 0])
+        np.testing.assert_array_equal(upper, [1, 0])
+
+    def test_time_step_without_data(self):
+        median = calculate_median(np.array([[NAN, NAN], [1.0, 3.0]]))[0]
+
+        np.testing.assert_array_equal(median, [NAN, 2.0])
+
+    def test_single_station(self):
+        median, lower, upper = calculate_median(np.array([[7.0], [NAN]]))
+
+        np.testing.assert_array_equal(median, [7.0, NAN])
+        np.testing.assert_array_equal(lower, [0, 0])
+        np.testing.assert_array_equal(upper, [0, 0])
+
+    def test_equal_values_keep_station_order(self):
+        lower, upper = calculate_median(np.array([[1.0, 1.0]]))[1:]
+
+        np.testing.assert_array_equal(lower, [0])
+        np.testing.assert_array_equal(upper, [1])
+
+
+class TestFindRainEvents:
+
+    def test_rain_separated_by_dry_time_is_two_events(self):
+        rain_matrix = np.zeros((40, 1))
+        rain_matrix[[0, 1], 0] = [1.0, 2.0]
+        rain_matrix[30, 0] = 0.5
+
+        station, start, end, depth, peak = find_rain_events(
+            get_time_steps(40), rain_matrix, dry_time=6 * 3600)
+
+        np.testing.assert_array_equal(station, [0, 0])
+        np.testing.assert_array_equal(start, [0, 30 * TIME_STEP])
+        np.testing.assert_array_equal(end, [2 * TIME_STEP, 31 * TIME_STEP])
+        np.testing.assert_array_equal(depth, [3.0, 0.5])
+        np.testing.assert_array_equal(peak, [8.0, 2.0])
+
+    def test_short_dry_spell_is_one_event(self):
+        rain_matrix = np.zeros((40, 1))
+        rain_matrix[[0, 10], 0] = 1.0
+
+        depth = find_rain_events(get_time_steps(40), rain_matrix,
+                                 dry_time=6 * 3600)[3]
+
+        np.testing.assert_array_equal(depth, [2.0])
+
+    def test_missing_values_count_as_dry(self):
+        rain_matrix = np.full((40, 1), NAN)
+        rain_matrix[:2, 0] = 0.0
+        rain_matrix[[2, 35], 0] = 1.0
+
+        depth = find_rain_events(get_time_steps(40), rain_matrix,
+                                 dry_time=6 * 3600)[3]
+
+        np.testing.assert_array_equal(depth, [1.0, 1.0])
+
+    def test_events_are_ordered_by_station(self):
+        rain_matrix = np.zeros((4, 2))
+        rain_matrix[3, 0] = 1.0
+        rain_matrix[0, 1] = 2.0
+
+        station, start = find_rain_events(get_time_steps(4), rain_matrix)[:2]
+
+        np.testing.assert_array_equal(station, [0, 1])
+        np.testing.assert_array_equal(start, [3 * TIME_STEP, 0])
+
+    def test_single_measurement_gets_the_time_step_as_interval(self):
+        rain_matrix = np.full((4, 1), NAN)
+        rain_matrix[2, 0] = 2.0
+
+        station, start, end, depth, peak = find_rain_events(
+            get_time_steps(4), rain_matrix)
+
+        np.testing.assert_array_equal(end, [3 * TIME_STEP])
+        np.testing.assert_array_equal(peak, [8.0])
+
+    def test_no_rain(self):
+        events = find_rain_events(get_time_steps(3), np.zeros((3, 2)))
+
+        assert all(len(values) == 0 for values in events)
+
+
+class TestCheckQuality:
+
+    @staticmethod
+    def get_rain_matrix():
+        # Five stations agreeing, rain differs between time steps so no
+        # station is stuck
+        return np.tile(np.arange(10)[:, None] * 0.1, (1, 5))
+
+    def test_agreeing_stations_are_not_flagged(self):
+        flags = check_quality(self.get_rain_matrix())
+
+        assert not flags.any()
+
+    def test_outlier(self):
+        rain_matrix = self.get_rain_matrix()
+        rain_matrix[5, 4] = 30.0
+
+        flags = check_quality(rain_matrix)
+
+        assert flags[5, 4] & QC_OUTLIER
+        assert np.count_nonzero(flags) == 1
+
+    def test_dry_station_while_others_have_rain(self):
+        rain_matrix = self.get_rain_matrix()
+        rain_matrix[5] = [2.0, 2.0, 2.0, 2.0, 0.0]
+
+        flags = check_quality(rain_matrix)
+
+        assert flags[5, 4] & QC_DRY
+        assert not flags[5, :4].any()
+
+    def test_stuck_station(self):
+        rain_matrix = self.get_rain_matrix()
+        rain_matrix[2:2 + data_processing.QC_STUCK_COUNT, 1] = 0.3
+
+        flags = check_quality(rain_matrix)
+
+        stuck = np.flatnonzero(flags[:, 1] & QC_STUCK)
+        np.testing.assert_array_equal(
+            stuck, np.arange(2, 2 + data_processing.QC_STUCK_COUNT))
+
+    def test_missing_value_ends_a_stuck_run(self):
+        rain_matrix = self.get_rain_matrix()
+        rain_matrix[:, 1] = 0.3
+        rain_matrix[4, 1] = NAN
+
+        flags = check_quality(rain_matrix)
+
+        assert not (flags[:, 1] & QC_STUCK).any()
+
+    def test_few_stations_are_not_compared(self):
+        rain_matrix = self.get_rain_matrix()
+        rain_matrix[5, 2:] = NAN
+        rain_matrix[5, 1] = 30.0
+
+        flags = check_quality(rain_matrix)
+
+        assert not flags[5].any()
+
+    def test_missing_values_are_never_flagged(self):
+        rain_matrix = self.get_rain_matrix()
+        rain_matrix[5] = [2.0, 2.0, 2.0, 2.0, NAN]
+
+        flags = check_quality(rain_matrix)
+
+        assert flags[5, 4] == 0
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:46:18 2026
+
+@author: tagtyk0616
+"""
+
+from back_end.data_processing import TIME_STEP
+from back_end.export import MAX_ROWS, VIEWS, plan_sheets
+
+
+class TestPlanSheets:
+
+    def test_small_request_fits_on_one_sheet_each(self):
+        sheets = plan_sheets(96, 10)
+
+        assert set(sheets) == set(VIEWS)
+        assert all(count == 1 for count in sheets.values())
+
+    def test_full_sheet_is_not_split(self):
+        # The header and max_rows - 1 rows of data
+        assert plan_sheets(5, 1, max_rows=6)['Allmän vy'] == 1
+        assert plan_sheets(6, 1, max_rows=6)['Allmän vy'] == 2
+
+    def test_continued_sheets_repeat_the_header(self):
+        assert plan_sheets(11, 1, max_rows=6)['Allmän vy'] == 3
+
+    def test_map_view_grows_with_the_stations(self):
+        sheets = plan_sheets(MAX_ROWS // 2, 4)
+
+        assert sheets['Allmän vy'] == 1
+        assert sheets['Kartfunktion'] == 3
+
+    def test_events_depend_on_the_dry_time(self):
+        # A year of 15 minute steps with 200 stations
+        time_step_count = 365 * 24 * 3600 // TIME_STEP
+
+        short_dry_time = plan_sheets(time_step_count, 200, dry_time=3600)
+        long_dry_time = plan_sheets(time_step_count, 200, dry_time=24 * 3600)
+
+        assert short_dry_time["Regnhändelser"] == 2
+        assert long_dry_time["Regnhändelser"] == 1
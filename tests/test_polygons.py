@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:31:05 2026
+
+@author: tagtyk0616
+"""
+
+import numpy as np
+from back_end import polygons
+from back_end.polygons import points_in_polygons
+
+
+def get_square(longitude_sw, latitude_sw, size):
+    return np.array([[longitude_sw, latitude_sw],
+                     [longitude_sw + size, latitude_sw],
+                     [longitude_sw + size, latitude_sw + size],
+                     [longitude_sw, latitude_sw + size],
+                     [longitude_sw, latitude_sw]])
+
+
+class TestPointsInPolygons:
+
+    def test_points_inside_and_outside(self):
+        inside = points_in_polygons([57.5, 57.5, 59.0, 57.5],
+                                    [11.5, 13.0, 11.5, 10.9],
+                                    [[get_square(11.0, 57.0, 1.0)]])
+
+        np.testing.assert_array_equal(inside, [True, False, False, False])
+
+    def test_open_ring(self):
+        inside = points_in_polygons([57.5, 58.5], [11.5, 11.5],
+                                    [[get_square(11.0, 57.0, 1.0)[:-1]]])
+
+        np.testing.assert_array_equal(inside, [True, False])
+
+    def test_hole(self):
+        polygon = [get_square(11.0, 57.0, 1.0), get_square(11.25, 57.25, 0.5)]
+
+        inside = points_in_polygons([57.5, 57.1], [11.5, 11.1], [polygon])
+
+        np.testing.assert_array_equal(inside, [False, True])
+
+    def test_any_of_several_polygons(self):
+        inside = points_in_polygons(
+            [57.5, 60.5, 59.0], [11.5, 15.5, 13.0],
+            [[get_square(11.0, 57.0, 1.0)], [get_square(15.0, 60.0, 1.0)]])
+
+        np.testing.assert_array_equal(inside, [True, True, False])
+
+    def test_concave_polygon(self):
+        # U shape open to the north
+        ring = np.array([[0.0, 0.0], [3.0, 0.0], [3.0, 3.0], [2.0, 3.0],
+                         [2.0, 1.0], [1.0, 1.0], [1.0, 3.0], [0.0, 3.0]])
+
+        inside = points_in_polygons([2.0, 2.0, 0.5], [0.5, 1.5, 1.5],
+                                    [[ring]])
+
+        np.testing.assert_array_equal(inside, [True, False, True])
+
+    def test_edges_tested_in_blocks(self, monkeypatch):
+        monkeypatch.setattr(polygons, "EDGE_BLOCK", 2)
+        angles = np.linspace(0, 2 * np.pi, 50, endpoint=False)
+        circle = np.stack([np.cos(angles), np.sin(angles)], axis=1)
+
+        inside = points_in_polygons([0.0, 0.9, 0.0], [0.0, 0.0, 1.1],
+                                    [[circle]])
+
+        np.testing.assert_array_equal(inside, [True, True, False])
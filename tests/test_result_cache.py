@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 11:02:37 2026
+
+@author: tagtyk0616
+"""
+
+import numpy as np
+from backend_handler import UserInputData
+from back_end.result_cache import get_result_key
+
+POLYGONS = [[np.array([[11.9, 57.7], [12.0, 57.7], [12.0, 57.8],
+                       [11.9, 57.7]])]]
+
+
+def get_key(**changes):
+    fields = {"auth_token": "token",
+              "latitude": 57.70887,
+              "longitude": 11.97456,
+              "date_begin": "2024-06-01",
+              "date_end": "2024-06-30",
+              "scale": "1 timme",
+              "station_amount": 5,
+              "path": ""}
+    fields.update(changes)
+    input_data = UserInputData(**fields)
+    input_data.convert_scale_to_api_format()
+    return get_result_key(input_data)
+
+
+class TestGetResultKey:
+
+    def test_same_request_from_another_user(self):
+        assert get_key() == get_key(auth_token="other token")
+
+    def test_request_changes_the_key(self):
+        key = get_key()
+
+        assert key != get_key(station_amount=6)
+        assert key != get_key(latitude=57.8)
+        assert key != get_key(date_end="2024-07-01")
+        assert key != get_key(scale="30 min")
+        assert key != get_key(output_format="CSV")
+        assert key != get_key(exclude_flagged=True)
+
+    def test_nearby_click_is_the_same_point(self):
+        assert get_key(latitude=57.70887) == get_key(latitude=57.7088700001)
+
+    def test_views_are_a_set(self):
+        assert get_key(views=("Median", 'Allmän vy')) \
+            == get_key(views=('Allmän vy', "Median"))
+
+    def test_dry_time_only_matters_for_rain_events(self):
+        assert get_key(dry_hours=2) == get_key(dry_hours=12)
+
+        views = ('Allmän vy', "Regnhändelser")
+        assert get_key(views=views, dry_hours=2) \
+            != get_key(views=views, dry_hours=12)
+
+    def test_polygon_request_ignores_point_and_amount(self):
+        key = get_key(polygons=POLYGONS)
+
+        assert key == get_key(polygons=POLYGONS, latitude=0, longitude=0,
+                              station_amount=50)
+        assert key != get_key()
+
+    def test_polygons_change_the_key(self):
+        moved = [[POLYGONS[0][0] + 0.01]]
+
+        assert get_key(polygons=POLYGONS) != get_key(polygons=moved)
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 11:34:09 2026
+
+@author: tagtyk0616
+"""
+
+import numpy as np
+import pytest
+from back_end.shared_store import SharedStore
+from back_end.station_index import CELL_SIZE, StationIndex, cells_in_box
+
+
+@pytest.fixture
+def index(tmp_path):
+    return StationIndex(SharedStore(str(tmp_path / "store.sqlite")))
+
+
+def add_stations(index, coordinates):
+    index._store.put_stations(
+        [(f"device {i}", f"module {i}", f"station {i}", latitude, longitude)
+         for i, (latitude, longitude) in enumerate(coordinates)])
+    index.reload()
+
+
+class TestStationIndexNearest:
+
+    def test_empty_index(self, index):
+        assert len(index.nearest(57.7, 11.97, 5)) == 0
+
+    def test_sorted_by_distance(self, index):
+        add_stations(index, [(57.75, 11.97), (57.71, 11.97), (57.9, 12.0)])
+
+        nearest = index.nearest(57.70887, 11.97456, 3)
+
+        assert list(nearest.names) == ["station 1", "station 0", "station 2"]
+        assert np.all(np.diff(nearest.distances) >= 0)
+
+    def test_closer_station_in_a_neighbouring_cell(self, index):
+        # The reference point lies at the east border of its cell, the
+        # station of the same cell is further away than the one east of it
+        add_stations(index, [(57.701, 11.961), (57.701, 11.9805)])
+
+        nearest = index.nearest(57.701, 11.9795, 1)
+
+        assert list(nearest.names) == ["station 1"]
+
+    def test_rings_expand_until_enough_stations(self, index):
+        add_stations(index, [(57.7, 11.97), (57.7 + 50 * CELL_SIZE, 11.97),
+                             (57.7, 11.97 - 120 * CELL_SIZE)])
+
+        nearest = index.nearest(57.7, 11.97, 3)
+
+        assert list(nearest.names) == ["station 0", "station 1", "station 2"]
+
+    def test_max_distance(self, index):
+        add_stations(index, [(57.7, 11.97), (57.7 + 50 * CELL_SIZE, 11.97)])
+
+        nearest = index.nearest(57.7, 11.97, 2, max_distance=20)
+
+        assert list(nearest.names) == ["station 0"]
+
+    def test_across_the_antimeridian(self, index):
+        add_stations(index, [(0.0, 179.5), (0.0, -179.995), (0.0, 179.99)])
+
+        nearest = index.nearest(0.0, 179.995, 3)
+
+        assert list(nearest.names) == ["station 2", "station 1", "station 0"]
+        np.testing.assert_allclose(nearest.distances[:2], [0.56, 1.11],
+                                   atol=0.01)
+
+
+class TestCellsInBox:
+
+    def test_borders_on_the_grid(self):
+        cells = cells_in_box(2 * CELL_SIZE, 3 * CELL_SIZE, 0.0, CELL_SIZE)
+
+        assert cells == [(0, 1), (0, 2), (1, 1), (1, 2)]
+
+    def test_box_inside_one_cell(self):
+        assert cells_in_box(57.705, 11.975, 57.701, 11.971) \
+            == [(2885, 598)]
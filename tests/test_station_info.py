@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 11:15:52 2026
+
+@author: tagtyk0616
+"""
+
+import numpy as np
+from back_end.station_info import StationTable
+
+
+def get_station_table(latitudes, longitudes):
+    count = len(latitudes)
+    return StationTable([f"device {i}" for i in range(count)],
+                        [f"module {i}" for i in range(count)],
+                        [f"station {i}" for i in range(count)],
+                        latitudes, longitudes)
+
+
+class TestStationTableNearest:
+
+    def test_sorted_by_distance(self):
+        stations = get_station_table([57.9, 57.71, 58.5, 57.75],
+                                     [12.0, 11.97, 12.0, 11.97])
+        stations.save_distances_from(57.70887, 11.97456)
+
+        nearest = stations.nearest(3)
+
+        assert list(nearest.names) == ["station 1", "station 3", "station 0"]
+        assert np.all(np.diff(nearest.distances) >= 0)
+
+    def test_amount_larger_than_the_table(self):
+        stations = get_station_table([57.9, 57.71], [12.0, 11.97])
+        stations.save_distances_from(57.70887, 11.97456)
+
+        nearest = stations.nearest(5)
+
+        assert list(nearest.names) == ["station 1", "station 0"]
+
+    def test_single_station(self):
+        stations = get_station_table([57.9], [12.0])
+        stations.save_distances_from(57.70887, 11.97456)
+
+        assert list(stations.nearest(1).names) == ["station 0"]
+
+    def test_equal_distances_keep_table_order(self):
+        stations = get_station_table([1.0, 0.0, -1.0], [0.0, 1.0, 0.0])
+        stations.save_distances_from(0.0, 0.0)
+
+        assert list(stations.nearest(3).names) \
+            == ["station 0", "station 1", "station 2"]
+
+    def test_across_the_antimeridian(self):
+        stations = get_station_table([0.0, 0.0], [179.0, -179.99])
+        stations.save_distances_from(0.0, 179.99)
+
+        nearest = stations.nearest(2)
+
+        assert list(nearest.names) == ["station 1", "station 0"]
+        np.testing.assert_allclose(nearest.distances[0], 2.22, atol=0.01)
+
+    def test_stations_without_distance_are_last(self):
+        stations = get_station_table([57.9, 57.71, 58.5],
+                                     [12.0, 11.97, 12.0])
+        stations.distances = np.array([20.0, np.nan, 5.0])
+
+        nearest = stations.nearest(2)
+
+        assert list(nearest.names) == ["station 2", "station 0"]